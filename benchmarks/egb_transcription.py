@@ -0,0 +1,98 @@
+"""Before/after benchmark of the egb odds transcription on a recorded odds table.
+
+Compares the generator pipeline of `egb/utils.transcribe_table` with the previous list based
+pipeline, which inserted row break tokens into the token list and then split it into rows.
+Both must produce the same rows. Peak memory is measured while the rows are consumed one at
+a time, without collecting them.
+
+Usage: python benchmarks/egb_transcription.py [--repeat N] [--scale N]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'scrapers', 'egb'), os.path.join(ROOT, 'scrapers')]
+
+import utils  # noqa: E402
+
+
+FIXTURE = os.path.join(ROOT, 'benchmarks', 'fixtures', 'egb_table.txt')
+
+
+def list_transcribe_table(text, scrape_time):
+	"""The previous transcription, with a full token list, row break list and row list."""
+
+	table = text.split('\n')[6:]
+
+	processed, insert_counter = [], 0
+	for tok_idx, token in enumerate(table):
+		if re.search(r'^(\d{1,2}(:\d{1,2}))$', token):
+			processed.insert(tok_idx + insert_counter - 1, 'ROW_BREAK')
+			insert_counter += 1
+		elif token == 'Live!':
+			processed.insert(tok_idx + insert_counter, 'ROW_BREAK')
+			insert_counter += 1
+		processed.append(token)
+	if processed[0] == 'ROW_BREAK':
+		processed.pop(0)
+
+	rows, row = [], []
+	for token in processed:
+		if token == 'ROW_BREAK':
+			rows.append(row)
+			row = []
+			continue
+		row.append(token)
+
+	return [utils.transcribe_row_data(row, scrape_time) for row in rows if len(row) == 7]
+
+
+def enlarge(text, scale):
+	"""Repeat the rows of a table `scale` times."""
+
+	lines = text.split('\n')
+	return '\n'.join(lines[:6] + lines[6:] * scale)
+
+
+def measure(function, text, repeat):
+	"""Fastest run time and peak traced memory of consuming the rows one by one."""
+
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		count = sum(1 for _ in function(text, 0))
+		timings.append(time.perf_counter() - start)
+
+	tracemalloc.start()
+	for _ in function(text, 0):
+		pass
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	return count, min(timings), peak
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--repeat', type=int, default=5, help='runs per implementation, the fastest is reported')
+	parser.add_argument('--scale', type=int, default=100, help='repeat the rows of the table N times')
+	args = parser.parse_args()
+
+	with open(FIXTURE) as f:
+		text = enlarge(f.read(), args.scale)
+
+	if list_transcribe_table(text, 0) != list(utils.transcribe_table(text, 0)):
+		sys.exit('The transcriptions differ.')
+
+	print('%s lines of table text (%s kB)' % (text.count('\n') + 1, len(text) // 1024))
+	for name, function in (('before (token lists)', list_transcribe_table), ('after (generators)', utils.transcribe_table)):
+		count, elapsed, peak = measure(function, text, args.repeat)
+		print('%-22s %8.1f ms  %9.0f rows/s  peak %8.1f kB' % (name, elapsed * 1e3, count / elapsed, peak / 1024.))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,390 @@
+"""End to end benchmark of the scrapers against a local stub of the bookie sites.
+
+A local http server serves the recorded pages of `benchmarks/fixtures` at the paths of the real
+sites, after a configurable latency and jitter. Every scraper is run as its own `scraper.py`
+process with its url variables pointed at the stub and the `DB_*` variables of a local
+database, so a run goes through fetching, rendering, transcription, change detection and the
+database writes like a production run. The wall clock, fetch, browser and database time of
+every run are read from the logs of the scraper, runs which exit with an error or produce no
+rows count as failed.
+
+The ggbet, egb and rivalry pages need the browser tier, so chrome and chromedriver have to be
+installed for them. The hltv pages are served as static html.
+
+With `--backfill-workers N`, N `batch_scraper.py` processes backfill the stub results pages in
+the work queue mode instead, sharing a queue table of their own in the local database. The run
+fails unless every worker exits normally and every offset was stored exactly once.
+
+Usage: DB_HOST=... DB_USER=... DB_PASSWORD=... DB_NAME=... python benchmarks/end_to_end.py
+           [--sites SITE ...] [--runs N] [--concurrency N] [--latency MS] [--jitter MS]
+           [--create-schema] [--truncate] [--output FILE]
+       DB_HOST=... python benchmarks/end_to_end.py --backfill-workers N [--backfill-pages N] [--create-schema]
+       python benchmarks/end_to_end.py --serve [--port PORT]
+"""
+import os
+import re
+import sys
+import ast
+import html
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import psycopg2
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRAPERS = os.path.join(ROOT, 'scrapers')
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+SCHEMA = os.path.join(ROOT, 'benchmarks', 'schema.sql')
+
+
+def read(name):
+	with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+		return f.read()
+
+
+def text_page(title, container, text):
+	"""Page rendering a recorded element text in a container matched by the site's selectors."""
+
+	return '<html><head><title>%s</title></head><body><div %s style="white-space: pre">%s</div></body></html>' % (
+		title, container, html.escape(text))
+
+
+def results_page():
+	"""Hltv results page with the recorded headers and results, one block per line of a result."""
+
+	recorded = json.loads(read('hltv_results.json'))
+	headers = ''.join('<div class="standard-headline">%s</div>' % html.escape(header) for header in recorded['headers'])
+	results = ''.join(
+		'<div class="result">%s</div>' % ''.join('<div>%s</div>' % html.escape(line) for line in result.split('\n'))
+		for result in recorded['results']
+	)
+	return '<html><head><title>Results</title></head><body>%s%s</body></html>' % (headers, results)
+
+
+# path of the page of every site, its url variables and its content
+SITES = {
+	'ggbet': ('/en/counter-strike', ('GGBET_URL',), lambda: text_page('ggbet', 'id="betting__container"', read('ggbet_table_jul.txt'))),
+	'egb': ('/esports/counter-strike', ('EGB_URL',), lambda: text_page('egb', 'class="table-bets"', read('egb_table.txt'))),
+	'rivalry': ('/matches/csgo-betting', ('RIVALRY_URL',), lambda: text_page('rivalry', 'id="__nuxt"', read('rivalry_table.txt'))),
+	'hltv': ('/betting/money', ('HLTV_URL',), lambda: read('hltv_betting.html')),
+	'hltv_results': ('/results', ('HLTV_URL', 'HLTV_BASE_URL'), results_page),
+}
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+	"""Serves the page of every site at its path, any query string included, after a random delay.
+
+	Parameters
+	----------
+	address : tuple
+		Host and port to listen on, port 0 picks a free port.
+	latency : float
+		Seconds every response is delayed.
+	jitter : float
+		Maximum random seconds added to the latency.
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, address=('127.0.0.1', 0), latency=0., jitter=0.):
+		HTTPServer.__init__(self, address, StubHandler)
+		self.latency = latency
+		self.jitter = jitter
+		self.pages = {path: page().encode('utf-8') for path, _, page in SITES.values()}
+		self.requests = 0
+		self._lock = threading.Lock()
+
+	@property
+	def base_url(self):
+		return 'http://%s:%s' % self.server_address[:2]
+
+	def environment(self, site):
+		"""Url variables pointing a scraper at the stub, the results base url takes an offset."""
+
+		path, names, _ = SITES[site]
+		return {name: self.base_url + path + ('?offset=' if name == 'HLTV_BASE_URL' else '') for name in names}
+
+	def delay(self):
+		time.sleep(self.latency + random.uniform(0., self.jitter))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		with self.server._lock:
+			self.server.requests += 1
+		page = self.server.pages.get(urlsplit(self.path).path)
+		self.server.delay()
+		if page is None:
+			self.send_error(404)
+			return
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/html; charset=utf-8')
+		self.send_header('Content-Length', str(len(page)))
+		self.end_headers()
+		self.wfile.write(page)
+
+	def log_message(self, format, *args):  # keep the benchmark output readable
+		pass
+
+
+BACKFILL_QUEUE_TABLE = 'backfill_chunks_e2e'  # queue table of the backfill workers, dropped before every run
+OFFSET_STEP = 100  # results per page, the OFFSET_STEP of hltv_results/config.py
+
+
+# log lines of the scrapers the timings are read from
+FETCHED = re.compile(r'Fetched (\d+) rows of \S+ with the (\w+) tier in ([\d.]+)s, attempts: (.*)$')
+WARMED = re.compile(r'Loaded the last odds of \d+ keys in ([\d.]+)s')
+WROTE = re.compile(r'Wrote (\d+) of \d+ rows to \S+ in ([\d.]+)s')
+
+
+def parse_log(log):
+	"""Read the rows, tier and the fetch, browser and database seconds of a run from its log."""
+
+	stats = {'rows': 0, 'tier': None, 'fetch_s': 0., 'browser_s': 0., 'db_s': 0., 'written': 0}
+	for line in log.splitlines():
+		match = FETCHED.search(line)
+		if match:
+			stats['rows'] += int(match.group(1))
+			stats['tier'] = match.group(2)
+			stats['fetch_s'] += float(match.group(3))
+			attempts = ast.literal_eval(match.group(4))
+			stats['browser_s'] += sum(seconds for tier, seconds, _ in attempts if tier == 'browser')
+			continue
+		match = WARMED.search(line)
+		if match:
+			stats['db_s'] += float(match.group(1))
+			continue
+		match = WROTE.search(line)
+		if match:
+			stats['written'] += int(match.group(1))
+			stats['db_s'] += float(match.group(2))
+
+	return stats
+
+
+def run_scraper(site, env, timeout):
+	"""Run the scraper of a site in its own process. Returns the stats of the run."""
+
+	start = time.time()
+	try:
+		process = subprocess.run(
+			[sys.executable, 'scraper.py'], cwd=os.path.join(SCRAPERS, site), env=env, timeout=timeout,
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True
+		)
+		returncode, log = process.returncode, process.stdout
+	except subprocess.TimeoutExpired as e:
+		returncode, log = 'timeout', e.output or ''
+		log = log.decode('utf-8', 'replace') if isinstance(log, bytes) else log
+	stats = parse_log(log)
+	stats.update({'site': site, 'returncode': returncode, 'wall_s': time.time() - start})
+	stats['ok'] = returncode == 0 and stats['rows'] > 0  # scrapers exit normally after a fetch without rows
+	if not stats['ok']:
+		stats['log'] = log[-2000:]
+
+	return stats
+
+
+def scraper_environment(server, site, spool_dir):
+	env = dict(os.environ)
+	env.update(server.environment(site))
+	env.update({
+		'ENVIRONMENT': 'PRODUCTION',  # only production runs write to the database
+		'SENTRY_URL': '',  # disables sentry
+		'SPOOL_DIR': spool_dir,
+		'PYTHONPATH': SCRAPERS,
+	})
+
+	return env
+
+
+def execute_sql(statements):
+	conn = psycopg2.connect(
+		host=os.environ['DB_HOST'], user=os.environ['DB_USER'], password=os.environ['DB_PASSWORD'], dbname=os.environ['DB_NAME']
+	)
+	with conn, conn.cursor() as cur:
+		cur.execute(statements)
+		rows = cur.fetchall() if cur.description else None
+	conn.close()
+
+	return rows
+
+
+def run_backfill(server, workers, pages, rate, timeout, spool_dir):
+	"""Backfill `pages` stub results pages with workers sharing the work queue. Returns the stats
+	of every worker and the chunks of the queue table per state.
+	"""
+
+	execute_sql('DROP TABLE IF EXISTS %s;' % BACKFILL_QUEUE_TABLE)
+	processes = []
+	for idx in range(workers):
+		env = scraper_environment(server, 'hltv_results', spool_dir)
+		env.update({
+			'BACKFILL_MODE': 'queue', 'WORKER_ID': 'e2e-%s' % idx, 'BACKFILL_QUEUE_TABLE': BACKFILL_QUEUE_TABLE,
+			'BACKFILL_OFFSET_RANGE': '0,%s' % (pages * OFFSET_STEP), 'BACKFILL_RATE': str(rate),
+		})
+		processes.append(subprocess.Popen(
+			[sys.executable, 'batch_scraper.py'], cwd=os.path.join(SCRAPERS, 'hltv_results'), env=env,
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True
+		))
+
+	results, start = [], time.time()
+	for idx, process in enumerate(processes):
+		try:
+			log, returncode = process.communicate(timeout=max(1., timeout - (time.time() - start)))[0], process.returncode
+		except subprocess.TimeoutExpired:
+			process.kill()
+			log, returncode = process.communicate()[0], 'timeout'
+		stats = parse_log(log)
+		pages_fetched = sum(1 for line in log.splitlines() if FETCHED.search(line))
+		stats.update({'worker': 'e2e-%s' % idx, 'returncode': returncode, 'wall_s': time.time() - start, 'pages': pages_fetched})
+		stats['ok'] = returncode == 0
+		if not stats['ok']:
+			stats['log'] = log[-2000:]
+		results.append(stats)
+
+	chunks = execute_sql('SELECT state, COUNT(*), COALESCE(SUM(pages), 0), MAX(attempts) FROM %s GROUP BY state;' % BACKFILL_QUEUE_TABLE)
+
+	return results, {state: {'chunks': count, 'pages': total, 'max_attempts': attempts} for state, count, total, attempts in chunks}
+
+
+def summarize(results):
+	"""Mean timings of the successful runs of every site."""
+
+	summary = {}
+	for site in sorted(set(r['site'] for r in results)):
+		runs = [r for r in results if r['site'] == site]
+		ok = [r for r in runs if r['ok']]
+		summary[site] = {'runs': len(runs), 'failed': len(runs) - len(ok)}
+		for key in ('wall_s', 'fetch_s', 'browser_s', 'db_s', 'rows', 'written'):
+			summary[site][key] = round(statistics.mean(r[key] for r in ok), 3) if ok else None
+		summary[site]['max_wall_s'] = round(max(r['wall_s'] for r in ok), 3) if ok else None
+
+	return summary
+
+
+def print_summary(summary, elapsed, runs):
+	print('%-13s %5s %7s %9s %9s %9s %9s %9s %8s %8s' % (
+		'site', 'runs', 'failed', 'wall s', 'max s', 'fetch s', 'browser s', 'db s', 'rows', 'written'))
+	for site, s in summary.items():
+		if s['wall_s'] is None:
+			print('%-13s %5s %7s' % (site, s['runs'], s['failed']))
+			continue
+		print('%-13s %5s %7s %9.3f %9.3f %9.3f %9.3f %9.3f %8.0f %8.0f' % (
+			site, s['runs'], s['failed'], s['wall_s'], s['max_wall_s'], s['fetch_s'], s['browser_s'], s['db_s'],
+			s['rows'], s['written']))
+	print('\n%s runs in %.1fs, %.1f runs per minute.' % (runs, elapsed, 60. * runs / elapsed if elapsed else 0.))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--sites', nargs='+', choices=sorted(SITES), default=sorted(SITES))
+	parser.add_argument('--runs', type=int, default=3, help='runs of every scraper')
+	parser.add_argument('--concurrency', type=int, default=1, help='scraper processes running at the same time')
+	parser.add_argument('--latency', type=float, default=200., help='milliseconds every response is delayed')
+	parser.add_argument('--jitter', type=float, default=100., help='maximum random milliseconds added to the latency')
+	parser.add_argument('--timeout', type=float, default=300., help='seconds until a run is killed')
+	parser.add_argument('--port', type=int, default=0, help='port of the stub server, a free port by default')
+	parser.add_argument('--serve', action='store_true', help='only serve the stub sites until interrupted')
+	parser.add_argument('--create-schema', action='store_true', help='create the tables of benchmarks/schema.sql')
+	parser.add_argument('--truncate', action='store_true', help='empty the tables first, so that no odds count as unchanged')
+	parser.add_argument('--output', help='json file to write the runs and the summary to')
+	parser.add_argument('--backfill-workers', type=int, default=0, help='backfill the results pages with N queue workers instead')
+	parser.add_argument('--backfill-pages', type=int, default=120, help='results pages of the backfill')
+	parser.add_argument('--backfill-rate', type=float, default=20., help='requests per second of every backfill worker')
+	args = parser.parse_args()
+
+	server = StubServer(('127.0.0.1', args.port), args.latency / 1e3, args.jitter / 1e3)
+	if args.serve:
+		print('Serving the stub sites at %s, point the scrapers at it with:' % server.base_url)
+		for site in sorted(SITES):
+			print('  %-13s %s' % (site, ' '.join('%s=%s' % item for item in sorted(server.environment(site).items()))))
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		return
+
+	missing = [name for name in ('DB_HOST', 'DB_USER', 'DB_PASSWORD', 'DB_NAME') if name not in os.environ]
+	if missing:
+		parser.error('set the variables of the local database: %s' % ', '.join(missing))
+	if args.create_schema:
+		with open(SCHEMA) as f:
+			execute_sql(f.read())
+	if args.truncate:
+		execute_sql('TRUNCATE csgo_winner_odds, csgo_match_results;')
+
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	if args.backfill_workers:
+		main_backfill(server, args)
+		return
+	jobs = [site for _ in range(args.runs) for site in args.sites]
+	with tempfile.TemporaryDirectory() as spool_dir:
+		start = time.time()
+		with ThreadPoolExecutor(args.concurrency) as executor:
+			results = list(executor.map(
+				lambda site: run_scraper(site, scraper_environment(server, site, spool_dir), args.timeout), jobs))
+		elapsed = time.time() - start
+	server.shutdown()
+
+	for site in args.sites:  # the log of the first failed run of every site
+		failed = [result for result in results if result['site'] == site and not result['ok']]
+		if failed:
+			print('A %s run failed (exit code %s, %s rows):\n%s\n' % (site, failed[0]['returncode'], failed[0]['rows'], failed[0]['log']))
+	summary = summarize(results)
+	print_summary(summary, elapsed, len(results))
+	print('The stub served %s requests with %.0f+%.0fms latency.' % (server.requests, args.latency, args.jitter))
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({
+				'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'latency_ms': args.latency, 'jitter_ms': args.jitter,
+				'concurrency': args.concurrency, 'elapsed_s': elapsed, 'summary': summary, 'runs': results,
+			}, f, indent=1)
+
+	sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+
+def main_backfill(server, args):
+	with tempfile.TemporaryDirectory() as spool_dir:
+		start = time.time()
+		results, chunks = run_backfill(server, args.backfill_workers, args.backfill_pages, args.backfill_rate, args.timeout, spool_dir)
+		elapsed = time.time() - start
+	server.shutdown()
+
+	for result in results:
+		if not result['ok']:
+			print('Worker %s failed (exit code %s):\n%s\n' % (result['worker'], result['returncode'], result['log']))
+	print('%-8s %7s %9s %7s %9s %9s' % ('worker', 'exit', 'wall s', 'pages', 'fetch s', 'db s'))
+	for result in results:
+		print('%-8s %7s %9.3f %7s %9.3f %9.3f' % (
+			result['worker'], result['returncode'], result['wall_s'], result['pages'], result['fetch_s'], result['db_s']))
+	stored = sum(state['pages'] for state in chunks.values())
+	fetched = sum(result['pages'] for result in results)
+	print('\nChunks: %s' % chunks)
+	print('%s workers backfilled %s of %s pages in %.1fs (%.1f pages per minute), %s pages fetched in total.' % (
+		len(results), stored, args.backfill_pages, elapsed, 60. * stored / elapsed if elapsed else 0., fetched))
+
+	ok = all(result['ok'] for result in results) and set(chunks) == {'done'} and stored == fetched == args.backfill_pages
+	if not ok:
+		print('The backfill did not store every page exactly once.')
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({
+				'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'latency_ms': args.latency, 'jitter_ms': args.jitter,
+				'workers': args.backfill_workers, 'elapsed_s': elapsed, 'chunks': chunks, 'runs': results,
+			}, f, indent=1)
+	sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,155 @@
+"""Throughput benchmark of the ggbet odds transcription on recorded odds tables.
+
+Compares the single pass row parser of `ggbet/utils.transcribe_table` with the previous
+pipeline, which joined and split the table text several times and searched every row for
+each token it looked up. Both must produce the same rows. The last run reuses the rows of all
+tournaments from a warm parse cache, as a worker does when a page did not change since its last scrape.
+
+Usage: python benchmarks/ggbet_transcription.py [--repeat N] [--scale N]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'scrapers', 'ggbet'), os.path.join(ROOT, 'scrapers')]
+
+import utils  # noqa: E402
+from common.batch import OddsBatch  # noqa: E402
+from common.parsecache import ParseCache  # noqa: E402
+from stopwords import STOPWORDS  # noqa: E402
+
+
+FIXTURES = [os.path.join(ROOT, 'benchmarks', 'fixtures', name) for name in ('ggbet_table_jul.txt', 'ggbet_table_jun.txt')]
+
+
+def idx_search(row, s, exact=False, discard=0):
+	for idx, token in enumerate(row):
+		if (token == s) if exact else (s in token):
+			if discard == 0:
+				return idx
+			discard -= 1
+	return -1
+
+
+def cut_index(row):
+	for idx, token in enumerate(row):
+		if re.search(r'^(\d{1,2}(:\d{1,2}))$', token):
+			return idx
+	return idx_search(row, 'TODAY')
+
+
+def odds(row, bet_type):
+	c1 = c2 = draw = -1
+	if bet_type == 'three-way':
+		x_1, x_2 = idx_search(row, 'X', True), idx_search(row, 'X', True, discard=1)
+		x_idx = x_2 if x_2 != -1 else x_1
+		if x_idx != -1:
+			c1, c2, draw = row[x_idx + 2], row[x_idx + 3], row[x_idx + 4]
+	elif bet_type == 'winner':
+		winner_idx, x_idx = idx_search(row, 'WINNER', True), idx_search(row, 'X', True)
+		if winner_idx != -1:
+			c1, c2 = row[winner_idx + 1], row[winner_idx + 2]
+		elif x_idx != -1:
+			c1, c2 = row[x_idx + 2], row[x_idx + 3]
+	if not (utils.is_number(c1) and utils.is_number(c2) and utils.is_number(draw)):
+		c1 = c2 = draw = -1
+	return c1, c2, draw
+
+
+def string_transcribe_table(text):
+	"""The previous transcription: padding joins, row break tokens and a search per looked up token."""
+
+	tokens = text.split('\n')
+	for idx, token in enumerate(tokens):
+		if token == 'RESULTS':
+			break
+	tokens = '_PADDING_'.join(tokens[idx + 1:]).split('_PADDING_')
+
+	processed, insert = [tokens[0]], False
+	for idx in range(1, len(tokens)):
+		if insert and not utils.is_number(tokens[idx]):
+			insert = False
+			processed.append('_ROW_BREAK_')
+		elif tokens[idx - 1] == 'Over' and tokens[idx] == 'Under':
+			insert = True
+			continue
+		processed.append(tokens[idx])
+	table = '_PADDING_'.join(processed).split('_ROW_BREAK_')
+
+	scrape_time = int(time.time())
+	tournaments, tournament = [], []
+	for row in reversed(table):
+		row = row.split('_PADDING_')
+		tournament.append(row)
+		if utils.get_tournament_name(row[:cut_index(row)], stopwords=STOPWORDS) != 'NA':
+			tournaments.append(tournament)
+			tournament = []
+
+	data = []
+	for tournament in tournaments:
+		for idx, match in enumerate(reversed(tournament)):
+			cut_idx = cut_index(match)
+			if idx == 0:
+				tournament_name = utils.get_tournament_name(match[:cut_idx], stopwords=STOPWORDS)
+				if '1X2' in ''.join(str(s) for s in match):
+					bet_type = 'three-way'
+				elif idx_search(match, 'WINNER', True) != -1:
+					bet_type = 'winner'
+				else:
+					bet_type = 'NA'
+			match_time = utils.get_match_time(match, cut_idx)
+			x_idx = idx_search(match, 'X', True)
+			data.append((match[x_idx - 1], match[x_idx + 1]) + odds(match, bet_type) +
+						(bet_type, scrape_time, match_time, tournament_name, 'ggbet'))
+
+	return list(OddsBatch(data))
+
+
+def enlarge(text, scale):
+	"""Repeat the rows of a table after its header `scale` times."""
+
+	head, sep, body = text.partition('\nRESULTS\n')
+	return head + sep + '\n'.join([body] * scale)
+
+
+def timeit(function, text, repeat):
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		rows = function(text)
+		timings.append(time.perf_counter() - start)
+
+	return rows, min(timings)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--repeat', type=int, default=5, help='runs per implementation, the fastest is reported')
+	parser.add_argument('--scale', type=int, default=1, help='repeat the rows of each table N times')
+	args = parser.parse_args()
+
+	for fixture in FIXTURES:
+		with open(fixture) as f:
+			text = enlarge(f.read(), args.scale)
+
+		before, before_time = timeit(string_transcribe_table, text, args.repeat)
+		after, after_time = timeit(utils.transcribe_table, text, args.repeat)
+		cache = ParseCache()
+		utils.transcribe_table(text, cache)
+		cached, cached_time = timeit(lambda text: utils.transcribe_table(text, cache), text, args.repeat)
+		strip_time = lambda rows: [row[:6] + row[7:] for row in rows]  # noqa: E731
+		if not strip_time(before) == strip_time(after) == strip_time(cached):
+			sys.exit('The transcriptions of %s differ.' % os.path.basename(fixture))
+
+		print('%s: %s rows from %s tokens' % (os.path.basename(fixture), len(after), text.count('\n') + 1))
+		print('  before (string round trips): %8.2f ms  %9.0f rows/s' % (before_time * 1e3, len(before) / before_time))
+		print('  after (single pass parser):  %8.2f ms  %9.0f rows/s' % (after_time * 1e3, len(after) / after_time))
+		print('  after, warm parse cache:      %8.2f ms  %9.0f rows/s' % (cached_time * 1e3, len(cached) / cached_time))
+		print('  speedup: %.1fx, %.1fx with a warm parse cache' % (before_time / after_time, before_time / cached_time))
+
+
+if __name__ == '__main__':
+	main()
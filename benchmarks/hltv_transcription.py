@@ -0,0 +1,129 @@
+"""Before/after benchmark of the hltv odds transcription on a recorded betting page.
+
+Compares the single lxml pass of `hltv/utils.transcribe_data` with the previous transcription,
+which parsed every tournament and every odds cell with its own BeautifulSoup. Both must
+produce the same rows. The last run reuses the rows of all tournaments from a warm parse cache,
+as a worker does when a page did not change since its last scrape.
+
+Usage: python benchmarks/hltv_transcription.py [--repeat N] [--scale N]
+"""
+import os
+import sys
+import time
+import argparse
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'scrapers', 'hltv'), os.path.join(ROOT, 'scrapers')]
+
+import utils  # noqa: E402
+from common.batch import OddsBatch  # noqa: E402
+from config import EXTRACTION  # noqa: E402
+from common.extraction import extract_html  # noqa: E402
+from common.parsecache import ParseCache  # noqa: E402
+
+
+FIXTURE = os.path.join(ROOT, 'benchmarks', 'fixtures', 'hltv_betting.html')
+
+
+def soup_transcribe_data(page):
+	"""The previous transcription, one BeautifulSoup per tournament lookup and per odds cell."""
+
+	def get_bookie_name(html):
+		name = 'Not Found'
+		for html_attr in html.contents:
+			try:
+				class_string = ' '.join(html_attr['class'])
+				if 'betting-list-odds-provider' in class_string:
+					name = class_string.split('-')[-1]
+					break
+			except TypeError:
+				continue
+		return name
+
+	scrape_time = int(time.time())
+	table_data = []
+	num_bookmakers = len(utils.get_book_makers(page['bookmakers']))
+	tournaments = ['<div class="event-header' + s for s in page['html'].split('<div class="event-header')][1:]
+
+	for tournament in tournaments:
+		tournament_name = BeautifulSoup(tournament, 'html.parser').contents[0].contents[0].text
+		team_names = [t.text for t in BeautifulSoup(tournament, 'html.parser').find_all('div', class_='team-name')]
+		bet_types = [b.text for b in BeautifulSoup(tournament, 'html.parser').find_all('div', class_='bet-best-of')]
+		rows = [tok + '/td>' for tok in tournament.split('/td>') if 'odds betting-list-odds' in tok]
+		html_rows = [BeautifulSoup(r, 'html.parser') for r in rows]
+
+		rows_by_team = []
+		for row in html_rows:
+			bookie_name = get_bookie_name(row)
+			if 'hidden' in bookie_name:
+				continue
+			row_idx = len(rows_by_team)
+			rows_by_team.append({
+				'tournament_name': tournament_name,
+				'team_name': team_names[int(row_idx / num_bookmakers)],
+				'bookie_name': bookie_name,
+				'odds': utils.convert_to_number(row.text),
+				'bet_type': bet_types[int(row_idx / (2 * num_bookmakers))]
+			})
+
+		for match_idx, match in enumerate(rows_by_team):
+			if (int(match_idx / num_bookmakers) % 2) != 0:
+				continue
+			other = rows_by_team[match_idx + num_bookmakers]
+			table_data.append((
+				match['team_name'], other['team_name'], match['odds'], other['odds'], -1, match['bet_type'],
+				scrape_time, -1, match['tournament_name'], match['bookie_name'] + ' (hltv)'
+			))
+
+	return table_data
+
+
+def enlarge(html, scale):
+	"""Repeat the tournaments of a page `scale` times to simulate a page with more matches."""
+
+	# the tournament headers and tables are siblings in one container, which is closed right before the page description
+	start = html.index('<div class="event-header')
+	end = html.rindex('</div>', start, html.index('<div class="description-box">'))
+
+	return html[:start] + html[start:end] * scale + html[end:]
+
+
+def timeit(function, page, repeat):
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		rows = function(page)
+		timings.append(time.perf_counter() - start)
+
+	return rows, min(timings)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--repeat', type=int, default=5, help='runs per implementation, the fastest is reported')
+	parser.add_argument('--scale', type=int, default=1, help='repeat the tournaments of the page N times')
+	args = parser.parse_args()
+
+	with open(FIXTURE) as f:
+		html = enlarge(f.read(), args.scale)
+	page = extract_html(html, EXTRACTION)
+
+	before, before_time = timeit(soup_transcribe_data, page, args.repeat)
+	after, after_time = timeit(utils.transcribe_data, page, args.repeat)
+	strip_time = lambda rows: [row[:6] + row[7:] for row in rows]  # noqa: E731
+	cache = ParseCache()
+	utils.transcribe_data(page, cache)
+	cached, cached_time = timeit(lambda page: utils.transcribe_data(page, cache), page, args.repeat)
+	if not strip_time(OddsBatch(before)) == strip_time(after) == strip_time(cached):
+		sys.exit('The transcriptions differ.')
+
+	print('%s rows from %s kB of html' % (len(after), len(html) // 1024))
+	print('before (BeautifulSoup per fragment): %8.1f ms  %8.0f rows/s' % (before_time * 1e3, len(before) / before_time))
+	print('after (single lxml pass):            %8.1f ms  %8.0f rows/s' % (after_time * 1e3, len(after) / after_time))
+	print('after, warm parse cache:             %8.1f ms  %8.0f rows/s' % (cached_time * 1e3, len(cached) / cached_time))
+	print('speedup: %.1fx, %.1fx with a warm parse cache' % (before_time / after_time, before_time / cached_time))
+
+
+if __name__ == '__main__':
+	main()
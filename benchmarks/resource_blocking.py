@@ -0,0 +1,196 @@
+"""Benchmark of the browser resource blocking against a local page server.
+
+The server serves a page shaped like a bookie site: its odds table is rendered by a script from
+a json endpoint, next to images, a web font, a video and two tracker scripts. The tracker
+scripts are served under paths containing their real hosts, so the host patterns of
+`common/resources.py` match them. Every response is delayed by a configurable latency.
+
+The page is loaded in chrome without any blocking, and with the default `ResourcePolicy` of
+the scrapers, with the browser cache disabled like in a fresh container. Requests, downloaded
+bytes and load time are read from the performance log and the savings of the blocked loads are
+printed. The benchmark fails if a blocked load did not render the odds
+table, i.e. if the policy blocked what the table needs. Chrome and chromedriver have to be
+installed.
+
+Usage: python benchmarks/resource_blocking.py [--loads N] [--latency MS] [--cache]
+       python benchmarks/resource_blocking.py --serve [--port PORT]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'scrapers'))
+
+from common.browser import BrowserPool  # noqa: E402
+from common.readiness import wait_until_ready  # noqa: E402
+from common.resources import ResourcePolicy  # noqa: E402
+
+
+ODDS_ROWS = 40
+ODDS_JS = """
+var xhr = new XMLHttpRequest();
+xhr.open('GET', '/api/odds');
+xhr.onload = function () {
+	var table = document.getElementById('odds');
+	JSON.parse(xhr.responseText).forEach(function (row) {
+		var div = document.createElement('div');
+		div.className = 'odds-row';
+		div.textContent = row.join(' ');
+		table.appendChild(div);
+	});
+};
+xhr.send();
+"""
+SITE_CSS = """
+@font-face { font-family: brand; src: url(/static/fonts/brand.woff2) format('woff2'); }
+body { font-family: brand, sans-serif; background: url(/static/img/background.jpg); }
+"""
+PAGE = """<html><head><title>odds</title><link rel="stylesheet" href="/static/site.css">
+<script async src="/t/www.google-analytics.com/analytics.js"></script>
+<script async src="/t/connect.facebook.net/en_US/fbevents.js"></script>
+</head><body>%s<video src="/static/media/intro.mp4" autoplay muted preload="auto"></video>
+<div id="odds"></div><script src="/static/odds.js"></script></body></html>
+""" % ''.join('<img src="/static/img/banner-%s.png">' % idx for idx in range(8))
+
+
+def build_content():
+	"""Content of every path: type and body. Binary resources are random bytes of a typical size."""
+
+	odds = [['team %s' % (2 * idx), 'team %s' % (2 * idx + 1), '1.%02d' % idx, '2.%02d' % idx] for idx in range(ODDS_ROWS)]
+	content = {
+		'/': ('text/html', PAGE.encode('utf-8')),
+		'/static/site.css': ('text/css', SITE_CSS.encode('utf-8')),
+		'/static/odds.js': ('application/javascript', ODDS_JS.encode('utf-8')),
+		'/api/odds': ('application/json', json.dumps(odds).encode('utf-8')),
+		'/static/fonts/brand.woff2': ('font/woff2', os.urandom(80 * 1024)),
+		'/static/img/background.jpg': ('image/jpeg', os.urandom(200 * 1024)),
+		'/static/media/intro.mp4': ('video/mp4', os.urandom(1024 * 1024)),
+		'/t/www.google-analytics.com/analytics.js': ('application/javascript', b'/*' + b'x' * 50 * 1024 + b'*/'),
+		'/t/connect.facebook.net/en_US/fbevents.js': ('application/javascript', b'/*' + b'x' * 90 * 1024 + b'*/'),
+	}
+	for idx in range(8):
+		content['/static/img/banner-%s.png' % idx] = ('image/png', os.urandom(60 * 1024))
+
+	return content
+
+
+class PageServer(ThreadingMixIn, HTTPServer):
+	"""Serves the page and its resources after a fixed delay per response."""
+
+	daemon_threads = True
+
+	def __init__(self, address=('127.0.0.1', 0), latency=0.):
+		HTTPServer.__init__(self, address, PageHandler)
+		self.latency = latency
+		self.content = build_content()
+		self.requests = 0
+		self._lock = threading.Lock()
+
+	@property
+	def base_url(self):
+		return 'http://%s:%s' % self.server_address[:2]
+
+
+class PageHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		with self.server._lock:
+			self.server.requests += 1
+		found = self.server.content.get(urlsplit(self.path).path)
+		time.sleep(self.server.latency)
+		if found is None:
+			self.send_error(404)
+			return
+		kind, body = found
+		self.send_response(200)
+		self.send_header('Content-Type', kind)
+		self.send_header('Content-Length', str(len(body)))
+		self.send_header('Cache-Control', 'max-age=3600')
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+# resource policy of every mode
+MODES = {
+	'unblocked': ResourcePolicy(types=(), baseline_sample=0.),
+	'blocked': ResourcePolicy(allow=('*/static/odds.js', '*/api/*'), baseline_sample=0.),
+}
+
+
+def load(pool, policy, url, cache):
+	"""Load the page once. Returns the requests, blocked requests, bytes, load time and rendered odds rows."""
+
+	with pool.lease() as driver:
+		policy.apply(driver)
+		if not cache:
+			driver.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': True})
+		start = time.time()
+		driver.get(url)
+		load_time = time.time() - start
+		ready = wait_until_ready(driver, '#odds', rows='.odds-row', min_rows=ODDS_ROWS, timeout=10, name='resource_blocking')
+		rows = len(driver.find_elements_by_css_selector('#odds .odds-row'))
+		usage = policy.measure(driver)
+
+	return {
+		'requests': usage.requests, 'blocked': usage.blocked, 'kib': usage.bytes / 1024., 'seconds': load_time,
+		'rows': rows, 'ready': ready.ready, 'blocked_allowed': usage.blocked_allowed,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--loads', type=int, default=5, help='page loads of every mode')
+	parser.add_argument('--latency', type=float, default=50., help='milliseconds every response is delayed')
+	parser.add_argument('--cache', action='store_true', help='keep the browser cache between loads, like a long-running worker')
+	parser.add_argument('--port', type=int, default=0, help='port of the page server, a free port by default')
+	parser.add_argument('--serve', action='store_true', help='only serve the page until interrupted')
+	args = parser.parse_args()
+
+	server = PageServer(('127.0.0.1', args.port), args.latency / 1e3)
+	if args.serve:
+		print('Serving the page at %s/' % server.base_url)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		return
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	results = {}
+	for mode, policy in MODES.items():
+		with BrowserPool(size=1) as pool:
+			pool.start()
+			results[mode] = [load(pool, policy, server.base_url + '/', args.cache) for _ in range(args.loads)]
+	server.shutdown()
+
+	print('%-10s %6s %9s %8s %10s %8s %6s' % ('mode', 'loads', 'requests', 'blocked', 'KiB', 'load s', 'rows'))
+	means = {}
+	for mode, loads in results.items():
+		means[mode] = {key: statistics.mean(result[key] for result in loads) for key in ('requests', 'blocked', 'kib', 'seconds', 'rows')}
+		print('%-10s %6s %9.1f %8.1f %10.1f %8.3f %6.0f' % (
+			mode, len(loads), means[mode]['requests'], means[mode]['blocked'], means[mode]['kib'], means[mode]['seconds'], means[mode]['rows']))
+	unblocked, blocked = means['unblocked'], means['blocked']
+	print('\nBlocking saved %.1f requests, %.1f KiB (%.0f%%) and %.3fs (%.0f%%) of load time per page.' % (
+		unblocked['requests'] - blocked['requests'], unblocked['kib'] - blocked['kib'],
+		100. * (1 - blocked['kib'] / unblocked['kib']) if unblocked['kib'] else 0., unblocked['seconds'] - blocked['seconds'],
+		100. * (1 - blocked['seconds'] / unblocked['seconds']) if unblocked['seconds'] else 0.))
+
+	broken = [result for result in results['blocked'] if not result['ready'] or result['rows'] < ODDS_ROWS or result['blocked_allowed']]
+	if broken:
+		print('%s blocked loads did not render the odds table: %s' % (len(broken), broken[0]))
+	sys.exit(1 if broken else 0)
+
+
+if __name__ == '__main__':
+	main()
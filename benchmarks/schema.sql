@@ -0,0 +1,31 @@
+-- Tables the scrapers write to, for a local database of the end to end benchmark.
+-- psql -f benchmarks/schema.sql, or python benchmarks/end_to_end.py --create-schema
+
+CREATE TABLE IF NOT EXISTS csgo_winner_odds (
+	id SERIAL PRIMARY KEY,
+	team_1 TEXT,
+	team_2 TEXT,
+	team_1_winner_odds REAL,
+	team_2_winner_odds REAL,
+	draw_odds REAL,
+	bet_type TEXT,
+	scrape_time INTEGER,
+	match_time INTEGER,
+	tournament_name TEXT,
+	source TEXT,
+	snapshot_id BIGINT  -- rows of one snapshot of all odds sites, see scrapers/fanout.py
+);
+
+-- last odds per source, loaded by the change detection at startup
+CREATE INDEX IF NOT EXISTS csgo_winner_odds_source_scrape_time ON csgo_winner_odds (source, scrape_time);
+
+CREATE TABLE IF NOT EXISTS csgo_match_results (
+	hash_id TEXT PRIMARY KEY,
+	team_1 TEXT,
+	team_2 TEXT,
+	team_1_score INTEGER,
+	team_2_score INTEGER,
+	tournament TEXT,
+	matchtype TEXT,
+	match_time BIGINT
+);
@@ -0,0 +1,264 @@
+"""Benchmark suite of the transcription code of all five scrapers on recorded pages.
+
+Every case runs a transcribe function or one of its helpers on a page from `benchmarks/fixtures`
+and on synthetic pages with the matches of the recorded page repeated 10 and 100 times. It
+reports rows per second, the peak traced memory, and the memory and number of blocks still
+allocated for the output. The per row time of an enlarged page relative to the recorded page
+shows super-linear behaviour, it stays close to 1 for linear code.
+
+The results can be written to a json file and compared with the file of an earlier commit, the
+comparison fails if a case got slower than the threshold.
+
+Usage: python benchmarks/suite.py [--sites SITE ...] [--scales 1,10,100] [--repeat N]
+                                  [--output FILE] [--compare FILE] [--threshold RATIO]
+"""
+import gc
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import subprocess
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRAPERS = os.path.join(ROOT, 'scrapers')
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+sys.path.insert(0, SCRAPERS)
+
+from common.extraction import extract_html  # noqa: E402
+from common.parsecache import ParseCache  # noqa: E402
+from common.sites import load_site  # noqa: E402
+
+
+SCRAPE_TIME = 1562025600  # fixed, so that no case depends on the clock
+
+
+def read(name):
+	with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+		return f.read()
+
+
+def repeat_between(text, start, end, scale):
+	"""Repeat the part of a text between the start and the end marker `scale` times."""
+
+	start, end = text.index(start) + len(start), text.index(end)
+	return text[:start] + text[start:end] * scale + text[end:]
+
+
+# cases of every site: a function building the input of a case from the page at a scale, and
+# the cases as (name, setup, run), setup turns the input into the argument of run
+def ggbet_cases(utils, config):
+	table = read('ggbet_table_jul.txt')
+
+	def page(scale):
+		head, sep, body = table.partition('\nRESULTS\n')
+		return {'table': head + sep + '\n'.join([body] * scale)}
+
+	def rows(page):
+		return list(utils.iter_rows(utils.iter_table_tokens(page['table'])))
+
+	return page, [
+		('transcribe_page', None, lambda page: utils.transcribe_page(page, scrape_time=SCRAPE_TIME)),
+		('transcribe_table', lambda page: page['table'], lambda text: utils.transcribe_table(text, scrape_time=SCRAPE_TIME)),
+		('iter_rows', lambda page: page['table'], lambda text: list(utils.iter_rows(utils.iter_table_tokens(text)))),
+		('get_odds', rows, lambda rows: [utils.get_odds(row, row.bet_type) for row in rows]),
+	]
+
+
+def egb_cases(utils, config):
+	lines = read('egb_table.txt').split('\n')
+
+	def page(scale):
+		return {'table': '\n'.join(lines[:6] + lines[6:] * scale)}
+
+	def rows(page):
+		return [row for row in utils.iter_rows(itertools.islice(utils.iter_lines(page['table']), 6, None)) if len(row) == 7]
+
+	return page, [
+		('transcribe_page', None, lambda page: utils.transcribe_page(page, scrape_time=SCRAPE_TIME)),
+		('iter_rows', lambda page: page['table'], lambda text: list(utils.iter_rows(itertools.islice(utils.iter_lines(text), 6, None)))),
+		('transcribe_row_data', rows, lambda rows: [utils.transcribe_row_data(row, SCRAPE_TIME) for row in rows]),
+	]
+
+
+def rivalry_cases(utils, config):
+	text = read('rivalry_table.txt')
+
+	def page(scale):
+		return {'table': repeat_between(text, 'Today\n', 'CONNECT WITH US:', scale)}
+
+	return page, [
+		('transcribe_page', None, lambda page: utils.transcribe_page(page, scrape_time=SCRAPE_TIME)),
+		('transcribe_table_data', lambda page: page['table'].split('\n'),
+			lambda table: utils.transcribe_table_data(table, scrape_time=SCRAPE_TIME)),
+	]
+
+
+def hltv_cases(utils, config):
+	html = read('hltv_betting.html')
+	# the tournament headers and tables are siblings in one container, which is closed right before the page description
+	start = html.index('<div class="event-header')
+	end = html.rindex('</div>', start, html.index('<div class="description-box">'))
+
+	def page(scale):
+		return extract_html(html[:start] + html[start:end] * scale + html[end:], config.EXTRACTION)
+
+	def warm_cache(page):
+		cache = ParseCache(max_fragments=10 ** 6)
+		utils.transcribe_data(page, cache, scrape_time=SCRAPE_TIME)
+		return page, cache
+
+	return page, [
+		('transcribe_data', None, lambda page: utils.transcribe_data(page, scrape_time=SCRAPE_TIME)),
+		('transcribe_data (warm parse cache)', warm_cache, lambda args: utils.transcribe_data(args[0], args[1], SCRAPE_TIME)),
+		('get_tournaments', lambda page: page['html'], utils.get_tournaments),
+		('iter_fragments', lambda page: page['html'], lambda html: list(utils.iter_fragments(html))),
+	]
+
+
+def hltv_results_cases(utils, config):
+	recorded = json.loads(read('hltv_results.json'))
+
+	def page(scale):
+		return {'headers': recorded['headers'], 'results': recorded['results'] * scale}
+
+	return page, [
+		('transcribe_page', None, utils.transcribe_page),
+		('transcribe_table_data', lambda page: page['results'], lambda results: utils.transcribe_table_data(results, SCRAPE_TIME)),
+		('calc_average_header_date', lambda page: page['headers'], lambda headers: [utils.calc_average_header_date(headers)]),
+	]
+
+
+SITES = {
+	'ggbet': ggbet_cases,
+	'egb': egb_cases,
+	'rivalry': rivalry_cases,
+	'hltv': hltv_cases,
+	'hltv_results': hltv_results_cases,
+}
+
+
+def measure(run, arg, repeat):
+	"""Fastest run time, and the peak, retained memory and retained blocks of one traced run."""
+
+	timings = []
+	for _ in range(repeat):
+		gc.collect()
+		start = time.perf_counter()
+		output = run(arg)
+		timings.append(time.perf_counter() - start)
+		rows = len(output)
+		del output
+
+	gc.collect()
+	tracemalloc.start()
+	output = run(arg)
+	retained, peak = tracemalloc.get_traced_memory()
+	blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+	tracemalloc.stop()
+	del output
+
+	return rows, min(timings), peak, retained, blocks
+
+
+def run_suite(sites, scales, repeat):
+	results = []
+	for site in sites:
+		page, cases = SITES[site](*load_site(site, ('utils', 'config')))
+		for scale in scales:
+			payload = page(scale)
+			input_bytes = len(json.dumps(payload))
+			for name, setup, run in cases:
+				arg = setup(payload) if setup else payload
+				rows, seconds, peak, retained, blocks = measure(run, arg, repeat)
+				results.append({
+					'site': site, 'case': name, 'scale': scale, 'rows': rows, 'input_kb': round(input_bytes / 1024., 1),
+					'seconds': seconds, 'rows_per_s': rows / seconds if seconds else None,
+					'peak_kb': round(peak / 1024., 1), 'retained_kb': round(retained / 1024., 1), 'retained_blocks': blocks,
+				})
+
+	# per row time against the smallest scale of the same case
+	base = {}
+	for result in results:
+		key = (result['site'], result['case'])
+		per_row = result['seconds'] / max(result['rows'], 1)
+		base.setdefault(key, per_row)
+		result['per_row_vs_base'] = round(per_row / base[key], 2) if base[key] else None
+
+	return results
+
+
+def print_results(results):
+	print('%-13s %-36s %5s %7s %10s %12s %10s %11s %8s %8s' % (
+		'site', 'case', 'scale', 'rows', 'ms', 'rows/s', 'peak kB', 'retained kB', 'blocks', 'per row'))
+	for r in results:
+		print('%-13s %-36s %4sx %7s %10.3f %12.0f %10.1f %11.1f %8s %7.2fx%s' % (
+			r['site'], r['case'], r['scale'], r['rows'], r['seconds'] * 1e3, r['rows_per_s'] or 0, r['peak_kb'],
+			r['retained_kb'], r['retained_blocks'], r['per_row_vs_base'] or 0,
+			'  super-linear?' if (r['per_row_vs_base'] or 0) > 2 else ''))
+
+
+def compare(results, baseline, threshold):
+	"""Print the cases which got slower or faster than the threshold. Returns the number of regressions."""
+
+	previous = {(r['site'], r['case'], r['scale']): r for r in baseline['results']}
+	regressions = 0
+	print('\nCompared with %s (%s):' % (baseline.get('commit'), baseline.get('created')))
+	for r in results:
+		old = previous.get((r['site'], r['case'], r['scale']))
+		if old is None:
+			continue
+		ratio = r['seconds'] / old['seconds'] if old['seconds'] else 1.
+		if ratio > threshold:
+			regressions += 1
+			print('  slower  %5.2fx  %s %s %sx' % (ratio, r['site'], r['case'], r['scale']))
+		elif ratio < 1. / threshold:
+			print('  faster  %5.2fx  %s %s %sx' % (1. / ratio, r['site'], r['case'], r['scale']))
+	if not regressions:
+		print('  no case is more than %.2fx slower.' % threshold)
+
+	return regressions
+
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--sites', nargs='+', choices=sorted(SITES), default=list(SITES))
+	parser.add_argument('--scales', default='1,10,100', help='comma separated page enlargements')
+	parser.add_argument('--repeat', type=int, default=5, help='timed runs per case, the fastest is reported')
+	parser.add_argument('--output', help='json file to write the results to')
+	parser.add_argument('--compare', help='json results of an earlier run to compare with')
+	parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio counted as a regression')
+	args = parser.parse_args()
+
+	results = run_suite(args.sites, [int(scale) for scale in args.scales.split(',')], args.repeat)
+	print_results(results)
+
+	report = {
+		'commit': git_commit(),
+		'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'repeat': args.repeat,
+		'results': results,
+	}
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=1)
+	if args.compare:
+		with open(args.compare) as f:
+			if compare(results, json.load(f), args.threshold):
+				sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,253 @@
+import math
+from array import array
+
+
+STRING, FLOAT, INT = 'string', 'float', 'int'
+
+
+def to_float(value):
+	"""Convert an odds value to a float. None is stored as nan, values which are not numbers as -1."""
+
+	if value is None:
+		return math.nan
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return -1.
+
+
+def escape_copy(value):
+	return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class StringColumn:
+	"""Dictionary encoded strings: every distinct value is stored once and rows hold its code."""
+
+	def __init__(self):
+		self.values = []
+		self.index = {}
+		self.codes = array('l')
+
+	def append(self, value):
+		code = self.index.get(value)
+		if code is None:
+			code = self.index[value] = len(self.values)
+			self.values.append(value)
+		self.codes.append(code)
+
+	def extend_column(self, other):
+		"""Append the rows of another string column, mapping its codes to the codes of this column."""
+
+		mapping = []
+		for value in other.values:
+			code = self.index.get(value)
+			if code is None:
+				code = self.index[value] = len(self.values)
+				self.values.append(value)
+			mapping.append(code)
+		self.codes.extend(mapping[code] for code in other.codes)
+
+	def fill(self, value, count):
+		self.values, self.index = [value], {value: 0}
+		self.codes = array('l', [0]) * count
+
+	def get(self, idx):
+		return self.values[self.codes[idx]]
+
+	def select(self, indices):
+		"""Get a column of the rows at the given indices, sharing the dictionary of this column."""
+
+		column = StringColumn()
+		column.values, column.index = list(self.values), dict(self.index)
+		column.codes = array('l', (self.codes[idx] for idx in indices))
+
+		return column
+
+	def __len__(self):
+		return len(self.codes)
+
+	def __iter__(self):
+		values = self.values
+		return (values[code] for code in self.codes)
+
+	def copy_values(self):
+		# escape every distinct value once
+		escaped = ['\\N' if value is None else escape_copy(str(value)) for value in self.values]
+		return (escaped[code] for code in self.codes)
+
+
+class NumberColumn:
+	"""Numbers in a typed array, doubles for odds and 64 bit integers for timestamps and scores."""
+
+	def __init__(self, kind):
+		self.kind = kind
+		self.data = array('d' if kind == FLOAT else 'q')
+
+	def append(self, value):
+		self.data.append(to_float(value) if self.kind == FLOAT else value)
+
+	def extend_column(self, other):
+		self.data.extend(other.data)
+
+	def fill(self, value, count):
+		self.data = array(self.data.typecode, [to_float(value) if self.kind == FLOAT else value]) * count
+
+	def get(self, idx):
+		value = self.data[idx]
+		return None if value != value else value  # nan is NULL
+
+	def select(self, indices):
+		column = NumberColumn(self.kind)
+		column.data = array(self.data.typecode, (self.data[idx] for idx in indices))
+
+		return column
+
+	def __len__(self):
+		return len(self.data)
+
+	def __iter__(self):
+		if self.kind == FLOAT:
+			return (None if value != value else value for value in self.data)  # nan is NULL
+		return iter(self.data)
+
+	def copy_values(self):
+		if self.kind == FLOAT:
+			return ('\\N' if value != value else repr(value) for value in self.data)
+		return (str(value) for value in self.data)
+
+
+class Batch:
+	"""Rows of a fixed schema stored in columns.
+
+	Strings are dictionary encoded and numbers are stored in typed arrays, so repeated team,
+	tournament and source names take no space per row. A batch iterates, indexes and slices
+	like a list of row tuples, and can be written with COPY without building the tuples.
+	Subclasses define the `columns` and their `types`.
+
+	Parameters
+	----------
+	rows : iterable
+		Row tuples or a batch of the same type to start with.
+	"""
+
+	columns = ()
+	types = ()
+
+	def __init__(self, rows=()):
+		self._columns = [StringColumn() if kind == STRING else NumberColumn(kind) for kind in self.types]
+		self.extend(rows)
+
+	def append(self, row):
+		for column, value in zip(self._columns, row):
+			column.append(value)
+
+	def extend(self, rows, defaults=None):
+		"""Append row tuples in the order of `columns`, or the rows of another batch.
+
+		The columns of a batch are matched by name. Columns the batch does not have are set to their
+		value in `defaults`, and a column which is missing on either side without a default is an error.
+		"""
+
+		if isinstance(rows, Batch):
+			defaults = defaults or {}
+			problems = []
+			unknown = [name for name in rows.columns if name not in self.columns]
+			if unknown:
+				problems.append('unknown columns %s' % ', '.join(unknown))
+			missing = [name for name in self.columns if name not in rows.columns and name not in defaults]
+			if missing:
+				problems.append('no values of %s' % ', '.join(missing))
+			if problems:
+				raise ValueError('Can not extend a %s with a %s: %s.' % (type(self).__name__, type(rows).__name__, '; '.join(problems)))
+			for name, column in zip(self.columns, self._columns):
+				if name in rows.columns:
+					column.extend_column(rows._columns[rows.columns.index(name)])
+				else:
+					other = StringColumn() if isinstance(column, StringColumn) else NumberColumn(column.kind)
+					other.fill(defaults[name], len(rows))
+					column.extend_column(other)
+		else:
+			for row in rows:
+				self.append(row)
+
+	def __len__(self):
+		return len(self._columns[0]) if self._columns else 0
+
+	def __iter__(self):
+		return zip(*self._columns)
+
+	def __add__(self, other):
+		batch = type(self)(self)
+		batch.extend(other)
+
+		return batch
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			return self.select(range(*key.indices(len(self))))
+
+		return tuple(column.get(key) for column in self._columns)
+
+	def __repr__(self):
+		return '%s(%s rows)' % (type(self).__name__, len(self))
+
+	def select(self, indices):
+		"""Get a batch of the rows at the given indices."""
+
+		indices = list(indices)
+		batch = type(self)()
+		batch._columns = [column.select(indices) for column in self._columns]
+
+		return batch
+
+	def fill(self, name, value):
+		"""Set the column `name` to `value` in every row."""
+
+		self._columns[self.columns.index(name)].fill(value, len(self))
+
+	def column(self, name):
+		"""Get the values of a column as a list."""
+
+		return list(self._columns[self.columns.index(name)])
+
+	def copy_lines(self):
+		"""Yield the rows as lines in the text format of COPY, in the order of `columns`."""
+
+		for values in zip(*(column.copy_values() for column in self._columns)):
+			yield '\t'.join(values) + '\n'
+
+	def nbytes(self):
+		"""Approximate memory of the column data, strings counted once per distinct value."""
+
+		total = 0
+		for column in self._columns:
+			if isinstance(column, StringColumn):
+				total += column.codes.itemsize * len(column.codes) + sum(len(value or '') for value in column.values)
+			else:
+				total += column.data.itemsize * len(column.data)
+
+		return total
+
+
+class OddsBatch(Batch):
+	"""Rows of the csgo_winner_odds table."""
+
+	columns = (
+		'team_1', 'team_2', 'team_1_winner_odds', 'team_2_winner_odds', 'draw_odds', 'bet_type', 'scrape_time',
+		'match_time', 'tournament_name', 'source'
+	)
+	types = (STRING, STRING, FLOAT, FLOAT, FLOAT, STRING, INT, INT, STRING, STRING)
+
+
+class SnapshotOddsBatch(OddsBatch):
+	"""Rows of the csgo_winner_odds table scraped in one snapshot of all odds sites, see fanout.py."""
+
+	columns = OddsBatch.columns + ('snapshot_id',)
+	types = OddsBatch.types + (INT,)
+
+
+class ResultsBatch(Batch):
+	"""Rows of the csgo_match_results table."""
+
+	columns = ('hash_id', 'team_1', 'team_2', 'team_1_score', 'team_2_score', 'tournament', 'matchtype', 'match_time')
+	types = (STRING, STRING, STRING, INT, INT, STRING, STRING, INT)
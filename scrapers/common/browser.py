@@ -0,0 +1,380 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from collections import Counter, deque
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+
+logger = logging.getLogger(__name__)
+
+
+CHROME_ARGUMENTS = ('--headless', '--no-sandbox', '--disable-dev-shm-usage')
+CHROME_PREFS = {  # browser features no scraper needs, resources are blocked per site, see common/resources.py
+	'profile.managed_default_content_settings.notifications': 2,
+	'profile.managed_default_content_settings.plugins': 2,
+	'profile.managed_default_content_settings.geolocation': 2,
+}
+
+
+def build_chrome_options(arguments=CHROME_ARGUMENTS, prefs=CHROME_PREFS):
+	"""Build the headless chrome options shared by all scrapers.
+
+	The network requests of every page are logged to the performance log, from which
+	`common.resources` counts the requests and bytes of a load.
+	"""
+
+	chrome_options = webdriver.ChromeOptions()
+	for argument in arguments:
+		chrome_options.add_argument(argument)
+	if prefs:
+		chrome_options.add_experimental_option('prefs', dict(prefs))
+	chrome_options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+	chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+
+	return chrome_options
+
+
+MAX_PAGES = 100  # pages served by a session before it is recycled
+MAX_RSS_MB = 1024  # resident memory of the chrome process tree of a session before it is recycled
+PAGE_LOAD_TIMEOUT = 60  # seconds until a navigation counts as stuck, its session is recycled
+
+
+def launch_chrome(prefs=CHROME_PREFS):
+	"""Launch a new headless chrome session."""
+
+	return webdriver.Chrome(options=build_chrome_options(prefs=prefs))
+
+
+def driver_pid(driver):
+	"""Pid of the chromedriver process of a session, None if it is unknown."""
+
+	process = getattr(getattr(driver, 'service', None), 'process', None)
+
+	return getattr(process, 'pid', None)
+
+
+def process_tree_rss(pid):
+	"""Resident memory in bytes of a process and all its descendants, read from /proc. Returns
+	None where /proc is not available.
+	"""
+
+	children = {}
+	try:
+		pids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+	except OSError:
+		return None
+	for child in pids:
+		try:
+			with open('/proc/%s/stat' % child) as f:
+				# the command name in parentheses can contain spaces, the fields after it can not
+				ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+		except (OSError, IndexError, ValueError):  # the process exited
+			continue
+		children.setdefault(ppid, []).append(child)
+
+	page_size, total, stack = os.sysconf('SC_PAGE_SIZE'), 0, [pid]
+	while stack:
+		current = stack.pop()
+		try:
+			with open('/proc/%s/statm' % current) as f:
+				total += int(f.read().split()[1]) * page_size
+		except (OSError, IndexError, ValueError):
+			continue
+		stack.extend(children.get(current, ()))
+
+	return total
+
+
+class SessionHealth:
+	"""Pages served and recent lease times of a chrome session."""
+
+	def __init__(self, window=10):
+		self.launched_at = time.time()
+		self.pages = 0
+		self.first = []  # lease times of the first pages
+		self.recent = deque(maxlen=window)
+		self.window = window
+
+	def record(self, elapsed):
+		self.pages += 1
+		if len(self.first) < self.window:
+			self.first.append(elapsed)
+		self.recent.append(elapsed)
+
+	def summary(self):
+		mean = lambda values: round(sum(values) / len(values), 3) if values else 0.
+		return {
+			'pages': self.pages,
+			'age': round(time.time() - self.launched_at, 1),
+			'first_lease_time': mean(self.first),
+			'recent_lease_time': mean(self.recent),
+		}
+
+
+class PoolStats:
+	"""Timing statistics of a browser pool. All times are in seconds."""
+
+	def __init__(self):
+		self.launches = 0
+		self.launch_time = 0.
+		self.leases = 0
+		self.warm_leases = 0
+		self.lease_wait_time = 0.
+		self.resets = 0
+		self.reset_time = 0.
+		self.reset_failures = 0
+		self.recycles = Counter()  # reason -> recycled sessions
+		self._lock = threading.Lock()
+
+	def record_launch(self, elapsed):
+		with self._lock:
+			self.launches += 1
+			self.launch_time += elapsed
+
+	def record_lease(self, elapsed, warm):
+		with self._lock:
+			self.leases += 1
+			self.warm_leases += int(warm)
+			self.lease_wait_time += elapsed
+
+	def record_reset(self, elapsed, failed=False):
+		with self._lock:
+			self.resets += 1
+			self.reset_time += elapsed
+			self.reset_failures += int(failed)
+
+	def record_recycle(self, reason):
+		with self._lock:
+			self.recycles[reason] += 1
+
+	def summary(self):
+		"""Summarize the stats, including the launch time saved by handing out warm sessions."""
+
+		with self._lock:
+			avg_launch_time = self.launch_time / self.launches if self.launches else 0.
+			return {
+				'launches': self.launches,
+				'avg_launch_time': round(avg_launch_time, 3),
+				'leases': self.leases,
+				'warm_leases': self.warm_leases,
+				'avg_lease_wait_time': round(self.lease_wait_time / self.leases, 3) if self.leases else 0.,
+				'resets': self.resets,
+				'reset_failures': self.reset_failures,
+				'avg_reset_time': round(self.reset_time / self.resets, 3) if self.resets else 0.,
+				'launch_time_saved': round(self.warm_leases * avg_launch_time - self.reset_time, 3),
+				'recycles': dict(self.recycles),
+			}
+
+
+class BrowserPool:
+	"""Keeps a number of warm headless chrome sessions alive and leases them to scrape jobs.
+
+	Sessions are launched lazily the first time a slot is leased (or eagerly with `start`) and
+	are reset after every lease, so the next job starts from a blank tab without cookies or
+	storage. Sessions that fail to reset are quit and relaunched on their next lease.
+
+	Renderer memory grows with every page a session serves, so sessions are recycled, i.e. quit
+	and relaunched on their next lease, after `max_pages` leases, once the resident memory of
+	their chrome process tree exceeds `max_rss_mb`, and after a lease which raised, such as a
+	navigation which did not finish within `page_load_timeout` or a dead chromedriver. All
+	sessions are quit when the pool is closed, at the latest when the interpreter exits.
+
+	Parameters
+	----------
+	size : int
+		Maximum number of concurrent chrome sessions.
+	launcher : callable
+		Function returning a new webdriver instance.
+	max_pages : int
+		Leases after which a session is recycled, never if None.
+	max_rss_mb : float
+		Resident memory in MiB of a session's processes after which it is recycled, never if None.
+	page_load_timeout : float
+		Seconds until a navigation raises a TimeoutException, not set if None.
+	"""
+
+	def __init__(self, size=1, launcher=launch_chrome, max_pages=MAX_PAGES, max_rss_mb=MAX_RSS_MB,
+				 page_load_timeout=PAGE_LOAD_TIMEOUT):
+		self.size = size
+		self.launcher = launcher
+		self.max_pages = max_pages
+		self.max_rss_mb = max_rss_mb
+		self.page_load_timeout = page_load_timeout
+		self.stats = PoolStats()
+		self._idle = queue.LifoQueue()  # most recently used session first, keeps caches hot
+		self._drivers = set()
+		self._health = {}  # driver -> SessionHealth
+		self._lock = threading.Lock()
+		self._closed = False
+		for _ in range(size):
+			self._idle.put(None)  # empty slot, launched on demand
+		atexit.register(self.close)  # chrome outlives the interpreter otherwise
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def start(self):
+		"""Launch all sessions upfront so that the first leases are warm."""
+
+		slots = [self._idle.get() for _ in range(self.size)]
+		for idx, driver in enumerate(slots):
+			if driver is None:
+				slots[idx] = self._launch()
+		for driver in slots:
+			self._idle.put(driver)
+
+		return self
+
+	def _launch(self):
+		start = time.time()
+		driver = self.launcher()
+		self.stats.record_launch(time.time() - start)
+		with self._lock:
+			self._drivers.add(driver)
+			self._health[driver] = SessionHealth()
+		if self.page_load_timeout is not None:
+			try:
+				driver.set_page_load_timeout(self.page_load_timeout)
+			except (AttributeError, WebDriverException):
+				logger.warning('Failed to set the page load timeout of a chrome session.')
+		logger.debug('Launched chrome session in %.2fs.', time.time() - start)
+
+		return driver
+
+	def _discard(self, driver):
+		with self._lock:
+			self._drivers.discard(driver)
+			self._health.pop(driver, None)
+		try:
+			driver.quit()
+		except Exception as e:  # a crashed chrome or chromedriver, the slot is relaunched anyway
+			logger.warning('Failed to quit chrome session: %r', e)
+
+	def _recycle_reason(self, driver, health):
+		"""Why a session should be recycled after a lease, None if it stays."""
+
+		if self.max_pages is not None and health.pages >= self.max_pages:
+			return 'pages'
+		if self.max_rss_mb is not None:
+			pid = driver_pid(driver)
+			rss = process_tree_rss(pid) if pid is not None else None
+			if rss is not None and rss > self.max_rss_mb * 1024 * 1024:
+				return 'memory'
+
+		return None
+
+	def _recycle(self, driver, reason):
+		health = self._health.get(driver)
+		logger.info('Recycling a chrome session (%s): %s', reason, health.summary() if health is not None else {})
+		self.stats.record_recycle(reason)
+		self._discard(driver)
+
+	@contextmanager
+	def lease(self, timeout=None):
+		"""Lease a chrome session for the duration of a with block.
+
+		Parameters
+		----------
+		timeout : float
+			Seconds to wait for a free session. Waits indefinitely if None.
+		"""
+
+		if self._closed:
+			raise RuntimeError('Browser pool is closed.')
+
+		start = time.time()
+		try:
+			driver = self._idle.get(timeout=timeout)
+		except queue.Empty:
+			raise TimeoutError('No browser session available after %ss.' % timeout)
+
+		warm = driver is not None
+		try:
+			if not warm:
+				driver = self._launch()
+		except Exception:
+			self._idle.put(None)
+			raise
+		self.stats.record_lease(time.time() - start, warm)
+
+		start, failed = time.time(), False
+		try:
+			yield driver
+		except Exception:  # e.g. the TimeoutException of a stuck navigation or a dead chromedriver
+			failed = True
+			raise
+		finally:
+			self._release(driver, time.time() - start, failed)
+
+	def _release(self, driver, elapsed=0., failed=False):
+		slot = None  # the slot is returned empty unless the session is kept, so it is never lost
+		try:
+			if self._closed:
+				self._discard(driver)
+				return
+
+			health = self._health.get(driver)
+			if health is not None:
+				health.record(elapsed)
+			# a session whose lease failed may be hung, it is not reset but replaced
+			reason = 'failure' if failed else self._recycle_reason(driver, health) if health is not None else None
+			if reason is not None:
+				self._recycle(driver, reason)
+				return
+
+			start = time.time()
+			try:
+				self.reset(driver)
+				self.stats.record_reset(time.time() - start)
+				slot = driver
+			except Exception as e:  # a webdriver error, or a connection error of a dead chromedriver
+				logger.warning('Failed to reset chrome session, relaunching on next lease: %r', e)
+				self.stats.record_reset(time.time() - start, failed=True)
+				self._discard(driver)
+		finally:
+			self._idle.put(slot)
+
+	@staticmethod
+	def reset(driver):
+		"""Reset a session to a blank tab without cookies, storage, blocked urls or leftover windows."""
+
+		handles = driver.window_handles
+		for handle in handles[1:]:
+			driver.switch_to.window(handle)
+			driver.close()
+		driver.switch_to.window(handles[0])
+		try:
+			driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+		except WebDriverException:  # storage is not accessible on some pages, e.g. about:blank
+			pass
+		driver.delete_all_cookies()
+		try:  # the resource policy of the last site must not apply to the next one
+			driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': []})
+		except (AttributeError, WebDriverException):
+			pass
+		driver.get('about:blank')
+		try:  # release renderer memory, not supported by every driver version
+			driver.execute_cdp_cmd('HeapProfiler.collectGarbage', {})
+		except (AttributeError, WebDriverException):
+			pass
+
+	def close(self):
+		"""Quit all chrome sessions of the pool, leased sessions included. Closing twice does nothing."""
+
+		if self._closed:
+			return
+		self._closed = True
+		atexit.unregister(self.close)
+		with self._lock:
+			drivers = list(self._drivers)
+		for driver in drivers:
+			self._discard(driver)
+		logger.info('Closed browser pool: %s', self.stats.summary())
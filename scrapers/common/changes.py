@@ -0,0 +1,148 @@
+import time
+import logging
+import psycopg2
+
+from common.batch import OddsBatch
+from common.db import ODDS_TABLE
+from common.metrics import METRICS
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFilter:
+	"""Suppresses odds rows whose odds did not move since they were last written.
+
+	Rows are keyed by (source, team_1, team_2, bet_type, match_time). A row is emitted if its
+	key is new, if its odds differ from the last emitted odds of the key, or as a heartbeat if
+	the key was last emitted `heartbeat` seconds ago, so gaps in the data stay detectable.
+	Keys which were not seen for `ttl` seconds are evicted. Times are the scrape times of the
+	rows.
+
+	Parameters
+	----------
+	ttl : float
+		Seconds after which a key which was not seen anymore is evicted.
+	heartbeat : float
+		Seconds after which unchanged odds are emitted again.
+	name : str
+		Site whose rows are filtered, the filter time is recorded in the metrics under it.
+	metrics : Metrics
+		Metrics to record the filter time in, if a name is given.
+	"""
+
+	def __init__(self, ttl=24 * 3600., heartbeat=3600., name=None, metrics=METRICS):
+		self.ttl = ttl
+		self.heartbeat = heartbeat
+		self.name = name
+		self.metrics = metrics
+		self.stats = {}
+		self.moved = 0  # rows emitted because their odds moved, over the life of the filter
+		self.warmed = set()  # sources loaded from the database
+		self._cache = {}  # key -> [odds, emitted_at, seen_at]
+
+	def __len__(self):
+		return len(self._cache)
+
+	@staticmethod
+	def key(row):
+		return row[9], row[0], row[1], row[5], row[7]
+
+	@staticmethod
+	def odds(team_1_odds, team_2_odds, draw_odds):
+		# odds are read back from real columns, compare them at a precision both sides agree on
+		return tuple(None if odds is None else round(odds, 4) for odds in (team_1_odds, team_2_odds, draw_odds))
+
+	def warm(self, db_credentials, sources, now=None):
+		"""Load the last written odds of the given sources from the database. Sources which were
+		already loaded are skipped, so a long-running worker only loads new sources.
+
+		Returns the number of loaded keys. The cache stays as it is if the database is unavailable,
+		in which case all rows are emitted.
+		"""
+
+		sources = set(sources) - self.warmed
+		if not sources:
+			return 0
+		now = time.time() if now is None else now
+		conn, start = None, time.time()
+		try:
+			conn = psycopg2.connect(**db_credentials)
+			with conn.cursor() as cursor:
+				cursor.execute("""
+					SELECT DISTINCT ON (source, team_1, team_2, bet_type, match_time)
+						source, team_1, team_2, bet_type, match_time,
+						team_1_winner_odds, team_2_winner_odds, draw_odds, scrape_time
+					FROM %s
+					WHERE source = ANY(%%s) AND scrape_time >= %%s
+					ORDER BY source, team_1, team_2, bet_type, match_time, scrape_time DESC;
+				""" % ODDS_TABLE, (list(sources), now - self.ttl))
+				rows = cursor.fetchall()
+		except psycopg2.Error as e:
+			logger.error('Failed to load the last odds from the database, no rows are suppressed: %s', e)
+			return 0
+		finally:
+			if conn is not None:
+				conn.close()
+
+		for row in rows:
+			key, emitted_at = row[:5], row[8]
+			cached = self._cache.get(key)
+			if cached is None or cached[1] < emitted_at:
+				self._cache[key] = [self.odds(*row[5:8]), emitted_at, emitted_at]
+		self.warmed.update(sources)
+		logger.info('Loaded the last odds of %s keys in %.3fs.', len(rows), time.time() - start)
+
+		return len(rows)
+
+	def evict(self, now=None):
+		"""Drop keys which were not seen for `ttl` seconds. Returns the number of dropped keys."""
+
+		now = time.time() if now is None else now
+		expired = [key for key, cached in self._cache.items() if now - cached[2] > self.ttl]
+		for key in expired:
+			del self._cache[key]
+
+		return len(expired)
+
+	def filter(self, rows, now=None):
+		"""Get the rows whose odds moved or which are due for a heartbeat, and remember their odds.
+		Keys are evicted relative to `now`, which defaults to the current time.
+		"""
+
+		with self.metrics.time(self.name, 'dedup'):
+			return self._filter(rows, now)
+
+	def _filter(self, rows, now):
+		if not isinstance(rows, OddsBatch):
+			rows = OddsBatch(rows)  # odds as floats
+
+		emitted, heartbeats = [], 0
+		for idx, row in enumerate(rows):
+			key, odds, scrape_time = self.key(row), self.odds(*row[2:5]), row[6]
+			cached = self._cache.get(key)
+			if cached is None or cached[0] != odds:
+				self._cache[key] = [odds, scrape_time, scrape_time]
+				emitted.append(idx)
+			elif scrape_time - cached[1] >= self.heartbeat:
+				cached[1] = cached[2] = scrape_time
+				emitted.append(idx)
+				heartbeats += 1
+			else:
+				cached[2] = max(cached[2], scrape_time)
+		evicted = self.evict(now)
+
+		suppressed = len(rows) - len(emitted)
+		self.moved += len(emitted) - heartbeats
+		self.stats = {
+			'rows': len(rows),
+			'emitted': len(emitted),
+			'heartbeats': heartbeats,
+			'suppressed': suppressed,
+			'suppressed_pct': 100. * suppressed / len(rows) if rows else 0.,
+			'evicted': evicted,
+		}
+		logger.info('Suppressed %s of %s rows with unchanged odds (%.1f%%), emitting %s rows including %s heartbeats.',
+					suppressed, len(rows), self.stats['suppressed_pct'], len(emitted), heartbeats)
+
+		return rows.select(emitted)
@@ -0,0 +1,414 @@
+import io
+import time
+import logging
+import threading
+import psycopg2
+
+from common.batch import Batch, OddsBatch, ResultsBatch
+from common.metrics import METRICS, STAGES
+
+logger = logging.getLogger(__name__)
+
+
+ODDS_TABLE = 'csgo_winner_odds'
+RESULTS_TABLE = 'csgo_match_results'
+RESULTS_CONFLICT = ('hash_id',)
+RESULTS_UPDATE = ('match_time',)
+SCRAPE_RUNS_TABLE = 'scrape_runs'
+SNAPSHOT_COLUMN = 'snapshot_id'  # odds rows of a snapshot of all odds sites, NULL for rows of single site scrapes
+
+
+class WriteResult:
+	"""Number of rows written by one or several database writes and how long they took."""
+
+	def __init__(self, rows, written, elapsed, error=None):
+		self.rows = rows
+		self.written = written
+		self.elapsed = elapsed
+		self.error = error
+
+	@property
+	def ok(self):
+		return self.error is None
+
+	def __repr__(self):
+		return 'WriteResult(rows=%s, written=%s, elapsed=%.3f, error=%r)' % (self.rows, self.written, self.elapsed, self.error)
+
+	@classmethod
+	def combine(cls, results):
+		"""Sum up a list of results, keeping the first error."""
+
+		errors = [r.error for r in results if not r.ok]
+		return cls(
+			sum(r.rows for r in results), sum(r.written for r in results), sum(r.elapsed for r in results),
+			errors[0] if errors else None
+		)
+
+
+def format_copy_value(value):
+	"""Format a value for the text format of COPY."""
+
+	if value is None:
+		return '\\N'
+
+	return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_merge(conn, table, columns, rows, conflict=None, update=()):
+	"""Stream rows into a staging table with COPY and merge them into a table with one statement.
+
+	Parameters
+	----------
+	conn : connection
+		Open psycopg2 connection, the caller commits.
+	table : str
+		Name of the target table.
+	columns : tuple
+		Column names in the order of the row values.
+	rows : Batch or iterable
+		Rows to write, a batch is formatted column by column.
+	conflict : tuple
+		Key columns of an upsert. Rows are plainly inserted if None.
+	update : tuple
+		Columns updated on a key conflict, nothing is updated if empty.
+
+	Returns
+	-------
+	Number of rows inserted or updated.
+	"""
+
+	staging = 'staging_' + table
+	column_list = ', '.join(columns)
+	buffer = io.StringIO()
+	if isinstance(rows, Batch):
+		buffer.writelines(rows.copy_lines())
+	else:
+		for row in rows:
+			buffer.write('\t'.join(format_copy_value(value) for value in row))
+			buffer.write('\n')
+	buffer.seek(0)
+
+	with conn.cursor() as cursor:
+		# the staging table lives as long as the connection and is emptied on every commit
+		cursor.execute(
+			'CREATE TEMP TABLE IF NOT EXISTS %s ON COMMIT DELETE ROWS AS SELECT %s FROM %s WITH NO DATA;'
+			% (staging, column_list, table)
+		)
+		cursor.copy_expert('COPY %s (%s) FROM STDIN;' % (staging, column_list), buffer)
+
+		if conflict is None:
+			cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s;' % (table, column_list, column_list, staging))
+		else:
+			# keep the last of duplicate keys in the batch, a single upsert can not touch a row twice
+			key_list = ', '.join(conflict)
+			action = 'UPDATE SET ' + ', '.join('%s = EXCLUDED.%s' % (c, c) for c in update) if update else 'NOTHING'
+			cursor.execute(
+				'INSERT INTO %s (%s) SELECT DISTINCT ON (%s) %s FROM %s ORDER BY %s, ctid DESC ON CONFLICT (%s) DO %s;'
+				% (table, column_list, key_list, column_list, staging, key_list, key_list, action)
+			)
+		written = cursor.rowcount
+		cursor.execute('TRUNCATE %s;' % staging)  # for further merges before the commit
+
+		return written
+
+
+class BulkWriter:
+	"""Buffers rows and writes them with `copy_merge` in batches over a reused connection.
+
+	A batch is written once `batch_size` rows are buffered, and on `flush`. Batching by time is
+	done by `common.writebehind.WriteBehind`, which writes what it collected once its first rows
+	waited for `max_delay` seconds.
+
+	Parameters
+	----------
+	db_credentials : dict
+		A dictionary containing key-value log in credentials for the database.
+	table : str
+		Name of the target table.
+	batch_type : type
+		Batch class of the table's rows, which defines the columns and buffers the rows.
+	conflict, update :
+		Upsert behaviour of the writes, see `copy_merge`.
+	batch_size : int
+		Maximum number of rows per batch.
+	max_delay : float
+		Maximum seconds a row waits in a write-behind queue before its batch is written.
+	name : str
+		Site whose rows are written, the writes are recorded in the metrics under it.
+	metrics : Metrics
+		Metrics to record the write times and the written rows in, if a name is given.
+	"""
+
+	def __init__(self, db_credentials, table, batch_type, conflict=None, update=(), batch_size=10000, max_delay=5.,
+				 name=None, metrics=METRICS):
+		self.db_credentials = db_credentials
+		self.table = table
+		self.batch_type = batch_type
+		self.columns = batch_type.columns
+		self.conflict = conflict
+		self.update = update
+		self.batch_size = batch_size
+		self.max_delay = max_delay
+		self.name = name
+		self.metrics = metrics
+		self.conn = None
+		self._buffer = batch_type()
+		self._lock = threading.Lock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _connection(self):
+		if self.conn is None or self.conn.closed:
+			self.conn = psycopg2.connect(**self.db_credentials)
+
+		return self.conn
+
+	def write(self, rows):
+		"""Buffer rows and write all full batches. Returns a list of WriteResults."""
+
+		with self._lock:
+			self._buffer.extend(rows)
+			results = []
+			while len(self._buffer) >= self.batch_size:
+				results.append(self._write_batch(self._buffer[:self.batch_size]))
+				self._buffer = self._buffer[self.batch_size:]
+
+		return results
+
+	def flush(self):
+		"""Write all buffered rows. Returns a list of WriteResults."""
+
+		with self._lock:
+			results = []
+			while self._buffer:
+				results.append(self._write_batch(self._buffer[:self.batch_size]))
+				self._buffer = self._buffer[self.batch_size:]
+
+		return results
+
+	def _write_batch(self, rows):
+		with self.metrics.time(self.name, 'write'):
+			result = self._copy_batch(rows)
+		if self.name is not None and result.ok:
+			# inserts write every row of the batch, upserts only report a total
+			self.metrics.count_rows(self.name, 'written', rows if result.written == len(rows) else result.written)
+
+		return result
+
+	def _copy_batch(self, rows):
+		start = time.time()
+		try:
+			conn = self._connection()
+			written = copy_merge(conn, self.table, self.columns, rows, self.conflict, self.update)
+			conn.commit()
+			result = WriteResult(len(rows), written, time.time() - start)
+			logger.info('Wrote %s of %s rows to %s in %.3fs.', written, len(rows), self.table, result.elapsed)
+		except psycopg2.Error as e:
+			logger.error('Failed to write %s rows into %s: %s', len(rows), self.table, e)
+			if self.conn is not None:
+				self.conn.close()  # drop the connection, it is reopened for the next batch
+			result = WriteResult(len(rows), 0, time.time() - start, error=str(e))
+
+		return result
+
+	def close(self):
+		"""Write all buffered rows and close the connection. Returns a list of WriteResults."""
+
+		results = self.flush()
+		if self.conn is not None:
+			self.conn.close()
+
+		return results
+
+
+def postgres_db_insert(data, db_credentials):
+	"""Insert odds data into the database.
+
+	PARAMS
+	------
+	data : OddsBatch or list of tuples
+		Rows with ordered entries of team_1, team_2, team_1_winner_odds, team_2_winner_odds, draw_odds,
+		bet_type, scrape_time, match_time, tournament_name, source.
+	db_credentials : dict
+		A dictionary containing key-value log in credentials for the database.
+
+	Returns
+	-------
+	WriteResult with the number of inserted rows and the latency.
+	"""
+
+	writer = BulkWriter(db_credentials, ODDS_TABLE, OddsBatch)
+	return WriteResult.combine(writer.write(data) + writer.close())
+
+
+def postgres_db_upsert(data, db_credentials):
+	"""Upsert match results data from hltv into the database, updating the match time of known results.
+
+	PARAMS
+	------
+	data : ResultsBatch or list of tuples
+		Rows with ordered entries of hash_id, team_1, team_2, team_1_score, team_2_score,
+		tournament, matchtype, match_time.
+	db_credentials : dict
+		A dictionary containing key-value log in credentials for the database.
+
+	Returns
+	-------
+	WriteResult with the number of upserted rows and the latency.
+	"""
+
+	writer = BulkWriter(db_credentials, RESULTS_TABLE, ResultsBatch, RESULTS_CONFLICT, RESULTS_UPDATE)
+	return WriteResult.combine(writer.write(data) + writer.close())
+
+
+class RunRecorder:
+	"""Records the summaries of scrape runs in the scrape_runs table over a reused connection.
+
+	The table is created when the connection is opened, so a long-running worker creates it once at
+	startup and then only inserts. Runs are recorded on a best effort basis, an error is logged,
+	drops the connection and does not fail the scrape.
+
+	Parameters
+	----------
+	db_credentials : dict
+		A dictionary containing key-value log in credentials for the database.
+	"""
+
+	columns = ('site', 'started_at', 'elapsed', 'tier', 'rows', 'written', 'error') + tuple(stage + '_seconds' for stage in STAGES)
+
+	def __init__(self, db_credentials):
+		self.db_credentials = db_credentials
+		self.conn = None
+		self._lock = threading.Lock()  # jobs of a worker finish in several threads
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _connection(self):
+		if self.conn is None or self.conn.closed:
+			self.conn = psycopg2.connect(**self.db_credentials)
+			with self.conn, self.conn.cursor() as cursor:
+				# concurrent `CREATE TABLE IF NOT EXISTS` statements can conflict, scrapers starting together serialize
+				cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (SCRAPE_RUNS_TABLE,))
+				cursor.execute("""
+					CREATE TABLE IF NOT EXISTS %s (
+						id SERIAL PRIMARY KEY,
+						site TEXT NOT NULL,
+						started_at INTEGER NOT NULL,
+						elapsed REAL,
+						tier TEXT,
+						rows INTEGER,
+						written INTEGER,
+						error TEXT,
+						%s
+					);
+					CREATE INDEX IF NOT EXISTS %s_site_started_at ON %s (site, started_at);
+				""" % (SCRAPE_RUNS_TABLE, ',\n'.join('%s_seconds REAL' % stage for stage in STAGES), SCRAPE_RUNS_TABLE, SCRAPE_RUNS_TABLE))
+
+		return self.conn
+
+	def open(self):
+		"""Open the connection and create the table. Returns True if the database is available."""
+
+		with self._lock:
+			try:
+				self._connection()
+			except psycopg2.Error as e:
+				logger.error('Failed to create the %s table: %s', SCRAPE_RUNS_TABLE, e)
+				self._drop()
+				return False
+
+		return True
+
+	def record(self, run):
+		"""Insert the summary of a run as returned by `Metrics.finish_run`. Returns True if the run was recorded."""
+
+		values = tuple(run[column] for column in self.columns[:7]) + tuple(run['stages'].get(stage) for stage in STAGES)
+		with self._lock:
+			try:
+				conn = self._connection()
+				with conn, conn.cursor() as cursor:
+					cursor.execute(
+						'INSERT INTO %s (%s) VALUES (%s);'
+						% (SCRAPE_RUNS_TABLE, ', '.join(self.columns), ', '.join(['%s'] * len(self.columns))),
+						values
+					)
+			except psycopg2.Error as e:
+				logger.error('Failed to record the run of %s: %s', run['site'], e)
+				self._drop()  # the connection is reopened for the next run
+				return False
+
+		return True
+
+	def _drop(self):
+		if self.conn is not None:
+			self.conn.close()
+			self.conn = None
+
+	def close(self):
+		with self._lock:
+			self._drop()
+
+
+def record_run(db_credentials, run):
+	"""Insert the summary of a scrape run into the scrape_runs table, which is created if needed.
+
+	Opens a connection for the one run, a long-running process keeps a `RunRecorder` instead.
+
+	PARAMS
+	------
+	db_credentials : dict
+		A dictionary containing key-value log in credentials for the database.
+	run : dict
+		Summary of the run as returned by `Metrics.finish_run`.
+
+	Returns
+	-------
+	True if the run was recorded.
+	"""
+
+	with RunRecorder(db_credentials) as recorder:
+		return recorder.record(run)
+
+
+def add_snapshot_column(db_credentials):
+	"""Add the snapshot_id column to the odds table if it does not exist yet.
+
+	PARAMS
+	------
+	db_credentials : dict
+		A dictionary containing key-value log in credentials for the database.
+
+	Returns
+	-------
+	True if the column exists.
+	"""
+
+	conn = None
+	try:
+		conn = psycopg2.connect(**db_credentials)
+		with conn, conn.cursor() as cursor:
+			# the ALTER TABLE locks the table, so it only runs if the column is missing
+			cursor.execute(
+				'SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s;',
+				(ODDS_TABLE, SNAPSHOT_COLUMN)
+			)
+			if cursor.fetchone() is None:
+				cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (SNAPSHOT_COLUMN,))
+				cursor.execute('ALTER TABLE %s ADD COLUMN IF NOT EXISTS %s BIGINT;' % (ODDS_TABLE, SNAPSHOT_COLUMN))
+				logger.info('Added the %s column to %s.', SNAPSHOT_COLUMN, ODDS_TABLE)
+	except psycopg2.Error as e:
+		logger.error('Failed to add the %s column to %s: %s', SNAPSHOT_COLUMN, ODDS_TABLE, e)
+		return False
+	finally:
+		if conn is not None:
+			conn.close()
+
+	return True
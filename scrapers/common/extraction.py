@@ -0,0 +1,185 @@
+import re
+import json
+import time
+import logging
+import lxml.html
+from lxml.cssselect import CSSSelector
+
+
+logger = logging.getLogger(__name__)
+
+
+# collects all declared fields in the browser and returns them as a single json string. Text is
+# read like the WebDriver element text (one line per block element, css text-transform applied)
+# rather than innerText, which separates table cells with tabs and keeps empty lines.
+EXTRACT_SCRIPT = """
+function visibleText(root) {
+	var lines = [''];
+	function append(text) { lines[lines.length - 1] += text; }
+	function newline() { if (lines[lines.length - 1] !== '') { lines.push(''); } }
+	function walk(node, style) {
+		if (node.nodeType === 3) {
+			if (style.visibility !== 'visible') { return; }
+			var text = node.nodeValue;
+			if (style.whiteSpace.indexOf('pre') !== 0) {
+				text = text.replace(/[\\n\\r\\t ]+/g, ' ');
+				if (/(^| )$/.test(lines[lines.length - 1])) { text = text.replace(/^ /, ''); }
+			}
+			if (style.textTransform === 'uppercase') { text = text.toUpperCase(); }
+			if (style.textTransform === 'lowercase') { text = text.toLowerCase(); }
+			if (style.textTransform === 'capitalize') { text = text.replace(/\\b\\w/g, function (c) { return c.toUpperCase(); }); }
+			text.split('\\n').forEach(function (part, idx) { if (idx > 0) { lines.push(''); } append(part); });
+			return;
+		}
+		if (node.nodeType !== 1) { return; }
+		if (node.tagName === 'BR') { lines.push(''); return; }
+		var elementStyle = window.getComputedStyle(node), display = elementStyle.display;
+		if (display === 'none') { return; }
+		var block = display.indexOf('inline') !== 0 && display !== 'table-cell' && display !== 'contents';
+		if (display === 'table-cell' && lines[lines.length - 1] && !/ $/.test(lines[lines.length - 1])) { append(' '); }
+		if (block) { newline(); }
+		Array.prototype.forEach.call(node.childNodes, function (child) { walk(child, elementStyle); });
+		if (block) { newline(); }
+	}
+	walk(root, window.getComputedStyle(root));
+	return lines.map(function (line) { return line.replace(/^[^\\S\\xa0]+|[^\\S\\xa0]+$/g, ''); }).join('\\n').trim();
+}
+var fields = arguments[0], payload = {};
+Object.keys(fields).forEach(function (name) {
+	var field = fields[name];
+	var elements = Array.prototype.slice.call(document.querySelectorAll(field.selector));
+	if (field.first) { elements = elements.slice(0, 1); }
+	var values = elements.map(function (element) {
+		if (field.attribute === 'text') { return visibleText(element); }
+		if (field.attribute === 'html') { return element.outerHTML; }
+		return element.getAttribute(field.attribute);
+	});
+	payload[name] = field.first ? (values.length ? values[0] : null) : values;
+});
+return JSON.stringify(payload);
+"""
+
+
+def normalize_fields(fields):
+	"""Fill in the defaults of declared fields.
+
+	Each field is a dict with a CSS `selector`, the `attribute` to read, which is either an
+	html attribute, 'text' for the rendered text or 'html' for the outer html, and whether
+	only the `first` match is read instead of a list of all matches.
+	"""
+
+	return {
+		name: {
+			'selector': field['selector'],
+			'attribute': field.get('attribute', 'text'),
+			'first': field.get('first', False),
+		}
+		for name, field in fields.items()
+	}
+
+
+def extract(driver, fields):
+	"""Read all declared fields from the current page of the driver in a single round trip.
+
+	Parameters
+	----------
+	driver : WebDriver
+		Driver which has loaded the page.
+	fields : dict
+		Mapping of payload keys to field declarations, see `normalize_fields`.
+
+	Returns
+	-------
+	Dictionary with a value per field. Fields with `first` map to a string or None if no
+	element matched, all others to a list of strings.
+	"""
+
+	start = time.time()
+	payload = json.loads(driver.execute_script(EXTRACT_SCRIPT, normalize_fields(fields)))
+	logger.debug('Extracted %s fields in %.3fs.', len(payload), time.time() - start)
+
+	return payload
+
+
+# tags rendered as blocks / skipped entirely by default browser styles, used for static html
+BLOCK_TAGS = {
+	'address', 'article', 'aside', 'blockquote', 'body', 'caption', 'dd', 'div', 'dl', 'dt', 'fieldset',
+	'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'html',
+	'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'tbody', 'tfoot', 'thead', 'tr', 'ul',
+}
+HIDDEN_TAGS = {'head', 'script', 'style', 'noscript', 'template', 'iframe', 'svg'}
+WHITESPACE = re.compile(r'[\n\r\t ]+')
+
+
+def _is_hidden(element):
+	style = element.get('style', '').replace(' ', '').lower()
+	return element.tag in HIDDEN_TAGS or element.get('hidden') is not None or 'display:none' in style
+
+
+def visible_text(element):
+	"""Approximate the WebDriver element text of a static lxml element, see EXTRACT_SCRIPT."""
+
+	lines = ['']
+
+	def append(text):
+		text = WHITESPACE.sub(' ', text)
+		if not lines[-1] or lines[-1].endswith(' '):
+			text = text.lstrip(' ')
+		lines[-1] += text
+
+	def newline():
+		if lines[-1] != '':
+			lines.append('')
+
+	def walk(node):
+		if not isinstance(node.tag, str) or _is_hidden(node):
+			pass
+		elif node.tag == 'br':
+			lines.append('')
+		else:
+			block = node.tag in BLOCK_TAGS
+			if node.tag in ('td', 'th') and lines[-1] and not lines[-1].endswith(' '):
+				lines[-1] += ' '
+			if block:
+				newline()
+			if node.text:
+				append(node.text)
+			for child in node:
+				walk(child)
+			if block:
+				newline()
+		if node.tail:
+			append(node.tail)
+
+	tail, element.tail = element.tail, None  # text after the element is not part of it
+	walk(element)
+	element.tail = tail
+
+	return '\n'.join(line.strip(' \n\r\t') for line in lines).strip(' \n\r\t')
+
+
+def extract_html(html, fields):
+	"""Read all declared fields from static html, the counterpart of `extract` without a browser.
+
+	The 'html' attribute of the root element returns the document as it was received.
+	"""
+
+	start = time.time()
+	document = lxml.html.fromstring(html)
+	payload = {}
+	for name, field in normalize_fields(fields).items():
+		elements = CSSSelector(field['selector'])(document)
+		if field['first']:
+			elements = elements[:1]
+		values = []
+		for element in elements:
+			if field['attribute'] == 'text':
+				values.append(visible_text(element))
+			elif field['attribute'] == 'html':
+				values.append(html if element is document else lxml.html.tostring(element, encoding='unicode', with_tail=False))
+			else:
+				values.append(element.get(field['attribute']))
+		payload[name] = (values[0] if values else None) if field['first'] else values
+	logger.debug('Extracted %s fields from static html in %.3fs.', len(payload), time.time() - start)
+
+	return payload
@@ -0,0 +1,231 @@
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.common.exceptions import WebDriverException
+
+from common.extraction import extract, extract_html
+from common.metrics import METRICS
+from common.readiness import wait_until_ready
+
+
+logger = logging.getLogger(__name__)
+
+
+TIERS = ('json', 'html', 'browser')  # cheapest first
+DEFAULT_HEADERS = {
+	'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0.3809.100 Safari/537.36',
+	'Accept-Language': 'en-US,en;q=0.9',
+}
+
+
+class HttpSessions:
+	"""Keep-alive http sessions, one per thread, with pooled connections per host.
+
+	Parameters
+	----------
+	pool_size : int
+		Maximum number of kept alive connections per host and thread.
+	timeout : float
+		Seconds until a request is given up.
+	headers : dict
+		Headers sent with every request.
+	"""
+
+	def __init__(self, pool_size=10, timeout=15, headers=DEFAULT_HEADERS):
+		self.pool_size = pool_size
+		self.timeout = timeout
+		self.headers = headers
+		self._local = threading.local()
+
+	@property
+	def session(self):
+		session = getattr(self._local, 'session', None)
+		if session is None:
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+			session.mount('http://', adapter)
+			session.mount('https://', adapter)
+			session.headers.update(self.headers)
+			self._local.session = session
+
+		return session
+
+	def get(self, url):
+		"""GET a url and raise on error status codes."""
+
+		response = self.session.get(url, timeout=self.timeout)
+		response.raise_for_status()
+
+		return response
+
+
+class FetchResult:
+	"""Rows of a fetched page together with the tier which served them.
+
+	`attempts` holds a (tier, seconds, number of rows or error) tuple for every tier tried.
+	"""
+
+	def __init__(self, name, tier, elapsed, rows, attempts):
+		self.name = name
+		self.tier = tier
+		self.elapsed = elapsed
+		self.rows = rows
+		self.attempts = attempts
+
+	def __repr__(self):
+		return 'FetchResult(name=%r, tier=%r, elapsed=%.3f, rows=%s)' % (self.name, self.tier, self.elapsed, len(self.rows))
+
+
+class TieredFetcher:
+	"""Fetch a page with the cheapest tier that produces rows.
+
+	The tiers are, cheapest first: 'json' requests a json endpoint directly, 'html' parses the
+	static html with lxml and 'browser' renders the page in a chrome session leased from the
+	browser pool. A tier which fails or whose page transcribes to no rows falls back to the
+	next configured tier. A browser page whose session failed, e.g. a navigation which got stuck
+	past the page load timeout of the pool, is retried in a fresh session before the tier fails,
+	the pool recycles the failed session. With an archive, the extracted payload of every html or browser page
+	which produced rows is archived for replays. The stages of every fetch are timed in the
+	metrics under the name of the page.
+
+	Parameters
+	----------
+	browser_pool : BrowserPool
+		Pool to lease chrome sessions from for the browser tier.
+	sessions : HttpSessions
+		Keep-alive sessions for the json and html tiers.
+	archive : SnapshotArchive
+		Archive of the transcribed page payloads.
+	metrics : Metrics
+		Metrics to record the stage timings and the produced rows in.
+	browser_retries : int
+		Retries of a browser page whose chrome session failed.
+	limiter : RateLimiter
+		Rate limit every request of a tier waits for, tier fallbacks and retries included. No
+		limit if None.
+	"""
+
+	def __init__(self, browser_pool=None, sessions=None, archive=None, metrics=METRICS, browser_retries=1, limiter=None):
+		self.browser_pool = browser_pool
+		self.sessions = sessions or HttpSessions()
+		self.archive = archive
+		self.metrics = metrics
+		self.browser_retries = browser_retries
+		self.limiter = limiter
+
+	def fetch(self, url, transcribe, fields, readiness=None, tiers=TIERS, json_url=None, parse_json=None, name=None,
+			  resources=None):
+		"""Fetch and transcribe a page.
+
+		Parameters
+		----------
+		url : str
+			Url of the page for the html and browser tiers.
+		transcribe : callable
+			Function turning the extracted page payload into a batch of rows.
+		fields : dict
+			DOM fields to extract, see `common.extraction.normalize_fields`.
+		readiness : dict
+			Keyword arguments for `wait_until_ready` in the browser tier.
+		tiers : tuple
+			Tiers to try in order.
+		json_url : str
+			Json endpoint of the page, the json tier is skipped without it.
+		parse_json : callable
+			Function turning the decoded json response into a batch of rows.
+		name : str
+			Name of the page for logging, defaults to the url.
+		resources : ResourcePolicy
+			Resources to block in the browser tier, see `common.resources`. Nothing is blocked if None.
+
+		Returns
+		-------
+		FetchResult of the first tier producing rows, or of the last tier tried. Its tier is None
+		if no configured tier could be tried.
+		"""
+
+		name = name or url
+		start = time.time()
+		rows, served_by, attempts = [], None, []
+
+		for tier in tiers:
+			if tier == 'json' and not (json_url and parse_json):
+				continue
+			if tier == 'browser' and self.browser_pool is None:
+				continue
+
+			served_by, tier_start = tier, time.time()
+			try:
+				page = self._fetch_tier(tier, url, fields, readiness, json_url, name, resources)
+				scrape_time = int(time.time())
+				with self.metrics.time(name, 'parse'):
+					rows = parse_json(page) if tier == 'json' else transcribe(page)
+				attempts.append((tier, round(time.time() - tier_start, 3), len(rows)))
+			except Exception as e:
+				logger.warning('The %s tier failed for %s: %r', tier, name, e)
+				attempts.append((tier, round(time.time() - tier_start, 3), repr(e)))
+				rows = []
+			if rows:
+				self.metrics.count_rows(name, 'produced', rows)
+				if self.archive is not None and tier != 'json':
+					self._archive(name, url, tier, page, len(rows), scrape_time)
+				break
+			logger.info('The %s tier produced no rows for %s.', tier, name)
+
+		result = FetchResult(name, served_by, time.time() - start, rows, attempts)
+		logger.info('Fetched %s rows of %s with the %s tier in %.2fs, attempts: %s',
+					len(rows), name, served_by, result.elapsed, attempts)
+
+		return result
+
+	def _acquire(self):
+		if self.limiter is not None:
+			self.limiter.acquire()
+
+	def _fetch_tier(self, tier, url, fields, readiness, json_url, name, resources=None):
+		if tier == 'json':
+			self._acquire()
+			with self.metrics.time(name, 'download'):
+				return self.sessions.get(json_url).json()
+		elif tier == 'html':
+			self._acquire()
+			with self.metrics.time(name, 'download'):
+				text = self.sessions.get(url).text
+			with self.metrics.time(name, 'extraction'):
+				return extract_html(text, fields)
+		elif tier == 'browser':
+			for attempt in range(self.browser_retries + 1):
+				try:
+					return self._browse(url, fields, readiness, name, resources)
+				except WebDriverException as e:
+					if attempt == self.browser_retries:
+						raise
+					logger.warning('The chrome session failed on %s, retrying in a fresh session: %r', name, e)
+		raise ValueError('Unknown fetch tier %s.' % tier)
+
+	def _browse(self, url, fields, readiness, name, resources=None):
+		start = time.time()
+		with self.browser_pool.lease() as driver:
+			self.metrics.observe(name, 'launch', time.time() - start)  # includes the launch of a cold session
+			baseline = resources.apply(driver) if resources is not None else None
+			self._acquire()
+			start = time.time()
+			with self.metrics.time(name, 'navigation'):
+				driver.get(url)
+			load_time = time.time() - start
+			if readiness:
+				with self.metrics.time(name, 'readiness'):
+					wait_until_ready(driver, name=name, **readiness)
+			with self.metrics.time(name, 'extraction'):
+				page = extract(driver, fields)
+			if baseline is not None:
+				resources.report(driver, name, load_time, baseline)
+			return page
+
+	def _archive(self, name, url, tier, page, rows, scrape_time):
+		try:
+			self.archive.save(name, url, tier, page, rows, scrape_time)
+		except Exception as e:  # the scrape does not depend on its archive
+			logger.warning('Failed to archive the %s page of %s: %r', tier, name, e)
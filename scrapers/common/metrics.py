@@ -0,0 +1,227 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+logger = logging.getLogger(__name__)
+
+
+# stages of a scrape, in the order they run
+STAGES = ('download', 'launch', 'navigation', 'readiness', 'extraction', 'parse', 'dedup', 'write')
+BUCKETS = (.01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)  # upper bounds of the stage histograms in seconds
+
+
+def count_sources(rows, default):
+	"""Count the rows of a batch per source. Rows without a source column, or a number of rows,
+	are counted under `default`.
+	"""
+
+	if 'source' in getattr(rows, 'columns', ()):
+		return Counter(rows.column('source'))
+	count = rows if isinstance(rows, int) else len(rows)
+
+	return Counter({default: count}) if count else Counter()
+
+
+def format_labels(labels):
+	escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+	return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in labels)
+
+
+class Metrics:
+	"""Stage timings and row counts of scrape runs, exported in the Prometheus text format.
+
+	The stages are timed per site by the shared modules: `download` (http tiers), `launch`
+	(leasing a chrome session, launching it if none is warm), `navigation`, `readiness`,
+	`extraction`, `parse`, `dedup` (change detection) and `write`. Rows produced by the parsers
+	and rows written to the database are counted per site and source. Counters and histograms
+	accumulate over the life of the process, `finish_run` additionally reports and resets the
+	totals of the current run of a site. A running `common.profiling.Profiler` is told about
+	every stage entered through `time`.
+
+	Parameters
+	----------
+	buckets : tuple
+		Upper bounds of the stage time histograms in seconds.
+	"""
+
+	def __init__(self, buckets=BUCKETS):
+		self.buckets = buckets
+		self._lock = threading.Lock()
+		self._histograms = {}  # (site, stage) -> [bucket counts, sum, count]
+		self._rows = defaultdict(Counter)  # kind -> (site, source) -> rows
+		self._runs = Counter()  # (site, status) -> runs
+		self._last_runs = {}  # site -> summary of its last finished run
+		self._run_stages = defaultdict(Counter)  # site -> stage -> seconds in the current run
+		self._run_rows = defaultdict(Counter)  # site -> kind -> rows in the current run
+		self._run_starts = {}
+		self.profiler = None
+
+	def observe(self, site, stage, seconds):
+		"""Record the seconds a stage of a site took."""
+
+		with self._lock:
+			histogram = self._histograms.get((site, stage))
+			if histogram is None:
+				histogram = self._histograms[(site, stage)] = [[0] * len(self.buckets), 0., 0]
+			for idx, bound in enumerate(self.buckets):
+				if seconds <= bound:
+					histogram[0][idx] += 1
+			histogram[1] += seconds
+			histogram[2] += 1
+			self._run_stages[site][stage] += seconds
+
+	@contextmanager
+	def time(self, site, stage):
+		"""Time the stage of a site for the duration of a with block, also if it raises. Stages of
+		a site which is None are not recorded.
+		"""
+
+		if site is None:
+			yield
+			return
+
+		profiler, start = self.profiler, time.time()
+		if profiler is not None:
+			profiler.enter(stage)
+		try:
+			yield
+		finally:
+			if profiler is not None:
+				profiler.exit(stage)
+			self.observe(site, stage, time.time() - start)
+
+	def count_rows(self, site, kind, rows):
+		"""Count rows per source, kind is 'produced' or 'written'. `rows` is a batch or a number of
+		rows without a known source.
+		"""
+
+		sources = count_sources(rows, site)
+		with self._lock:
+			for source, count in sources.items():
+				self._rows[kind][(site, source)] += count
+			self._run_rows[site][kind] += sum(sources.values())
+
+	def start_run(self, site):
+		with self._lock:
+			self._run_starts[site] = time.time()
+			self._run_stages.pop(site, None)
+			self._run_rows.pop(site, None)
+
+	def finish_run(self, site, tier=None, error=None):
+		"""Log and return the summary of the current run of a site, and reset its run totals.
+
+		Returns
+		-------
+		dict with the site, start time, elapsed seconds, tier, rows produced and written, error
+		and the seconds of every stage.
+		"""
+
+		now = time.time()
+		with self._lock:
+			started_at = self._run_starts.pop(site, now)
+			stages = self._run_stages.pop(site, Counter())
+			rows = self._run_rows.pop(site, Counter())
+			run = {
+				'site': site,
+				'started_at': int(started_at),
+				'elapsed': now - started_at,
+				'tier': tier,
+				'rows': rows['produced'],
+				'written': rows['written'],
+				'error': error,
+				'stages': {stage: stages[stage] for stage in STAGES if stage in stages},
+			}
+			status = 'error' if error is not None else 'ok' if run['rows'] else 'empty'
+			self._runs[(site, status)] += 1
+			self._last_runs[site] = run
+
+		logger.info('Run of %s took %.2fs with %s rows produced and %s written, stages: %s', site, run['elapsed'],
+					run['rows'], run['written'], ', '.join('%s %.3fs' % item for item in run['stages'].items()) or 'none')
+
+		return run
+
+	def render(self):
+		"""Get all metrics in the Prometheus text exposition format."""
+
+		lines = []
+
+		def metric(name, kind, description):
+			lines.append('# HELP %s %s' % (name, description))
+			lines.append('# TYPE %s %s' % (name, kind))
+
+		with self._lock:
+			metric('scraper_stage_seconds', 'histogram', 'Seconds spent in a stage of a scrape.')
+			for (site, stage), (buckets, total, count) in sorted(self._histograms.items()):
+				labels = (('site', site), ('stage', stage))
+				for bound, observations in zip(self.buckets, buckets):
+					lines.append('scraper_stage_seconds_bucket%s %s' % (format_labels(labels + (('le', bound),)), observations))
+				lines.append('scraper_stage_seconds_bucket%s %s' % (format_labels(labels + (('le', '+Inf'),)), count))
+				lines.append('scraper_stage_seconds_sum%s %s' % (format_labels(labels), total))
+				lines.append('scraper_stage_seconds_count%s %s' % (format_labels(labels), count))
+
+			for kind in ('produced', 'written'):
+				metric('scraper_rows_%s_total' % kind, 'counter', 'Rows %s per site and source.' % kind)
+				for (site, source), count in sorted(self._rows[kind].items()):
+					lines.append('scraper_rows_%s_total%s %s' % (kind, format_labels((('site', site), ('source', source))), count))
+
+			metric('scraper_runs_total', 'counter', 'Finished runs per site and status (ok, empty or error).')
+			for (site, status), count in sorted(self._runs.items()):
+				lines.append('scraper_runs_total%s %s' % (format_labels((('site', site), ('status', status))), count))
+
+			for name, key, description in (
+				('scraper_last_run_timestamp_seconds', 'started_at', 'Start time of the last run of a site.'),
+				('scraper_last_run_seconds', 'elapsed', 'Duration of the last run of a site.'),
+				('scraper_last_run_rows', 'rows', 'Rows produced by the last run of a site.'),
+				('scraper_last_run_written_rows', 'written', 'Rows written by the last run of a site.'),
+			):
+				metric(name, 'gauge', description)
+				for site, run in sorted(self._last_runs.items()):
+					lines.append('%s%s %s' % (name, format_labels((('site', site),)), run[key]))
+
+		return '\n'.join(lines) + '\n'
+
+	def write_textfile(self, path):
+		"""Write the metrics to a file for the textfile collector of the node exporter, atomically."""
+
+		tmp_path = '%s.%s.tmp' % (path, os.getpid())
+		with open(tmp_path, 'w') as f:
+			f.write(self.render())
+		os.replace(tmp_path, path)
+		logger.debug('Wrote metrics to %s.', path)
+
+	def serve(self, port, host=''):
+		"""Serve the metrics over http from a background thread. Returns the server."""
+
+		server = MetricsServer((host, port), MetricsHandler)
+		server.metrics = self
+		threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+		logger.info('Serving metrics on port %s.', server.server_address[1])
+
+		return server
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		body = self.server.metrics.render().encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+METRICS = Metrics()
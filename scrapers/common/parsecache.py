@@ -0,0 +1,89 @@
+import hashlib
+import logging
+import collections
+
+
+logger = logging.getLogger(__name__)
+
+
+class ParseCache:
+	"""LRU cache of the rows parsed from page fragments, keyed by a hash of the fragment.
+
+	Most tournaments of a page are unchanged between two scrapes. Their rows are taken from the
+	cache instead of being parsed again, so the parse time of a scrape follows the number of
+	changed fragments rather than the size of the page. Cached rows keep the scrape time of the
+	scrape which parsed them, callers refresh it in the batch they collect the rows in. The cache
+	lives as long as the process, a long-running worker keeps it across scrapes.
+
+	Parameters
+	----------
+	max_fragments : int
+		Number of fragments to keep, the least recently used fragments are evicted.
+	"""
+
+	def __init__(self, max_fragments=500):
+		self.max_fragments = max_fragments
+		self.hits = self.misses = self.evictions = 0
+		self._run_hits = self._run_misses = 0
+		self._cache = collections.OrderedDict()
+
+	def __len__(self):
+		return len(self._cache)
+
+	@staticmethod
+	def key(fragment):
+		return hashlib.md5(fragment.encode('utf-8')).digest()
+
+	@property
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups else 0.
+
+	def parse(self, fragment, parse):
+		"""Get the rows of a fragment from the cache, or parse and cache them.
+
+		Parameters
+		----------
+		fragment : str
+			Text of the fragment, together with anything else its rows depend on.
+		parse : callable
+			Called without arguments on a miss, returns the batch of rows of the fragment.
+
+		Returns
+		-------
+		Batch of the rows of the fragment. It is shared with the cache and must not be modified.
+		"""
+
+		key = self.key(fragment)
+		rows = self._cache.get(key)
+		if rows is None:
+			self.misses += 1
+			self._run_misses += 1
+			rows = self._cache[key] = parse()
+			if len(self._cache) > self.max_fragments:
+				self._cache.popitem(last=False)
+				self.evictions += 1
+		else:
+			self.hits += 1
+			self._run_hits += 1
+			self._cache.move_to_end(key)
+
+		return rows
+
+	def report(self):
+		"""Log the hit rate since the last report and overall, and return the numbers of the run."""
+
+		lookups = self._run_hits + self._run_misses
+		stats = {
+			'fragments': lookups,
+			'hits': self._run_hits,
+			'misses': self._run_misses,
+			'hit_rate': self._run_hits / lookups if lookups else 0.,
+			'cached': len(self._cache),
+			'evictions': self.evictions,
+		}
+		logger.info('Parse cache reused %s of %s fragments (%.1f%%, %.1f%% overall), %s fragments cached, %s evicted.',
+					stats['hits'], lookups, 100. * stats['hit_rate'], 100. * self.hit_rate, stats['cached'], self.evictions)
+		self._run_hits = self._run_misses = 0
+
+		return stats
@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import random
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+from common.metrics import METRICS, STAGES
+
+
+logger = logging.getLogger(__name__)
+
+
+MODES = ('cpu', 'memory')
+
+
+def frame_label(code):
+	return '%s (%s:%s)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Profiler:
+	"""Samples the stacks and traces the allocations of a scraper run or of some of its stages.
+
+	The cpu mode samples the python stacks of the profiled threads every `interval` seconds from
+	a background thread and writes them as collapsed stacks, the input of flamegraph.pl and
+	speedscope. The memory mode traces allocations with tracemalloc and writes the lines which
+	allocated most of the memory still held at the end of the profiled window, with the peak.
+
+	Without stages every thread is profiled for the whole run. With stages (see
+	`common.metrics.STAGES`) only threads inside one of them are sampled, and allocations are
+	only traced while one of them runs, so the other stages run at full speed. Stages are
+	entered through `Metrics.time`.
+
+	Parameters
+	----------
+	name : str
+		Name of the profiled run, prefix of the written files.
+	modes : tuple
+		'cpu' and/or 'memory'.
+	stages : tuple
+		Stages to profile, the whole run if None.
+	directory : str
+		Directory to write the profiles to.
+	interval : float
+		Seconds between two stack samples.
+	top : int
+		Number of allocating lines in the memory report.
+	metrics : Metrics
+		Metrics whose timed stages are reported to the profiler.
+	"""
+
+	def __init__(self, name, modes=MODES, stages=None, directory='.', interval=.01, top=25, metrics=METRICS):
+		unknown = set(modes) - set(MODES) | set(stages or ()) - set(STAGES)
+		if unknown:
+			raise ValueError('Unknown profiling modes or stages: %s' % ', '.join(sorted(unknown)))
+		self.name = name
+		self.cpu = 'cpu' in modes
+		self.memory = 'memory' in modes
+		self.stages = set(stages) if stages else None
+		self.directory = directory
+		self.interval = interval
+		self.top = top
+		self.metrics = metrics
+		self.stacks = Counter()
+		self.allocations = Counter()  # (file, line) -> bytes still held at the end of the traced windows
+		self.allocated_blocks = Counter()  # (file, line) -> blocks
+		self.peak = 0
+		self.samples = self.windows = 0
+		self._threads = {}  # ident -> [stage, depth] of the threads inside a profiled stage
+		self._tracing = 0  # threads inside a profiled stage while allocations are traced
+		self._lock = threading.Lock()
+		self._stopped = threading.Event()
+		self._sampler = None
+		self._started_at = None
+
+	def start(self):
+		self._started_at = time.time()
+		self.metrics.profiler = self
+		if self.memory and self.stages is None:
+			self._trace_start()
+		if self.cpu:
+			self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+			self._sampler.start()
+		logger.info('Profiling %s of %s (%s).', ', '.join(sorted(self.stages)) if self.stages else 'the run', self.name,
+					', '.join(mode for mode in MODES if getattr(self, mode)))
+
+		return self
+
+	def enter(self, stage):
+		"""Called by `Metrics.time` when the current thread enters a stage."""
+
+		if self.stages is None or stage not in self.stages:
+			return
+		ident = threading.get_ident()
+		with self._lock:
+			state = self._threads.get(ident)
+			if state is not None:
+				state[1] += 1
+				return
+			self._threads[ident] = [stage, 1]
+			if self.memory:
+				self._trace_start()
+
+	def exit(self, stage):
+		"""Called by `Metrics.time` when the current thread leaves a stage."""
+
+		if self.stages is None or stage not in self.stages:
+			return
+		ident = threading.get_ident()
+		with self._lock:
+			state = self._threads.get(ident)
+			if state is None:
+				return
+			state[1] -= 1
+			if state[1] == 0:
+				del self._threads[ident]
+				if self.memory:
+					self._trace_end()
+
+	def _trace_start(self):
+		self._tracing += 1
+		if self._tracing == 1:
+			tracemalloc.start()
+
+	def _trace_end(self):
+		"""Stop tracing once no thread is in a profiled window, keeping the allocations still held."""
+
+		self._tracing -= 1
+		if self._tracing > 0:
+			return
+		snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+		self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+		self.windows += 1
+		for stat in snapshot.statistics('lineno'):
+			frame = stat.traceback[0]
+			self.allocations[(frame.filename, frame.lineno)] += stat.size
+			self.allocated_blocks[(frame.filename, frame.lineno)] += stat.count
+
+	def _sample(self):
+		sampler = threading.get_ident()
+		while not self._stopped.wait(self.interval):
+			names = {thread.ident: thread.name for thread in threading.enumerate()}
+			with self._lock:
+				profiled = dict((ident, state[0]) for ident, state in self._threads.items()) if self.stages else None
+			for ident, frame in sys._current_frames().items():
+				if ident == sampler or (profiled is not None and ident not in profiled):
+					continue
+				stack = []
+				while frame is not None:
+					stack.append(frame_label(frame.f_code))
+					frame = frame.f_back
+				root = profiled[ident] if profiled is not None else names.get(ident, str(ident))
+				self.stacks[';'.join([root] + stack[::-1])] += 1
+				self.samples += 1
+
+	def stop(self):
+		"""Stop profiling and write the profiles. Returns the paths of the written files."""
+
+		if self._sampler is not None:
+			self._stopped.set()
+			self._sampler.join()
+		with self._lock:
+			if self.memory and self.stages is None:
+				self._trace_end()
+			elif self._tracing:  # the run ended inside a profiled stage
+				self._tracing = 1
+				self._trace_end()
+			self._threads.clear()
+		self.metrics.profiler = None
+
+		prefix = os.path.join(self.directory, '%s.%s.%s' % (self.name, time.strftime('%Y%m%dT%H%M%S', time.gmtime(self._started_at)), os.getpid()))
+		paths = []
+		if self.cpu:
+			paths.append(prefix + '.collapsed')
+			with open(paths[-1], 'w') as f:
+				for stack, count in self.stacks.most_common():
+					f.write('%s %s\n' % (stack, count))
+		if self.memory:
+			paths.append(prefix + '.alloc.txt')
+			with open(paths[-1], 'w') as f:
+				f.write(self.allocation_report())
+		logger.info('Profiled %s in %.2fs with %s stack samples and %s traced windows, wrote %s.', self.name,
+					time.time() - self._started_at, self.samples, self.windows, ', '.join(paths))
+
+		return paths
+
+	def allocation_report(self):
+		lines = [
+			'Memory still allocated at the end of the profiled %s of %s, top %s lines' % (
+				'stages (%s)' % ', '.join(sorted(self.stages)) if self.stages else 'run', self.name, self.top),
+			'Traced windows: %s, peak traced memory: %.1f KiB, total: %.1f KiB' % (
+				self.windows, self.peak / 1024., sum(self.allocations.values()) / 1024.),
+			'',
+			'%12s %10s  %s' % ('KiB', 'blocks', 'line'),
+		]
+		for (filename, lineno), size in self.allocations.most_common(self.top):
+			lines.append('%12.1f %10s  %s:%s' % (size / 1024., self.allocated_blocks[(filename, lineno)], filename, lineno))
+
+		return '\n'.join(lines) + '\n'
+
+
+def start_profiler(name, modes, stages=None, sample=1., directory='.', **kwargs):
+	"""Start profiling a sampled fraction of runs.
+
+	Parameters
+	----------
+	name : str
+		Name of the profiled run.
+	modes : str
+		Comma separated profiling modes, 'cpu' and/or 'memory'. Profiling is off if empty.
+	stages : str
+		Comma separated stages to profile, the whole run if empty.
+	sample : float
+		Probability that the run is profiled.
+	directory : str
+		Directory to write the profiles to.
+
+	Returns
+	-------
+	The started Profiler, or None if the run is not profiled.
+	"""
+
+	if not modes or random.random() >= sample:
+		return None
+	split = lambda value: tuple(part.strip() for part in value.split(',') if part.strip()) if value else ()
+
+	return Profiler(name, split(modes), split(stages) or None, directory, **kwargs).start()
@@ -0,0 +1,37 @@
+import time
+import threading
+
+
+class RateLimiter:
+	"""Thread safe token bucket capping the rate of requests across all threads.
+
+	Parameters
+	----------
+	rate : float
+		Sustained number of requests per second.
+	burst : int
+		Number of requests which may be sent at once after an idle period.
+	"""
+
+	def __init__(self, rate, burst=1):
+		self.rate = float(rate)
+		self.burst = burst
+		self._tokens = float(burst)
+		self._last = time.monotonic()
+		self._lock = threading.Lock()
+
+	def acquire(self):
+		"""Block until a request may be sent. Returns the seconds waited."""
+
+		waited = 0.
+		while True:
+			with self._lock:
+				now = time.monotonic()
+				self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+				self._last = now
+				if self._tokens >= 1:
+					self._tokens -= 1
+					return waited
+				wait = (1 - self._tokens) / self.rate
+			time.sleep(wait)
+			waited += wait
@@ -0,0 +1,136 @@
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+
+
+logger = logging.getLogger(__name__)
+
+
+# returns -1 while the page is not ready, otherwise the number of rows rendered so far
+READY_SCRIPT = """
+var selector = arguments[0], rows = arguments[1], text = arguments[2], scroll = arguments[3];
+var container = document.querySelector(selector);
+if (!container) { return -1; }
+if (text && container.innerText.indexOf(text) < 0) { return -1; }
+if (scroll) { window.scrollTo(0, document.body.scrollHeight); }
+if (rows) { return document.querySelectorAll(rows).length; }
+return container.innerText.split('\\n').length;
+"""
+
+
+class ReadinessResult:
+	"""Outcome of waiting for a page to become ready."""
+
+	def __init__(self, name, ready, elapsed, rows, polls):
+		self.name = name
+		self.ready = ready
+		self.elapsed = elapsed
+		self.rows = rows
+		self.polls = polls
+
+	def __repr__(self):
+		return 'ReadinessResult(name=%r, ready=%r, elapsed=%.3f, rows=%r, polls=%r)' % (
+			self.name, self.ready, self.elapsed, self.rows, self.polls)
+
+
+class ReadinessLog:
+	"""Keeps the most recent readiness timings per page to tune timeouts from real data."""
+
+	def __init__(self, maxlen=1000):
+		self.maxlen = maxlen
+		self._samples = defaultdict(lambda: deque(maxlen=self.maxlen))
+		self._lock = threading.Lock()
+
+	def record(self, result):
+		with self._lock:
+			self._samples[result.name].append((result.elapsed, result.ready))
+
+	def summary(self, name):
+		"""Summarize the readiness times of a page, timed out loads are included at their timeout."""
+
+		with self._lock:
+			samples = list(self._samples[name])
+		if not samples:
+			return {'count': 0}
+
+		elapsed = sorted(s[0] for s in samples)
+		percentile = lambda p: elapsed[min(len(elapsed) - 1, int(p * len(elapsed)))]
+
+		return {
+			'count': len(samples),
+			'timeouts': sum(1 for s in samples if not s[1]),
+			'p50': round(percentile(.5), 3),
+			'p90': round(percentile(.9), 3),
+			'p99': round(percentile(.99), 3),
+			'max': round(elapsed[-1], 3),
+		}
+
+
+READINESS_LOG = ReadinessLog()
+
+
+def wait_until_ready(driver, selector, rows=None, text=None, min_rows=1, timeout=20, settle=.5,
+					 poll_interval=.1, scroll=True, name=None, log=READINESS_LOG):
+	"""Wait until a page has rendered its table and the number of rows has stopped changing.
+
+	Every poll is a single script round trip which checks the DOM conditions, scrolls to the
+	bottom of the page to trigger lazily loaded content and counts the rendered rows.
+
+	Parameters
+	----------
+	driver : WebDriver
+		Driver which has already navigated to the page.
+	selector : str
+		CSS selector of the element containing the table.
+	rows : str
+		CSS selector of the table rows. If None, the lines of text in the container are counted.
+	text : str
+		Optional text which must be present in the container.
+	min_rows : int
+		Minimum number of rows for the page to be considered ready.
+	timeout : float
+		Hard limit in seconds after which the wait is given up.
+	settle : float
+		Seconds the row count must stay unchanged before the page is ready.
+	poll_interval : float
+		Seconds between two polls.
+	scroll : bool
+		Whether to scroll down on every poll to load dynamic content.
+	name : str
+		Name of the page under which the timing is recorded, defaults to the selector.
+	log : ReadinessLog
+		Log to record the timing in.
+
+	Returns
+	-------
+	ReadinessResult of the wait. The page is not ready if the timeout was hit.
+	"""
+
+	name = name or selector
+	start = time.time()
+	deadline = start + timeout
+	last_count, stable_since, polls = None, start, 0
+
+	while True:
+		count = driver.execute_script(READY_SCRIPT, selector, rows, text, scroll)
+		polls += 1
+		now = time.time()
+		if count != last_count:
+			last_count, stable_since = count, now
+		elif count >= min_rows and now - stable_since >= settle:
+			ready = True
+			break
+		if now >= deadline:
+			ready = False
+			break
+		time.sleep(poll_interval)
+
+	result = ReadinessResult(name, ready, time.time() - start, max(last_count, 0), polls)
+	log.record(result)
+	if ready:
+		logger.info('Page %s was ready after %.2fs with %s rows.', name, result.elapsed, result.rows)
+	else:
+		logger.warning('Page %s was not ready after %.2fs (%s rows), continuing anyway.', name, result.elapsed, result.rows)
+
+	return result
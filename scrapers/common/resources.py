@@ -0,0 +1,189 @@
+import json
+import random
+import logging
+import threading
+from fnmatch import fnmatchcase
+from collections import Counter, defaultdict, deque
+from selenium.common.exceptions import WebDriverException
+
+
+logger = logging.getLogger(__name__)
+
+
+# url patterns of the blockable resource types, in the wildcard syntax of Network.setBlockedURLs
+EXTENSIONS = {
+	'image': ('png', 'jpg', 'jpeg', 'gif', 'webp', 'svg', 'ico', 'bmp', 'avif'),
+	'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+	'media': ('mp4', 'webm', 'ogg', 'ogv', 'mp3', 'wav', 'm3u8', 'mpd', 'mov'),
+}
+TRACKERS = (
+	'*google-analytics.com/*', '*googletagmanager.com/*', '*doubleclick.net/*', '*googlesyndication.com/*',
+	'*googleadservices.com/*', '*connect.facebook.net/*', '*facebook.com/tr*', '*mc.yandex.ru/*', '*hotjar.com/*',
+	'*scorecardresearch.com/*', '*quantserve.com/*', '*adnxs.com/*', '*criteo.com/*', '*criteo.net/*',
+	'*amazon-adsystem.com/*', '*taboola.com/*', '*outbrain.com/*', '*clarity.ms/*', '*bat.bing.com/*',
+)
+DEFAULT_TYPES = ('image', 'font', 'media', 'tracker')
+RENDERING_TYPES = ('Document', 'Script', 'XHR', 'Fetch', 'WebSocket')  # resource types the odds tables can depend on
+
+
+def type_patterns(kind):
+	"""Url patterns of a resource type, with and without a query string."""
+
+	if kind == 'tracker':
+		return TRACKERS
+	if kind not in EXTENSIONS:
+		raise ValueError('Unknown resource type %s.' % kind)
+
+	return tuple(pattern for ext in EXTENSIONS[kind] for pattern in ('*.%s' % ext, '*.%s?*' % ext))
+
+
+class ResourceUsage:
+	"""Requests of a page load read from the performance log of chrome."""
+
+	def __init__(self):
+		self.requests = 0  # requests which went to the network
+		self.blocked = 0
+		self.bytes = 0
+		self.blocked_types = Counter()
+		self.blocked_allowed = []  # blocked urls which matched the allowlist
+
+
+class ResourcePolicy:
+	"""Blocks the resources of a site which its odds do not need, in the browser tier.
+
+	Resources are blocked by url pattern with the DevTools command `Network.setBlockedURLs`,
+	which holds for the tab of a leased session until the pool resets it. Scripts, xhr and fetch
+	requests are never blocked by type,
+	only tracker hosts are, and a blocked request of a rendering type which matches `allow` is
+	logged as an error, since the odds table may depend on it.
+
+	A sampled fraction of the loads runs without the url patterns. Their requests, bytes and
+	load time are the baseline the savings of the blocked loads are reported against.
+
+	Parameters
+	----------
+	types : tuple
+		Resource types to block: 'image', 'font', 'media' and/or 'tracker'.
+	patterns : tuple
+		Additional url patterns of the site to block.
+	allow : tuple
+		Url patterns (fnmatch) of the scripts and requests rendering the odds, which must not be blocked.
+	baseline_sample : float
+		Probability that a load runs without the url patterns, as baseline.
+	log : ResourceLog
+		Log the usage of every load is recorded in.
+	"""
+
+	def __init__(self, types=DEFAULT_TYPES, patterns=(), allow=(), baseline_sample=.05, log=None):
+		self.types = tuple(types)
+		self.patterns = tuple(pattern for kind in self.types for pattern in type_patterns(kind)) + tuple(patterns)
+		self.allow = tuple(allow)
+		self.baseline_sample = baseline_sample
+		self.log = log if log is not None else RESOURCE_LOG
+
+	def apply(self, driver):
+		"""Block the urls of the policy in the current tab, or none for a baseline load. Returns
+		whether the load is a baseline, None if the driver could not block urls.
+		"""
+
+		baseline = random.random() < self.baseline_sample
+		drain_performance_log(driver)  # requests of earlier loads and of the reset
+		try:
+			driver.execute_cdp_cmd('Network.enable', {})
+			driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': [] if baseline else list(self.patterns)})
+		except (AttributeError, WebDriverException) as e:  # not supported by every driver version
+			logger.warning('Could not block resources: %r', e)
+			return None
+
+		return baseline
+
+	def measure(self, driver):
+		"""Read the requests of the load from the performance log. Returns a ResourceUsage."""
+
+		usage = ResourceUsage()
+		requests = {}  # request id -> (type, url)
+		for method, params in read_performance_log(driver):
+			if method == 'Network.requestWillBeSent':
+				requests[params['requestId']] = (params.get('type', 'Other'), params['request']['url'])
+			elif method == 'Network.loadingFinished':
+				usage.bytes += int(params.get('encodedDataLength', 0))
+			elif method == 'Network.loadingFailed' and (params.get('blockedReason') or 'BLOCKED_BY_CLIENT' in params.get('errorText', '')):
+				kind, url = requests.get(params['requestId'], (params.get('type', 'Other'), ''))
+				usage.blocked += 1
+				usage.blocked_types[kind] += 1
+				if kind in RENDERING_TYPES and any(fnmatchcase(url, pattern) for pattern in self.allow):
+					usage.blocked_allowed.append(url)
+		usage.requests = max(0, len(requests) - usage.blocked)  # blocked requests never reach the network
+
+		return usage
+
+	def report(self, driver, name, load_time, baseline):
+		"""Measure the load, record it and log it with the savings against the baseline loads."""
+
+		try:
+			usage = self.measure(driver)
+		except (WebDriverException, KeyError, ValueError) as e:  # chrome launched without performance logging
+			logger.debug('Could not read the requests of %s: %r', name, e)
+			return None
+		for url in usage.blocked_allowed:
+			logger.error('The resource policy of %s blocked %s, which renders the odds.', name, url)
+		self.log.record(name, usage, load_time, baseline)
+		summary = self.log.summary(name)
+		logger.info('%s load of %s: %s requests, %s blocked (%s), %.1f KiB in %.2fs; %s', 'Baseline' if baseline else 'Blocked',
+					name, usage.requests, usage.blocked, ', '.join('%s %s' % item for item in usage.blocked_types.most_common()) or 'none',
+					usage.bytes / 1024., load_time, 'saving %(requests_saved)s requests, %(kib_saved)s KiB and %(seconds_saved)ss '
+					'per load against %(baseline_loads)s baseline loads.' % summary if 'requests_saved' in summary else 'no savings to compare yet.')
+
+		return usage
+
+
+def drain_performance_log(driver):
+	try:
+		driver.get_log('performance')
+	except WebDriverException:  # performance logging is off
+		pass
+
+
+def read_performance_log(driver):
+	"""Yield the method and params of the DevTools network events in the performance log."""
+
+	for entry in driver.get_log('performance'):
+		message = json.loads(entry['message'])['message']
+		if message['method'].startswith('Network.'):
+			yield message['method'], message['params']
+
+
+class ResourceLog:
+	"""Keeps the requests, bytes and load times of the recent blocked and baseline loads per page."""
+
+	def __init__(self, maxlen=100):
+		self.maxlen = maxlen
+		self._samples = defaultdict(lambda: (deque(maxlen=self.maxlen), deque(maxlen=self.maxlen)))
+		self._lock = threading.Lock()
+
+	def record(self, name, usage, load_time, baseline=False):
+		with self._lock:
+			self._samples[name][int(baseline)].append((usage.requests, usage.bytes, load_time))
+
+	def summary(self, name):
+		"""Average requests, KiB and load time of the blocked loads of a page, and what they saved
+		against the baseline loads, if there are any.
+		"""
+
+		with self._lock:
+			blocked, baseline = (list(samples) for samples in self._samples[name])
+		mean = lambda samples, idx: sum(s[idx] for s in samples) / len(samples)
+		summary = {'loads': len(blocked), 'baseline_loads': len(baseline)}
+		if blocked:
+			summary.update(requests=round(mean(blocked, 0), 1), kib=round(mean(blocked, 1) / 1024., 1), seconds=round(mean(blocked, 2), 3))
+		if blocked and baseline:
+			summary.update(
+				requests_saved=round(mean(baseline, 0) - mean(blocked, 0), 1),
+				kib_saved=round((mean(baseline, 1) - mean(blocked, 1)) / 1024., 1),
+				seconds_saved=round(mean(baseline, 2) - mean(blocked, 2), 3),
+			)
+
+		return summary
+
+
+RESOURCE_LOG = ResourceLog()
@@ -0,0 +1,132 @@
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+NO_MATCH_LEAD = 24 * 3600.  # lead time of a site without an upcoming match, when jobs are ranked
+
+
+def next_match_time(rows, now=None):
+	"""Get the earliest match start of a batch of odds which is still ahead, or None.
+
+	Unknown match times are -1 and started matches are in the past, both are ignored.
+	"""
+
+	now = time.time() if now is None else now
+	if 'match_time' not in getattr(rows, 'columns', ()):
+		return None
+	upcoming = [match_time for match_time in rows.column('match_time') if match_time is not None and match_time > now]
+
+	return min(upcoming) if upcoming else None
+
+
+class AdaptiveSchedule:
+	"""Interval between two scrapes of a site, driven by its upcoming matches and by odds movement.
+
+	Odds of a match move fastest close to its start, so the interval shrinks to `lead_fraction`
+	of the time left until the next match of the site starts. Every run in which no odds moved
+	multiplies the interval by `backoff`, and a run with moved odds resets it to `interval`. The
+	result is kept between `min_interval` and `max_interval`.
+
+	Parameters
+	----------
+	interval : float
+		Seconds between two runs of the site while its odds move and no match is close.
+	min_interval : float
+		Lower bound of the interval, when a match is about to start.
+	max_interval : float
+		Upper bound of the interval, after many runs without odds movement.
+	lead_fraction : float
+		Fraction of the time until the next match start the interval is shortened to.
+	backoff : float
+		Growth of the interval per consecutive run without odds movement.
+	"""
+
+	def __init__(self, interval, min_interval=60., max_interval=1800., lead_fraction=.1, backoff=1.5):
+		self.base_interval = interval
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.lead_fraction = lead_fraction
+		self.backoff = backoff
+		self.quiet_runs = 0  # consecutive runs without odds movement
+		self.next_match = None  # earliest upcoming match start seen in the last run
+
+	def update(self, rows, moved, now=None):
+		"""Take the rows of a finished run and the number of rows whose odds moved in it.
+
+		`moved` is None if the movement is unknown, e.g. if the run produced no rows, in which
+		case the backoff stays as it is. Returns the interval until the next run.
+		"""
+
+		now = time.time() if now is None else now
+		if rows is not None and len(rows) > 0:
+			self.next_match = next_match_time(rows, now)
+		if moved is not None:
+			self.quiet_runs = 0 if moved else self.quiet_runs + 1
+
+		return self.interval(now)
+
+	def lead(self, now=None):
+		"""Seconds until the next known match start, None if there is none."""
+
+		now = time.time() if now is None else now
+		if self.next_match is None or self.next_match <= now:
+			return None
+
+		return self.next_match - now
+
+	def interval(self, now=None):
+		interval = min(self.base_interval * self.backoff ** self.quiet_runs, self.max_interval)
+		lead = self.lead(now)
+		if lead is not None:
+			interval = min(interval, lead * self.lead_fraction)
+
+		return max(self.min_interval, min(interval, self.max_interval))
+
+
+class ScrapeBudget:
+	"""Token bucket limiting the page loads of all jobs of a worker.
+
+	Tokens refill at `per_hour` per hour up to `burst`, every run takes one. Sites which back off
+	leave their tokens to the sites with matches about to start.
+
+	Parameters
+	----------
+	per_hour : float
+		Page loads per hour.
+	burst : float
+		Maximum number of tokens saved up, the bucket starts full.
+	"""
+
+	def __init__(self, per_hour, burst=1.):
+		self.per_hour = per_hour
+		self.rate = per_hour / 3600.
+		self.burst = max(1., burst)
+		self.tokens = self.burst
+		self.taken = self.denied = 0
+		self._updated_at = time.time()
+
+	def _refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self._updated_at) * self.rate)
+		self._updated_at = now
+
+	def take(self, now=None):
+		"""Take a token if one is left. Returns whether one was taken."""
+
+		self._refill(time.time() if now is None else now)
+		if self.tokens < 1.:
+			self.denied += 1
+			return False
+		self.tokens -= 1.
+		self.taken += 1
+
+		return True
+
+	def wait_time(self, now=None):
+		"""Seconds until the next token is available."""
+
+		self._refill(time.time() if now is None else now)
+
+		return max(0., (1. - self.tokens) / self.rate) if self.rate > 0 else float('inf')
@@ -0,0 +1,29 @@
+import os
+import sys
+import importlib
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # the scrapers directory
+SITES = ('ggbet', 'egb', 'rivalry', 'hltv', 'hltv_results')
+ODDS_SITES = ('ggbet', 'egb', 'rivalry', 'hltv')
+SITE_MODULES = ('scraper', 'utils', 'config', 'stopwords')  # module names every site uses for its own modules
+
+
+def load_site(site, modules=('scraper', 'config')):
+	"""Import modules of a site, by default its scraper and config, into a process running
+	several sites. Returns a tuple of the modules.
+
+	The sites share their module names, so the modules of a site are imported from its directory
+	under their plain names and removed from `sys.modules` again. The scraper keeps the references
+	to its own utils and config modules.
+	"""
+
+	for name in SITE_MODULES:
+		sys.modules.pop(name, None)
+	sys.path.insert(0, os.path.join(ROOT, site))
+	try:
+		return tuple(importlib.import_module(name) for name in modules)
+	finally:
+		sys.path.pop(0)
+		for name in SITE_MODULES:
+			sys.modules.pop(name, None)
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotArchive:
+	"""Compressed, content addressed archive of the page payloads the scrapers transcribed.
+
+	A payload is stored once as a zlib compressed json file named by the sha256 of its content,
+	so unchanged pages of consecutive scrapes take no extra space. A SQLite index lists every
+	snapshot by site and scrape time, which lets `replay.py` re-run the current transcribe
+	functions over archived pages without network access.
+
+	Parameters
+	----------
+	root : str
+		Directory of the archive, created if it does not exist.
+	level : int
+		zlib compression level.
+	"""
+
+	def __init__(self, root, level=6):
+		self.root = root
+		self.level = level
+		os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+		self._lock = threading.Lock()
+		self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=30., check_same_thread=False)
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS snapshots (
+				id INTEGER PRIMARY KEY,
+				site TEXT NOT NULL,
+				url TEXT NOT NULL,
+				tier TEXT NOT NULL,
+				scrape_time INTEGER NOT NULL,
+				digest TEXT NOT NULL,
+				size INTEGER NOT NULL,
+				rows INTEGER NOT NULL
+			)
+		""")
+		self.conn.execute('CREATE INDEX IF NOT EXISTS snapshots_site_time ON snapshots (site, scrape_time)')
+		self.conn.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		self.conn.close()
+
+	def path(self, digest):
+		return os.path.join(self.root, 'objects', digest[:2], digest[2:] + '.json.z')
+
+	def save(self, site, url, tier, payload, rows=0, scrape_time=None):
+		"""Archive a page payload and index it. Returns the digest of the payload.
+
+		Parameters
+		----------
+		site : str
+			Name of the scraped site.
+		url : str
+			Url of the page.
+		tier : str
+			Fetch tier which served the page.
+		payload : dict
+			Extracted page payload, as handed to the transcribe function of the site.
+		rows : int
+			Number of rows the payload was transcribed to.
+		scrape_time : int
+			Unix timestamp of the scrape, defaults to now.
+		"""
+
+		data = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+		digest = hashlib.sha256(data).hexdigest()
+		path = self.path(digest)
+		if not os.path.exists(path):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			tmp_path = '%s.%s.tmp' % (path, threading.get_ident())
+			with open(tmp_path, 'wb') as f:
+				f.write(zlib.compress(data, self.level))
+			os.replace(tmp_path, path)
+
+		scrape_time = int(time.time()) if scrape_time is None else scrape_time
+		with self._lock, self.conn:
+			self.conn.execute(
+				'INSERT INTO snapshots (site, url, tier, scrape_time, digest, size, rows) VALUES (?, ?, ?, ?, ?, ?, ?)',
+				(site, url, tier, scrape_time, digest, len(data), rows)
+			)
+		logger.debug('Archived the %s page of %s as %s.', tier, site, digest[:12])
+
+		return digest
+
+	def load(self, digest):
+		"""Get the payload of a digest."""
+
+		with open(self.path(digest), 'rb') as f:
+			return json.loads(zlib.decompress(f.read()).decode('utf-8'))
+
+	def find(self, site, start=None, end=None):
+		"""Get the (scrape time, url, tier, digest) tuples of the snapshots of a site in [start, end), oldest first."""
+
+		with self._lock:
+			return self.conn.execute("""
+				SELECT scrape_time, url, tier, digest FROM snapshots
+				WHERE site = ? AND scrape_time >= ? AND scrape_time < ?
+				ORDER BY scrape_time, id
+			""", (site, start or 0, end or 2 ** 62)).fetchall()
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+
+from common.batch import Batch
+from common.db import WriteResult
+
+
+logger = logging.getLogger(__name__)
+
+
+FLUSH = 'flush'  # queued by `WriteBehind.flush`, the rows collected so far are written right away
+
+
+class Spool:
+	"""Append-only local file of rows which could not be written to the database.
+
+	Every append is one json line holding a batch of rows and is synced to disk before it
+	returns. A replay moves the file aside first, so rows spooled during a replay are kept
+	for the next one.
+
+	Parameters
+	----------
+	path : str
+		Path of the spool file.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.replay_path = path + '.replay'
+		self._lock = threading.Lock()
+
+	def append(self, rows):
+		with self._lock:
+			with open(self.path, 'a') as f:
+				f.write(json.dumps(list(rows)) + '\n')
+				f.flush()
+				os.fsync(f.fileno())
+		logger.warning('Spooled %s rows to %s.', len(rows), self.path)
+
+	def pending(self):
+		"""Check if there are spooled rows left to replay."""
+
+		return any(os.path.exists(p) and os.path.getsize(p) > 0 for p in (self.path, self.replay_path))
+
+	@staticmethod
+	def _read(path):
+		batches = []
+		with open(path) as f:
+			for line in f:
+				try:
+					batches.append([tuple(row) for row in json.loads(line)])
+				except ValueError:
+					logger.error('Skipping a corrupt line of the spool file %s.', path)  # torn write of a crash
+
+		return batches
+
+	def replay(self, write, batch_size=10000):
+		"""Write all spooled rows in bulk.
+
+		Spooled batches are merged into writes of `batch_size` rows. If a write fails, the rows
+		not written yet stay spooled for the next replay.
+
+		Parameters
+		----------
+		write : callable
+			Writes a list of rows and returns a WriteResult.
+		batch_size : int
+			Maximum number of rows per write.
+
+		Returns
+		-------
+		WriteResult of all writes.
+		"""
+
+		with self._lock:
+			# a replay file left by an interrupted replay is replayed first, new rows are added to it
+			if os.path.exists(self.path):
+				with open(self.path) as src, open(self.replay_path, 'a') as dst:
+					dst.write(src.read())
+					dst.flush()
+					os.fsync(dst.fileno())
+				os.remove(self.path)
+		if not os.path.exists(self.replay_path):
+			return WriteResult(0, 0, 0.)
+
+		batches = self._read(self.replay_path)
+		rows = [row for batch in batches for row in batch]
+		groups = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+		results = []
+		for idx, rows in enumerate(groups):
+			result = write(rows)
+			results.append(result)
+			if not result.ok:
+				remaining = groups[idx:]
+				with open(self.replay_path + '.tmp', 'w') as f:
+					for rows in remaining:
+						f.write(json.dumps(rows) + '\n')
+					f.flush()
+					os.fsync(f.fileno())
+				os.replace(self.replay_path + '.tmp', self.replay_path)
+				logger.error('Replay of %s failed, %s rows stay spooled.', self.path, sum(len(g) for g in remaining))
+				break
+		else:
+			os.remove(self.replay_path)
+
+		result = WriteResult.combine(results)
+		logger.info('Replayed %s of %s spooled rows in %.3fs.', result.written, result.rows, result.elapsed)
+
+		return result
+
+
+class WriteBehind:
+	"""Writes rows to the database in a background thread, spilling to a spool when the database is unavailable.
+
+	Scrapers `put` rows onto a bounded queue and return right away. The writer thread drains
+	the queue in batches of the writer's batch size, and writes a smaller batch once its first
+	rows waited for the writer's `max_delay` seconds, or on `flush`. A failed batch is spooled, and further
+	batches go straight to the spool until `retry_interval` has passed. Once a write succeeds
+	again the spool is replayed in bulk. If the queue is full because the database is slow,
+	rows are spooled by the caller instead of blocking the scrape.
+
+	Parameters
+	----------
+	writer : BulkWriter
+		Writer of the target table.
+	spool : Spool
+		Spool of the target table.
+	max_queue : int
+		Maximum number of queued row batches.
+	retry_interval : float
+		Seconds to wait after a failed write before the database is tried again.
+	"""
+
+	def __init__(self, writer, spool, max_queue=1000, retry_interval=30.):
+		self.writer = writer
+		self.spool = spool
+		self.retry_interval = retry_interval
+		self.queued = self.written = self.spooled = self.replayed = 0
+		self._queue = queue.Queue(maxsize=max_queue)
+		self._retry_at = 0.
+		self._carry = writer.batch_type()
+		self._closed = False
+		self._unhandled = 0  # queued rows which were neither written nor spooled yet
+		self._handled = threading.Condition()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def put(self, rows):
+		"""Queue rows for writing without waiting for the database."""
+
+		if not isinstance(rows, Batch):
+			rows = self.writer.batch_type(rows)
+		if not rows:
+			return
+		self.queued += len(rows)
+		with self._handled:
+			self._unhandled += len(rows)
+		try:
+			self._queue.put_nowait(rows)
+		except queue.Full:
+			logger.warning('Write queue is full, spooling %s rows.', len(rows))
+			self._spool(rows)
+			self._mark_handled(rows)
+
+	def _mark_handled(self, rows):
+		with self._handled:
+			self._unhandled -= len(rows)
+			self._handled.notify_all()
+
+	def flush(self, timeout=None):
+		"""Wait until all queued rows were written or spooled. Returns False on a timeout."""
+
+		try:
+			self._queue.put_nowait(FLUSH)
+		except queue.Full:  # the queue holds more than a batch, which is written without waiting
+			pass
+		with self._handled:
+			return self._handled.wait_for(lambda: self._unhandled <= 0, timeout)
+
+	def _spool(self, rows):
+		self.spool.append(rows)
+		self.spooled += len(rows)
+
+	def _write(self, rows):
+		return WriteResult.combine(self.writer.write(rows) + self.writer.flush())
+
+	def _drain(self):
+		"""Wait for queued rows and collect them into a batch. Returns the rows and whether the queue was closed."""
+
+		rows = self._carry
+		if not rows and not self._closed:
+			rows = self._queue.get()
+			if rows is None:
+				return [], True
+			if rows is FLUSH:
+				return [], False
+		rows = self.writer.batch_type(rows)  # a copy to append to
+		deadline = time.time() + self.writer.max_delay
+		while len(rows) < self.writer.batch_size and not self._closed:
+			try:
+				more = self._queue.get(timeout=max(0., deadline - time.time()))
+			except queue.Empty:
+				break
+			if more is FLUSH:
+				break
+			if more is None:
+				self._closed = True
+				break
+			rows.extend(more)
+		# one write per batch, so a failed batch is spooled without duplicating written rows
+		rows, self._carry = rows[:self.writer.batch_size], rows[self.writer.batch_size:]
+
+		return rows, self._closed and not self._carry
+
+	def _run(self):
+		if self.spool.pending():
+			self._replay()
+		closed = False
+		while not closed:
+			rows, closed = self._drain()
+			if not rows:
+				continue
+			if time.time() < self._retry_at:
+				self._spool(rows)
+				self._mark_handled(rows)
+				continue
+			result = self._write(rows)
+			if not result.ok:
+				self._retry_at = time.time() + self.retry_interval
+				self._spool(rows)
+				self._mark_handled(rows)
+				continue
+			self.written += result.written
+			self._mark_handled(rows)
+			if self.spool.pending():
+				self._replay()
+
+	def _replay(self):
+		result = self.spool.replay(self._write, self.writer.batch_size)
+		self.replayed += result.written
+		if not result.ok:
+			self._retry_at = time.time() + self.retry_interval
+
+	def close(self):
+		"""Write all queued rows, spooling what can not be written, and stop the writer thread."""
+
+		self._queue.put(None)
+		self._thread.join()
+		self.writer.close()
+		logger.info('Write-behind: %s rows queued, %s written, %s spooled, %s replayed.',
+					self.queued, self.written, self.spooled, self.replayed)
@@ -3,6 +3,50 @@
 EGB_URL = 'https://egb.com/esports/counter-strike#'
 
 
+READINESS = {  # DOM conditions for the odds table to be loaded
+	'selector': '.table-bets',
+	'timeout': 20,
+}
+
+
+EXTRACTION = {  # DOM fields read in one round trip
+	'table': {'selector': '.table-bets', 'first': True},
+}
+
+
+FETCH_TIERS = ('browser',)  # single page app, the static html has no odds
+
+
+RESOURCES = {  # resources blocked in the browser tier, see common/resources.py
+	'types': ('image', 'font', 'media', 'tracker'),
+	'allow': ('*egb.com/*',),  # scripts and api requests of the site render the odds table
+	'baseline_sample': .05,  # fraction of the loads without blocking, to measure the savings
+}
+
+
+CHANGE_DETECTION = {  # rows with unchanged odds are only written as hourly heartbeats
+	'ttl': 24 * 3600,
+	'heartbeat': 3600,
+}
+
+
+SPOOL_FILE = 'egb.spool'  # rows which could not be written, replayed on the next run
+
+
+METRICS_FILE = 'egb.prom'  # metrics of the last run, written to the METRICS_DIR directory
+
+
+WORKER_INTERVAL = 5 * 60  # seconds between two runs in a long-running worker, see worker.py
+
+
+SCHEDULE = {  # adaptive intervals of the worker around WORKER_INTERVAL, see common/schedule.py
+	'min_interval': 60,  # when a match is about to start
+	'max_interval': 30 * 60,  # after many runs without odds movement
+	'lead_fraction': .1,  # a match starting in an hour is scraped at least every 6 minutes
+	'backoff': 1.5,  # interval growth per run without odds movement
+}
+
+
 LOGGING = {
 	'disable_existing_loggers': False,
 	'version': 1,
@@ -26,6 +70,10 @@ LOGGING = {
 		'DEV': {
 			'handlers': ['console'],
 			'level': 'DEBUG',
+		},
+		'common': {  # fetch, write and browser timings of the shared modules
+			'handlers': ['console'],
+			'level': 'INFO',
 		}
 	}
 }
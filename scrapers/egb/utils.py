@@ -2,53 +2,56 @@ import re
 import time
 import logging
 import datetime
-import psycopg2
+import itertools
+from common.batch import OddsBatch
 
 
 logger = logging.getLogger(__name__)
 
 
-def insert_row_breaks(flattened_table, break_token='ROW_BREAK'):
-	"""For tokenized table data insert row breaks."""
+TIME_TOKEN = re.compile(r'^(\d{1,2}(:\d{1,2}))$')
 
-	processed_flattened_table, insert_counter = [], 0
-	for tok_idx, token in enumerate(flattened_table):
 
-		# identify row break location and insert token
-		if re.search(r'^(\d{1,2}(:\d{1,2}))$', token):
-			processed_flattened_table.insert(tok_idx + insert_counter - 1, break_token)
-			insert_counter += 1
-		elif token == 'Live!':
-			processed_flattened_table.insert(tok_idx + insert_counter, break_token)
-			insert_counter += 1
-		processed_flattened_table.append(token)
+def iter_lines(text):
+	"""Yield the lines of a text one at a time, without splitting the whole text."""
 
-	# clean up first item if identified as row break
-	if processed_flattened_table[0] == break_token:
-		processed_flattened_table.pop(0)
+	start = 0
+	end = text.find('\n')
+	while end != -1:
+		yield text[start:end]
+		start = end + 1
+		end = text.find('\n', start)
+	yield text[start:]
 
-	return processed_flattened_table
 
+def iter_rows(tokens):
+	"""Group a stream of table tokens into rows.
 
-def reformat_list_to_table(flattened_table, break_token='ROW_BREAK'):
-	"""Given a flattened table with row break tokens, reformat into 2d array."""
+	A row starts with the date token in front of a time token, or with a 'Live!' token. Every
+	token is held back by one step, so a row is yielded as soon as the next row starts. The
+	tokens after the last row start are not yielded, since that row may be incomplete.
+	"""
 
-	table, row = [], []
-	for token in flattened_table:
-		if token == break_token:
-			table.append(row)
+	row, previous = [], None
+	for token in tokens:
+		if TIME_TOKEN.search(token):  # the date in front of the time starts the next row
+			yield row
+			row = [] if previous is None else [previous]
+		elif token == 'Live!':
+			if previous is not None:
+				row.append(previous)
+			yield row
 			row = []
-			continue
-		row.append(token)
+		elif previous is not None:
+			row.append(previous)
+		previous = token
 
-	return table
 
-
-def get_match_time(tm, dt):
-	"""Convert time and date to match time timestamp."""
+def get_match_time(tm, dt, year=None):
+	"""Convert time and date to match time timestamp, in the current year or in `year`."""
 
 	try:  # TODO: implement robust year filling method
-		match_time = datetime.datetime.strptime(dt + ' ' + tm, '%d.%m %H:%M').replace(year=datetime.datetime.now().year)
+		match_time = datetime.datetime.strptime(dt + ' ' + tm, '%d.%m %H:%M').replace(year=year or datetime.datetime.now().year)
 		match_time = int(datetime.datetime.timestamp(match_time))
 	except ValueError:
 		match_time = -1
@@ -71,7 +74,7 @@ def transcribe_row_data(row, scrape_time):
 	dt, tm, tournament_name, contestant_1, contestant_1_odds, contestant_2, contestant_2_odds = row
 	contestant_1_odds = string_to_float(contestant_1_odds)
 	contestant_2_odds = string_to_float(contestant_2_odds)
-	match_time = get_match_time(tm, dt)
+	match_time = get_match_time(tm, dt, datetime.datetime.fromtimestamp(scrape_time).year if scrape_time else None)
 	source, bet_type, draw_odds = 'egb', 'winner', -1
 	row = (
 		contestant_1, contestant_2, contestant_1_odds, contestant_2_odds, draw_odds,
@@ -81,35 +84,31 @@ def transcribe_row_data(row, scrape_time):
 	return row
 
 
-def postgres_db_insert(data, db_credentials):
-	"""Insert odds data into database.
+def transcribe_table(text, scrape_time, header_lines=6):
+	"""Transcribe the text of the odds table into database rows.
 
-	PARAMS
-	------
-	data : list of tuples
-		List of tuples containing ordered entries of team_1, team_2, team_1_winner_odds, team_2_winner_odds,
-		scrape_time, match_time, tournament_name, source.
-	db_credentials : dict
-		A dictionary containing key-value log in credentials for the database.
-	"""
+	Parameters
+	----------
+	text : str
+		Text of the odds table, one token per line.
+	scrape_time : int
+		Unix timestamp of the scrape.
+	header_lines : int
+		Number of lines of the table header.
 
-	conn = None
-	insert_statement = """
-		INSERT INTO csgo_winner_odds (
-			team_1, team_2, team_1_winner_odds, team_2_winner_odds, draw_odds, bet_type, scrape_time, match_time, tournament_name, source
-		)
-		VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+	Returns
+	-------
+	Generator of tuples ready for database insertion. Rows of live games are skipped.
 	"""
 
-	try:
-		conn = psycopg2.connect(**db_credentials)
-		cursor = conn.cursor()
-		cursor.executemany(insert_statement, data)
-		conn.commit()
-		cursor.close()
-		logger.info('Inserted %s rows.', len(data))
-	except psycopg2.DatabaseError:
-		logger.error('Failed to insert %s rows into database.', len(data))
-	finally:
-		if conn:
-			conn.close()
+	for row in iter_rows(itertools.islice(iter_lines(text), header_lines, None)):
+		if len(row) == 7:  # filter out live games
+			yield transcribe_row_data(row, scrape_time)
+
+
+def transcribe_page(page, scrape_time=None):
+	"""Transcribe the extracted egb page into an `OddsBatch`, scraped now or at `scrape_time`."""
+
+	scrape_time = int(time.time()) if scrape_time is None else scrape_time
+
+	return OddsBatch(transcribe_table(page['table'] or '', scrape_time))
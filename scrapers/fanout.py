@@ -0,0 +1,149 @@
+"""Scrape all odds sites at the same time into one snapshot of the market.
+
+The scrape functions of the sites run concurrently in threads, sharing a browser pool with a
+chrome session per site, so a snapshot takes about as long as its slowest site instead of the
+sum of all sites. Sites which did not finish within `FANOUT_DEADLINE` seconds are left out of
+the snapshot. Every row is stamped with the same snapshot id, the start time of the snapshot,
+in the snapshot_id column of the odds table, and all rows are written in one batch.
+
+The rows of a snapshot are complete: they do not pass the change detection of the single site
+scrapes, so the odds of all sites can be compared within one snapshot.
+
+Usage: python fanout.py [SITE ...]
+"""
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from common.batch import OddsBatch, SnapshotOddsBatch
+from common.browser import BrowserPool
+from common.db import BulkWriter, RunRecorder, ODDS_TABLE, SNAPSHOT_COLUMN, add_snapshot_column
+from common.fetcher import TieredFetcher
+from common.metrics import METRICS
+from common.sites import ODDS_SITES, load_site
+from common.snapshots import SnapshotArchive
+from common.writebehind import WriteBehind, Spool
+
+
+# get os config variables, the scrapers read the others
+ENVIRONMENT = os.environ['ENVIRONMENT']
+DB_CREDENTIALS = {
+	'host': os.environ['DB_HOST'],
+	'user': os.environ['DB_USER'],
+	'password': os.environ['DB_PASSWORD'],
+	'dbname': os.environ['DB_NAME']
+}
+SPOOL_PATH = os.path.join(os.environ.get('SPOOL_DIR', '.'), 'fanout.spool')
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')  # archive of the scraped pages, off if not set
+METRICS_DIR = os.environ.get('METRICS_DIR')  # textfile collector directory of the run metrics, off if not set
+FANOUT_DEADLINE = float(os.environ.get('FANOUT_DEADLINE', 90))  # seconds until the sites still running are left out
+
+
+logger = logging.getLogger(ENVIRONMENT)
+
+
+def scrape_site(site, scraper, fetcher):
+	METRICS.start_run(site)
+	return scraper.scrape(fetcher)
+
+
+def fan_out(scrapers, fetcher, deadline):
+	"""Scrape the sites concurrently until a deadline.
+
+	Parameters
+	----------
+	scrapers : dict
+		Scraper module of every site.
+	fetcher : TieredFetcher
+		Fetcher shared by all sites, with a chrome session per site in its pool.
+	deadline : float
+		Seconds after which sites which are still running are left out.
+
+	Returns
+	-------
+	dict of the FetchResult of every finished site, and dict of the error of every failed or late site.
+	"""
+
+	executor = ThreadPoolExecutor(len(scrapers))
+	futures = {executor.submit(scrape_site, site, scraper, fetcher): site for site, scraper in scrapers.items()}
+	done, late = wait(futures, timeout=deadline)
+	executor.shutdown(wait=False)  # late sites are not waited for, they fail once the browser pool closes
+
+	results, errors = {}, {}
+	for future in done:
+		site = futures[future]
+		try:
+			results[site] = future.result()
+		except Exception as e:
+			logger.exception('The scrape of %s failed.', site)
+			errors[site] = repr(e)
+	for future in late:
+		logger.warning('%s missed the deadline of %ss, it is left out of the snapshot.', futures[future], deadline)
+		errors[futures[future]] = 'missed the deadline of %ss' % deadline
+
+	return results, errors
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('sites', nargs='*', help='sites to scrape, all odds sites by default: %s' % ', '.join(ODDS_SITES))
+	args = parser.parse_args()
+	sites = args.sites or list(ODDS_SITES)
+	unknown = set(sites) - set(ODDS_SITES)
+	if unknown:
+		parser.error('unknown odds sites: %s' % ', '.join(sorted(unknown)))
+
+	scrapers = {site: load_site(site)[0] for site in sites}
+	logger.info('Starting a snapshot of %s.', ', '.join(sites))
+
+	start = time.time()
+	snapshot_id = int(start)
+	METRICS.start_run('fanout')
+	archive = SnapshotArchive(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+	with BrowserPool(size=len(sites)) as pool:
+		results, errors = fan_out(scrapers, TieredFetcher(pool, archive=archive), FANOUT_DEADLINE)
+	scraped = time.time() - start
+
+	# the odds are written without their snapshot id rather than spooled until the column exists
+	batch_type = SnapshotOddsBatch
+	if ENVIRONMENT == 'PRODUCTION' and not add_snapshot_column(DB_CREDENTIALS):
+		logger.error('The %s column is missing from %s, the odds of snapshot %s are written without it.',
+					 SNAPSHOT_COLUMN, ODDS_TABLE, snapshot_id)
+		errors['fanout'] = 'missing %s column' % SNAPSHOT_COLUMN
+		batch_type = OddsBatch
+	snapshot = batch_type()
+	for site in sites:
+		if site in results:
+			snapshot.extend(results[site].rows, {SNAPSHOT_COLUMN: snapshot_id})
+	logger.info('Snapshot %s has %s rows of %s of %s sites, scraped in %.2fs, %.2fs of scraping in total, slowest %s.',
+				snapshot_id, len(snapshot), len(results), len(sites), scraped, sum(r.elapsed for r in results.values()),
+				max(results, key=lambda site: results[site].elapsed) if results else None)
+
+	# insert to db in one batch
+	if ENVIRONMENT == 'PRODUCTION' and len(snapshot) > 0:
+		writer = BulkWriter(DB_CREDENTIALS, ODDS_TABLE, batch_type, batch_size=len(snapshot), name='fanout')
+		with WriteBehind(writer, Spool(SPOOL_PATH)) as sink:
+			sink.put(snapshot)
+	elif len(snapshot) == 0:
+		logger.warning('The snapshot produced 0 data points.')
+	else:
+		logger.info('Produced data: %s', snapshot)
+	if archive is not None:
+		archive.close()
+
+	# record the runs
+	summaries = [METRICS.finish_run(site, results[site].tier if site in results else None, errors.get(site)) for site in sites]
+	METRICS.count_rows('fanout', 'produced', snapshot)
+	summaries.append(METRICS.finish_run('fanout', None, '; '.join('%s: %s' % item for item in sorted(errors.items())) or None))
+	if ENVIRONMENT == 'PRODUCTION':
+		with RunRecorder(DB_CREDENTIALS) as recorder:
+			for summary in summaries:
+				recorder.record(summary)
+	if METRICS_DIR:
+		METRICS.write_textfile(os.path.join(METRICS_DIR, 'fanout.prom'))
+
+
+if __name__ == '__main__':
+	main()
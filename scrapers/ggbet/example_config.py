@@ -3,6 +3,20 @@
 GGBET_URL = 'https://gg.bet/en/counter-strike'
 
 
+READINESS = {  # DOM conditions for the odds table to be loaded
+	'selector': '#betting__container',
+	'timeout': 20,
+}
+
+
+EXTRACTION = {  # DOM fields read in one round trip
+	'table': {'selector': '#betting__container', 'first': True},
+}
+
+
+FETCH_TIERS = ('browser',)  # single page app, the static html has no odds
+
+
 LOGGING = {
 	'disable_existing_loggers': False,
 	'version': 1,
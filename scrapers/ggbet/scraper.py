@@ -1,12 +1,20 @@
 import os
-import time
 import sentry_sdk
 import logging.config
-from bs4 import BeautifulSoup
-from selenium import webdriver
 
-from utils import remove_header, insert_row_breaks, transcribe_table_data, postgres_db_insert
-from config import GGBET_URL, LOGGING
+from common.browser import BrowserPool
+from common.changes import ChangeFilter
+from common.batch import OddsBatch
+from common.db import BulkWriter, ODDS_TABLE, record_run
+from common.fetcher import TieredFetcher
+from common.metrics import METRICS
+from common.profiling import start_profiler
+from common.resources import ResourcePolicy
+from common.parsecache import ParseCache
+from common.snapshots import SnapshotArchive
+from common.writebehind import WriteBehind, Spool
+from utils import transcribe_page
+from config import GGBET_URL, LOGGING, READINESS, EXTRACTION, FETCH_TIERS, RESOURCES, CHANGE_DETECTION, SPOOL_FILE, PARSE_CACHE, METRICS_FILE
 
 
 # get os config variables
@@ -18,6 +26,13 @@ DB_CREDENTIALS = {
 	'password': os.environ['DB_PASSWORD'],
 	'dbname': os.environ['DB_NAME']
 }
+SPOOL_PATH = os.path.join(os.environ.get('SPOOL_DIR', '.'), SPOOL_FILE)
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')  # archive of the scraped pages, off if not set
+METRICS_DIR = os.environ.get('METRICS_DIR')  # textfile collector directory of the run metrics, off if not set
+PROFILE = os.environ.get('PROFILE')  # profiling of the run, "cpu" and/or "memory", off if not set
+PROFILE_STAGES = os.environ.get('PROFILE_STAGES')  # profiled stages, e.g. "parse" or "write", the whole run if not set
+PROFILE_SAMPLE = float(os.environ.get('PROFILE_SAMPLE', 1.))  # fraction of the runs which are profiled
+GGBET_URL = os.environ.get('GGBET_URL', GGBET_URL)  # set to scrape a stub site, see benchmarks/end_to_end.py
 
 
 # initialize logging and monitoring
@@ -27,33 +42,91 @@ if ENVIRONMENT == 'PRODUCTION':
 	sentry_sdk.init(SENTRY_URL)
 
 
-if __name__ == '__main__':
+# resources blocked in the browser tier, with the savings per load
+resources = ResourcePolicy(**RESOURCES)
 
-	logger.info('Starting scrape job for ggbet table data.')
 
-	# initialize headless selenium webdriver
-	chrome_options = webdriver.ChromeOptions()
-	chrome_options.add_argument('--headless')
-	chrome_options.add_argument('--no-sandbox')
-	chrome_options.add_argument('--disable-dev-shm-usage')
-	driver = webdriver.Chrome(chrome_options=chrome_options)
-
-	# load website
-	driver.get(GGBET_URL)
-	html = driver.page_source
-	time.sleep(5)  # give webpage time to load table
-	driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")  # scroll down to load dynamic content
-	time.sleep(1)
-
-	# transcribe data table
-	table = driver.find_element_by_id('betting__container').text
-	soup = BeautifulSoup(table, 'html.parser')
-	table_text = remove_header(soup.text)
-	table_text = insert_row_breaks(table_text)
-	table_rows = table_text.split('_ROW_BREAK_')
-	formatted_data = transcribe_table_data(table_rows)
+# rows of unchanged tournaments, kept as long as the worker runs
+parse_cache = ParseCache(**PARSE_CACHE)
+
+# last written odds per key, kept as long as the worker runs
+changes = ChangeFilter(name='ggbet', **CHANGE_DETECTION)
+
+
+def transcribe(page):
+	"""Transcribe the extracted ggbet page into database rows."""
+
+	formatted_data = transcribe_page(page, parse_cache)
+	parse_cache.report()
+
+	return formatted_data
+
+
+def scrape(fetcher):
+	"""Fetch the ggbet page with the cheapest configured tier and transcribe its odds table."""
+
+	return fetcher.fetch(GGBET_URL, transcribe, EXTRACTION, READINESS, tiers=FETCH_TIERS, name='ggbet', resources=resources)
+
+
+def open_sink():
+	"""Open the write-behind queue of the odds table."""
+
+	return WriteBehind(BulkWriter(DB_CREDENTIALS, ODDS_TABLE, OddsBatch, name='ggbet'), Spool(SPOOL_PATH))
+
+
+def run(fetcher, sink=None):
+	"""Scrape the ggbet odds once and queue the changed rows for the database.
+
+	Parameters
+	----------
+	fetcher : TieredFetcher
+		Fetcher of the page.
+	sink : WriteBehind
+		Write-behind queue of the odds table, the rows are only logged if None.
+
+	Returns
+	-------
+	FetchResult of the page.
+	"""
+
+	result = scrape(fetcher)
+	formatted_data = result.rows
 	logger.info('Finished processing of %s rows.', len(formatted_data))
 
-	if len(formatted_data) > 0:
+	# insert to db
+	if sink is not None and len(formatted_data) > 0:
+		changes.warm(DB_CREDENTIALS, set(row[9] for row in formatted_data))
+		formatted_data = changes.filter(formatted_data)
 		logger.info('Inserting %s rows into database.', len(formatted_data))
-		postgres_db_insert(formatted_data, DB_CREDENTIALS)
+		sink.put(formatted_data)
+
+	return result
+
+
+if __name__ == '__main__':
+
+	logger.info('Starting scrape job for ggbet table data.')
+
+	METRICS.start_run('ggbet')
+	profiler = start_profiler('ggbet', PROFILE, PROFILE_STAGES, PROFILE_SAMPLE, METRICS_DIR or '.')
+	archive = SnapshotArchive(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+	sink = open_sink()
+	tier = error = None
+	try:
+		with BrowserPool(size=1) as pool:
+			tier = run(TieredFetcher(pool, archive=archive), sink).tier
+	except Exception as e:
+		error = repr(e)
+		raise  # a failed run is recorded too, and still reported
+	finally:
+		sink.close()
+		if archive is not None:
+			archive.close()
+
+		# record the run
+		if profiler is not None:
+			profiler.stop()
+		summary = METRICS.finish_run('ggbet', tier, error)
+		record_run(DB_CREDENTIALS, summary)
+		if METRICS_DIR:
+			METRICS.write_textfile(os.path.join(METRICS_DIR, METRICS_FILE))
@@ -2,8 +2,10 @@ import re
 import time
 import logging
 import datetime
-import psycopg2
+import itertools
+from bs4 import BeautifulSoup
 from stopwords import STOPWORDS
+from common.batch import OddsBatch
 
 
 logger = logging.getLogger(__name__)
@@ -19,62 +21,88 @@ def is_number(s):
         return False
 
 
-def remove_header(html, cutoff='RESULTS', separator='\n', padding_token='_PADDING_'):
-    """Removes table header and inserts padding_tokens instead of the separator."""
+TIME_TOKEN = re.compile(r'^(\d{1,2}(:\d{1,2}))$')
 
-    tokenized_html = html.split(separator)
-    for idx, token in enumerate(tokenized_html):
-        if token == cutoff:
-            break
-    headless_html = padding_token.join(tokenized_html[idx+1:])
 
-    return headless_html
+def iter_table_tokens(text, cutoff='RESULTS'):
+    """Get an iterator over the lines of the table text which follow the cutoff line of the header."""
 
+    tokens = text.split('\n')
+    try:
+        start = tokens.index(cutoff) + 1
+    except ValueError:
+        start = len(tokens)
 
-def insert_row_breaks(html, separator='_PADDING_', row_break_token='_ROW_BREAK_', padding_token='_PADDING_'):
-    """Inserts a token to indicate row breaks in the table. Very contrived rules."""
-
-    tokenized_html = html.split(separator)
-    num_tokens = len(tokenized_html)
-    insert = False
-    processed_html = [tokenized_html[0]]
-    for idx in range(1, num_tokens):        
-        if insert and not is_number(tokenized_html[idx]):
-            insert = False
-            processed_html.append(row_break_token)
-        elif tokenized_html[idx - 1] == 'Over' and tokenized_html[idx] == 'Under':
-            insert = True
-            continue
-        processed_html.append(tokenized_html[idx])
-    processed_html = padding_token.join(processed_html)
+    return itertools.islice(tokens, start, None)
 
-    return processed_html
 
+class Row:
+    """Tokens of a table row and the positions of the tokens the transcription looks up.
 
-def idx_search(l, s):
-    """Get the index of the first occurrence of a string s within strings in a list l.
-    Only returns the first occurrence.
+    The positions of the first two 'X', the first 'WINNER' and the first time token are
+    recorded by `iter_rows` while the tokens are added.
     """
-    
-    res_idx = -1
-    for idx, token in enumerate(l):
-        if s in token:
-            res_idx = idx
-            break
 
-    return res_idx
+    __slots__ = ('tokens', 'x', 'winner', 'time')
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.x = []
+        self.winner = self.time = -1
 
+    @property
+    def cut(self):
+        """Index of the token which separates the tournament title from the rest."""
 
-def idx_time_regex_search(row):
-    """Get the index of the first occurrence of a time in xx:xx format."""
+        if self.time != -1:
+            return self.time
+        for idx, token in enumerate(self.tokens):  # usually an ongoing match if there is no time
+            if 'TODAY' in token:
+                return idx
+        return -1
 
-    res_idx = -1
-    for idx, token in enumerate(row):
-        if re.search(r'^(\d{1,2}(:\d{1,2}))$', token):
-            res_idx = idx
-            break
+    @property
+    def bet_type(self):
+        if '1X2' in ''.join(self.tokens):
+            return 'three-way'
+        elif self.winner != -1:
+            return 'winner'
+        return 'NA'
 
-    return res_idx
+
+def iter_rows(tokens):
+    """Split the table tokens into rows in a single pass. Very contrived rules.
+
+    A row ends in front of the first non-numeric token after an 'Over', 'Under' pair, the
+    'Under' token itself is dropped. Rows keep an empty token at the ends where they were split.
+    """
+
+    row, previous, insert = Row([]), None, False
+    for token in tokens:
+        if previous is not None:
+            if insert and not is_number(token):
+                insert = False
+                row.tokens.append('')
+                yield row
+                row = Row([''])
+            elif previous == 'Over' and token == 'Under':
+                insert = True
+                previous = token
+                continue
+        previous = token
+
+        idx = len(row.tokens)
+        row.tokens.append(token)
+        if token == 'X':
+            if len(row.x) < 2:
+                row.x.append(idx)
+        elif token == 'WINNER':
+            if row.winner == -1:
+                row.winner = idx
+        elif row.time == -1 and ':' in token and TIME_TOKEN.search(token):
+            row.time = idx
+
+    yield row if previous is not None else Row([''])
 
 
 def get_tournament_name(token_list, stopwords=STOPWORDS, default="NA"):
@@ -90,32 +118,13 @@ def get_tournament_name(token_list, stopwords=STOPWORDS, default="NA"):
     return tournament_name
 
 
-def idx_search_on_hard_string(row, s, discard=0):
-    res_idx = -1
-    for idx, token in enumerate(row):
-        if token == s and discard == 0:
-            res_idx = idx
-            break
-        elif token == s:
-            discard -= 1
-    return res_idx
-
-
-def get_tournament_cut_index(row):
-    """Find the index of the element in the data which separates the tournament title from the rest."""
-    idx = idx_time_regex_search(row)  # match on xx:xx time
-    if idx == -1:  # if it fails usually ongoing match - then match on TODAY
-        idx = idx_search(row, 'TODAY')
-    return idx
-
-
-def get_match_time(row, idx):
-    """Extract the match time from a row od data."""
+def get_match_time(row, idx, year=None):
+    """Extract the match time from a row od data, in the current year or in `year`."""
 
     tm = row[idx]
     dt = row[idx + 1]
     try:
-        match_time = datetime.datetime.strptime(dt + ' ' + tm, '%b %d %H:%M').replace(year=2019)
+        match_time = datetime.datetime.strptime(dt + ' ' + tm, '%b %d %H:%M').replace(year=year or datetime.datetime.now().year)
         match_time = int(datetime.datetime.timestamp(match_time))
     except:  # usually screws up when match is TODAY
         match_time = -1
@@ -123,65 +132,28 @@ def get_match_time(row, idx):
     return match_time
 
 
-def get_contestants(row):
-    """Get the names of the two contestant teams from a row of data in the table."""
-
-    idx = idx_search_on_hard_string(row, 'X')
-    contestant_1 = row[idx - 1]
-    contestant_2 = row[idx + 1]
-
-    return contestant_1, contestant_2
-
-
-def get_bet_type(row):
-    """Get the type of the bet for row data of the table."""
-
-    is_three_way_match = '1X2' in ''.join(str(s) for s in row)
-    winner_in_row = -1 != idx_search_on_hard_string(row, 'WINNER')
-
-    if is_three_way_match:
-        bet_type = 'three-way'
-    elif winner_in_row:
-        bet_type = 'winner'
-    else:
-        bet_type = 'NA'
-
-    return bet_type
-
-
 def get_odds(row, bet_type):
     """Get bet odds from a row of table data. bet_type is either winner or three-way.
-    Perform two index searches in the methods to cover two different types or row formatting.
+    Use one of two token positions to cover two different types or row formatting.
     """
 
     contestant_1_odds = contestant_2_odds = draw_odds = -1
 
-    if bet_type == 'three-way':
-
-        x_idx_1 = idx_search_on_hard_string(row, 'X', discard=0)
-        x_idx_2 = idx_search_on_hard_string(row, 'X', discard=1)
-
-        if x_idx_2 != -1:
-            contestant_1_odds = row[x_idx_2 + 2]
-            contestant_2_odds = row[x_idx_2 + 3]
-            draw_odds = row[x_idx_2 + 4]
-        elif x_idx_1 != -1:
-            contestant_1_odds = row[x_idx_1 + 2]
-            contestant_2_odds = row[x_idx_1 + 3]
-            draw_odds = row[x_idx_1 + 4]
+    tokens = row.tokens
+    if bet_type == 'three-way' and row.x:
+        x_idx = row.x[-1]  # the second X if there are two
+        contestant_1_odds = tokens[x_idx + 2]
+        contestant_2_odds = tokens[x_idx + 3]
+        draw_odds = tokens[x_idx + 4]
 
     elif bet_type == 'winner':
 
-        draw_odds = -1
-        winner_idx = idx_search_on_hard_string(row, 'WINNER')
-        x_idx = idx_search_on_hard_string(row, 'X')
-
-        if winner_idx != -1:
-            contestant_1_odds = row[winner_idx + 1]
-            contestant_2_odds = row[winner_idx + 2]
-        elif x_idx != -1:
-            contestant_1_odds = row[x_idx + 2]
-            contestant_2_odds = row[x_idx + 3]
+        if row.winner != -1:
+            contestant_1_odds = tokens[row.winner + 1]
+            contestant_2_odds = tokens[row.winner + 2]
+        elif row.x:
+            contestant_1_odds = tokens[row.x[0] + 2]
+            contestant_2_odds = tokens[row.x[0] + 3]
 
     # clean up
     if not(is_number(contestant_1_odds) and is_number(contestant_2_odds) and is_number(draw_odds)):
@@ -192,70 +164,72 @@ def get_odds(row, bet_type):
     return contestant_1_odds, contestant_2_odds, draw_odds
 
 
-def transcribe_table_data(table):
-    """Extract relevant fields from table and output it as a list of tuples."""
+def iter_tournaments(rows):
+    """Group table rows into tournaments. Yields the name of each tournament and its rows, which
+    start with the tournament header row. Rows in front of the first tournament are skipped.
+    """
+
+    tournament_name, tournament = None, []
+    for row in rows:
+        name = get_tournament_name(row.tokens[:row.cut], stopwords=STOPWORDS)
+        if name != 'NA':
+            if tournament:
+                yield tournament_name, tournament
+            tournament_name, tournament = name, [row]
+        elif tournament:
+            tournament.append(row)
 
-    scrape_time = int(time.time())
+    if tournament:
+        yield tournament_name, tournament
 
-    # sort rows by tournament
-    tournaments, tournament = [], []
-    for row in reversed(table):
-        row = row.split('_PADDING_')
-        tournament.append(row)
-        time_idx = get_tournament_cut_index(row)
-        tournament_name = get_tournament_name(row[:time_idx], stopwords=STOPWORDS)
-        if tournament_name != 'NA':
-            tournaments.append(tournament)
-            tournament = []
 
-    # process each match in the context of the tournament
+def transcribe_tournament(tournament_name, rows, scrape_time):
+    """Transcribe the rows of a tournament into a list of tuples. The header row sets the bet
+    type of all matches.
+    """
+
+    bet_type = rows[0].bet_type
+    year = datetime.datetime.fromtimestamp(scrape_time).year
+
     data = []
-    for tournament in tournaments:
-        for idx, match in enumerate(reversed(tournament)):
-            cut_idx = get_tournament_cut_index(match)
-            if idx == 0:
-                tournament_name = get_tournament_name(match[:cut_idx], stopwords=STOPWORDS)
-                bet_type = get_bet_type(match)
-            match_time = get_match_time(match, cut_idx)
-            contestant_1, contestant_2 = get_contestants(match)
-
-            contestant_1_odds, contestant_2_odds, draw_odds = get_odds(match, bet_type)
-            db_row = (contestant_1, contestant_2, contestant_1_odds, contestant_2_odds, draw_odds,
-                      bet_type, scrape_time, match_time, tournament_name, 'ggbet')
-            data.append(db_row)
+    for row in rows:
+        x_idx = row.x[0] if row.x else -1
+        contestant_1, contestant_2 = row.tokens[x_idx - 1], row.tokens[x_idx + 1]
+        match_time = get_match_time(row.tokens, row.cut, year)
+        contestant_1_odds, contestant_2_odds, draw_odds = get_odds(row, bet_type)
+        data.append((contestant_1, contestant_2, contestant_1_odds, contestant_2_odds, draw_odds,
+                     bet_type, scrape_time, match_time, tournament_name, 'ggbet'))
 
     return data
 
 
-def postgres_db_insert(data, db_credentials):
-    """Insert GGBet odds data into database.
+def transcribe_table(text, cache=None, scrape_time=None):
+    """Extract relevant fields from the table text and output them as an `OddsBatch`.
 
-    PARAMS
-    ------
-    data : list of tuples
-        List of tuples containing ordered entries of team_1, team_2, team_1_winner_odds, team_2_winner_odds,
-        scrape_time, match_time, tournament_name, source.
-    db_credentials : dict
-        A dictionary containing key-value log in credentials for the database.
+    Rows are split in one pass and grouped into tournaments, which are listed from the bottom
+    of the table to the top. With a `ParseCache`, the rows of tournaments whose tokens did not
+    change since an earlier scrape are taken from the cache. The rows are scraped now or at `scrape_time`.
     """
 
-    conn = None
-    insert_statement = """
-        INSERT INTO csgo_winner_odds (
-            team_1, team_2, team_1_winner_odds, team_2_winner_odds, draw_odds, bet_type, scrape_time, match_time, tournament_name, source
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-    """
+    scrape_time = int(time.time()) if scrape_time is None else scrape_time
 
-    try:
-        conn = psycopg2.connect(**db_credentials)
-        cursor = conn.cursor()
-        cursor.executemany(insert_statement, data)
-        conn.commit()
-        cursor.close()
-        logger.info('Inserted %s rows.', len(data))
-    except psycopg2.DatabaseError:
-        logger.error('Failed to insert %s rows into database.', len(data))
-    finally:
-        if conn:
-            conn.close()
+    data = OddsBatch()
+    for tournament_name, rows in reversed(list(iter_tournaments(iter_rows(iter_table_tokens(text))))):
+        if cache is None:
+            data.extend(transcribe_tournament(tournament_name, rows, scrape_time))
+        else:
+            fragment = '\n'.join(token for row in rows for token in row.tokens)
+            parse = lambda: OddsBatch(transcribe_tournament(tournament_name, rows, scrape_time))  # noqa: E731
+            data.extend(cache.parse(fragment, parse))
+    if cache is not None:
+        data.fill('scrape_time', scrape_time)  # cached rows have the time of an earlier scrape
+
+    return data
+
+
+def transcribe_page(page, cache=None, scrape_time=None):
+    """Transcribe the extracted ggbet page into an `OddsBatch`, see `transcribe_table`."""
+
+    soup = BeautifulSoup(page['table'] or '', 'html.parser')
+
+    return transcribe_table(soup.text, cache, scrape_time)
@@ -3,6 +3,58 @@
 HLTV_URL = 'https://www.hltv.org/betting/money'
 
 
+READINESS = {  # DOM conditions for the odds table to be loaded
+	'selector': '.event-header',
+	'rows': '.betting-list-odds',
+	'timeout': 30,
+}
+
+
+EXTRACTION = {  # DOM fields read in one round trip
+	'bookmakers': {'selector': '.provider-cell', 'attribute': 'class'},
+	'html': {'selector': 'html', 'attribute': 'html', 'first': True},
+}
+
+
+FETCH_TIERS = ('html', 'browser')  # server rendered, chrome is only a fallback
+
+
+RESOURCES = {  # resources blocked in the browser tier, see common/resources.py
+	'types': ('image', 'font', 'media', 'tracker'),
+	'allow': ('*hltv.org/*',),  # scripts and api requests of the site render the odds table
+	'baseline_sample': .05,  # fraction of the loads without blocking, to measure the savings
+}
+
+
+CHANGE_DETECTION = {  # rows with unchanged odds are only written as hourly heartbeats
+	'ttl': 24 * 3600,
+	'heartbeat': 3600,
+}
+
+
+SPOOL_FILE = 'hltv.spool'  # rows which could not be written, replayed on the next run
+
+
+METRICS_FILE = 'hltv.prom'  # metrics of the last run, written to the METRICS_DIR directory
+
+
+WORKER_INTERVAL = 5 * 60  # seconds between two runs in a long-running worker, see worker.py
+
+
+# adaptive intervals of the worker around WORKER_INTERVAL, see common/schedule.py. The betting
+# page has no match times (they are stored as -1), so only the odds movement backoff applies.
+SCHEDULE = {
+	'min_interval': 60,
+	'max_interval': 30 * 60,  # after many runs without odds movement
+	'backoff': 1.5,  # interval growth per run without odds movement
+}
+
+
+PARSE_CACHE = {  # rows of unchanged tournament fragments are reused between scrapes of a worker
+	'max_fragments': 500,
+}
+
+
 LOGGING = {
 	'disable_existing_loggers': False,
 	'version': 1,
@@ -26,6 +78,10 @@ LOGGING = {
 		'DEV': {
 			'handlers': ['console'],
 			'level': 'DEBUG',
+		},
+		'common': {  # fetch, write and browser timings of the shared modules
+			'handlers': ['console'],
+			'level': 'INFO',
 		}
 	}
 }
@@ -1,11 +1,20 @@
 import os
-import time
 import sentry_sdk
 import logging.config
-from selenium import webdriver
 
-from config import LOGGING, HLTV_URL
-from utils import transcribe_data, postgres_db_insert
+from common.browser import BrowserPool
+from common.changes import ChangeFilter
+from common.batch import OddsBatch
+from common.db import BulkWriter, ODDS_TABLE, record_run
+from common.fetcher import TieredFetcher
+from common.metrics import METRICS
+from common.profiling import start_profiler
+from common.resources import ResourcePolicy
+from common.parsecache import ParseCache
+from common.snapshots import SnapshotArchive
+from common.writebehind import WriteBehind, Spool
+from config import LOGGING, HLTV_URL, READINESS, EXTRACTION, FETCH_TIERS, RESOURCES, CHANGE_DETECTION, SPOOL_FILE, PARSE_CACHE, METRICS_FILE
+from utils import transcribe_data
 
 
 # get os config variables
@@ -17,6 +26,13 @@ DB_CREDENTIALS = {
 	'password': os.environ['DB_PASSWORD'],
 	'dbname': os.environ['DB_NAME']
 }
+SPOOL_PATH = os.path.join(os.environ.get('SPOOL_DIR', '.'), SPOOL_FILE)
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')  # archive of the scraped pages, off if not set
+METRICS_DIR = os.environ.get('METRICS_DIR')  # textfile collector directory of the run metrics, off if not set
+PROFILE = os.environ.get('PROFILE')  # profiling of the run, "cpu" and/or "memory", off if not set
+PROFILE_STAGES = os.environ.get('PROFILE_STAGES')  # profiled stages, e.g. "parse" or "write", the whole run if not set
+PROFILE_SAMPLE = float(os.environ.get('PROFILE_SAMPLE', 1.))  # fraction of the runs which are profiled
+HLTV_URL = os.environ.get('HLTV_URL', HLTV_URL)  # set to scrape a stub site, see benchmarks/end_to_end.py
 
 
 # initialize logging and monitoring
@@ -26,29 +42,97 @@ if ENVIRONMENT == 'PRODUCTION':
 	sentry_sdk.init(SENTRY_URL)
 
 
-if __name__ == '__main__':
+# resources blocked in the browser tier, with the savings per load
+resources = ResourcePolicy(**RESOURCES)
+
+
+# rows of unchanged tournaments, kept as long as the worker runs
+parse_cache = ParseCache(**PARSE_CACHE)
+
+# last written odds per key, kept as long as the worker runs
+changes = ChangeFilter(name='hltv', **CHANGE_DETECTION)
+
+
+def transcribe(page):
+	"""Transcribe the extracted hltv page into database rows, reusing the rows of unchanged tournaments."""
+
+	table = transcribe_data(page, parse_cache)
+	parse_cache.report()
+
+	return table
+
+
+def scrape(fetcher):
+	"""Fetch the hltv betting page with the cheapest configured tier and transcribe its odds table."""
+
+	return fetcher.fetch(HLTV_URL, transcribe, EXTRACTION, READINESS, tiers=FETCH_TIERS, name='hltv', resources=resources)
 
-	logger.info('Starting scrape job for hltv aggregate table data.')
 
-	# initialize headless selenium webdriver
-	chrome_options = webdriver.ChromeOptions()
-	chrome_options.add_argument('--headless')
-	chrome_options.add_argument('--no-sandbox')
-	chrome_options.add_argument('--disable-dev-shm-usage')
-	driver = webdriver.Chrome(chrome_options=chrome_options)
+def open_sink():
+	"""Open the write-behind queue of the odds table."""
 
-	# load website / raw table data
-	driver.get(HLTV_URL)
+	return WriteBehind(BulkWriter(DB_CREDENTIALS, ODDS_TABLE, OddsBatch, name='hltv'), Spool(SPOOL_PATH))
 
-	# transcribe raw html to condensed tabular data
-	table = transcribe_data(driver)
+
+def run(fetcher, sink=None):
+	"""Scrape the hltv odds once and queue the changed rows for the database.
+
+	Parameters
+	----------
+	fetcher : TieredFetcher
+		Fetcher of the page.
+	sink : WriteBehind
+		Write-behind queue of the odds table, the rows are only logged if None.
+
+	Returns
+	-------
+	FetchResult of the page.
+	"""
+
+	result = scrape(fetcher)
+	table = result.rows
 	logger.info('Finished processing of %s rows.', len(table))
 
 	# insert to db
-	if ENVIRONMENT == 'PRODUCTION' and len(table) > 0:
+	if sink is not None and len(table) > 0:
+		changes.warm(DB_CREDENTIALS, set(row[9] for row in table))
+		table = changes.filter(table)
 		logger.info('Inserting %s rows into database.', len(table))
-		postgres_db_insert(table, DB_CREDENTIALS)
+		sink.put(table)
 	elif len(table) == 0:
 		logger.warning('HLTV data scrape produced 0 data points.')
 	else:
 		logger.info('Produced data: %s', table)
+
+	return result
+
+
+if __name__ == '__main__':
+
+	logger.info('Starting scrape job for hltv aggregate table data.')
+
+	METRICS.start_run('hltv')
+	profiler = start_profiler('hltv', PROFILE, PROFILE_STAGES, PROFILE_SAMPLE, METRICS_DIR or '.')
+	archive = SnapshotArchive(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+	sink = open_sink() if ENVIRONMENT == 'PRODUCTION' else None
+	tier = error = None
+	try:
+		with BrowserPool(size=1) as pool:
+			tier = run(TieredFetcher(pool, archive=archive), sink).tier
+	except Exception as e:
+		error = repr(e)
+		raise  # a failed run is recorded too, and still reported
+	finally:
+		if sink is not None:
+			sink.close()
+		if archive is not None:
+			archive.close()
+
+		# record the run
+		if profiler is not None:
+			profiler.stop()
+		summary = METRICS.finish_run('hltv', tier, error)
+		if ENVIRONMENT == 'PRODUCTION':
+			record_run(DB_CREDENTIALS, summary)
+		if METRICS_DIR:
+			METRICS.write_textfile(os.path.join(METRICS_DIR, METRICS_FILE))
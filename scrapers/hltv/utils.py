@@ -1,7 +1,8 @@
 import time
 import logging
-import psycopg2
-from bs4 import BeautifulSoup
+import functools
+import lxml.html
+from common.batch import OddsBatch
 
 logger = logging.getLogger(__name__)
 
@@ -16,182 +17,140 @@ def convert_to_number(s):
 	return num
 
 
-def get_bookie_name(html):
-	"""Extract the book maker name a given entry in the odds table."""
+def get_bookie_name(class_string):
+	"""Extract the book maker name from the class attribute of an entry in the odds table."""
 
-	name = 'Not Found'
-	for html_attr in html.contents:
-		try:
-			class_string = ' '.join(html_attr['class'])
-			if 'betting-list-odds-provider' in class_string:
-				name = class_string.split('-')[-1]
-				break
-		except TypeError:
-			continue
+	class_string = ' '.join(class_string.split())
+	if 'betting-list-odds-provider' not in class_string:
+		return 'Not Found'
 
-	return name
+	return class_string.split('-')[-1]
 
 
-def get_book_makers(driver):
-	"""Get a list of all book makers."""
+def get_book_makers(provider_classes):
+	"""Get a list of all book makers from the class attributes of the provider cells."""
 
-	bookmakers = driver.find_elements_by_class_name('provider-cell')
-	bookmakers = [bookie.get_attribute('class') for bookie in bookmakers]
-	bookmakers = [bookie[27:] for bookie in bookmakers if 'hidden' not in bookie]
+	bookmakers = [bookie[27:] for bookie in provider_classes if 'hidden' not in bookie]
 
 	return bookmakers
 
 
-def get_team_names(raw_html):
-	"""Get a list of team names for a given tournament."""
-
-	html = BeautifulSoup(raw_html).find_all("div", class_="team-name")
-	team_names = [team.text for team in html]
-
-	return team_names
-
-
-def get_bet_types(raw_html):
-	"""Get the bet type of the match, for example BO3."""
-
-	html = BeautifulSoup(raw_html).find_all("div", class_="bet-best-of")
-	bet_types = [bet.text for bet in html]
-
-	return bet_types
-
-
-def get_tournament_name(raw_html):
-	"""Get the tournament name from the html object of the tournament."""
-
-	html = BeautifulSoup(raw_html)
-	tournament_name = html.contents[0].contents[0].text
-
-	return tournament_name
-
-
-def get_odds_rows(raw_html):
-	"""Filters rows and returns only the rows that contain odds data."""
-
-	separator = '/td>'
-	rows = [tok + separator for tok in raw_html.split(separator) if 'odds betting-list-odds' in tok]
-	html_rows = [BeautifulSoup(r, 'html.parser') for r in rows]
-
-	return html_rows
-
+def get_tournaments(html):
+	"""Parse the page once and collect the name, team names, bet types and odds of every tournament.
 
-def is_valid_bookie(row):
-	"""Returns a boolean value if the bookie is active."""
+	The page is walked in document order, each tournament header starts a new tournament which
+	collects all following elements until the next header.
 
-	name = get_bookie_name(row)
+	Parameters
+	----------
+	html : str
+		Html of the odds page.
 
-	if 'hidden' in name:
-		is_valid = False
-	else:
-		is_valid = True
-
-	return is_valid
+	Returns
+	-------
+	List of dicts with the tournament name, the lists of team names and bet types, and a list of
+	(bookie name, odds) tuples of the active bookies, in the order of the odds table.
+	"""
 
+	if not html:
+		return []
 
-def decode_row(row):
-	"""Extract the bookie name and the odds for a team from a row of data."""
+	tournaments = []
+	for element in lxml.html.document_fromstring(html).iter('div', 'td'):
+		classes = element.get('class') or ''
+		if element.tag == 'div' and classes.startswith('event-header'):
+			name = element.text or (element[0].text_content() if len(element) else '')
+			tournaments.append({'tournament_name': name, 'team_names': [], 'bet_types': [], 'odds': []})
+		elif not tournaments:
+			continue
+		elif element.tag == 'td':
+			if 'odds betting-list-odds' in classes:
+				bookie_name = get_bookie_name(classes)
+				if 'hidden' not in bookie_name:  # inactive bookie
+					tournaments[-1]['odds'].append((bookie_name, convert_to_number(element.text_content())))
+		elif 'team-name' in classes.split():
+			tournaments[-1]['team_names'].append(element.text_content())
+		elif 'bet-best-of' in classes.split():
+			tournaments[-1]['bet_types'].append(element.text_content())
 
-	bookie_name = get_bookie_name(row)
-	odds = convert_to_number(row.text)
+	return tournaments
 
-	return bookie_name, odds
 
+def iter_fragments(html, marker='<div class="event-header', end_marker='<div class="description-box">'):
+	"""Split the html of the odds page into the fragments of its tournaments, without parsing it.
 
-def transcribe_data(driver):
-	"""Transcribe the raw html data to a tabular format for database insertion."""
+	A fragment runs from a tournament header to the next header, the last one ends in front of
+	the page description. Fragments are not balanced html, which the lxml parser repairs.
+	"""
 
-	scrape_time = int(time.time())
+	start = html.find(marker)
+	end_of_tournaments = html.find(end_marker, start)
+	if end_of_tournaments == -1:
+		end_of_tournaments = len(html)
+	while start != -1:
+		end = html.find(marker, start + len(marker), end_of_tournaments)
+		yield html[start:end if end != -1 else end_of_tournaments]
+		start = end
 
-	table_data = []
-	bookmakers = get_book_makers(driver)
-	num_bookmakers = len(bookmakers)
-	html = driver.page_source
-	tournaments = ['<div class="event-header' + s for s in html.split('<div class="event-header')][1:]
 
-	for tournament in tournaments:
+def transcribe_tournaments(html, num_bookmakers, scrape_time):
+	"""Transcribe the tournaments of a page or page fragment into an `OddsBatch`."""
 
-		tournament_name = get_tournament_name(tournament)
-		team_names = get_team_names(tournament)
-		bet_types = get_bet_types(tournament)
-		html_rows = get_odds_rows(tournament)
+	table_data = OddsBatch()
+	for tournament in get_tournaments(html):
 
-		row_idx = 0
-		rows_by_team = []
-		for row in html_rows:  # extract data, still in wrong format
+		# odds are listed per team and bookmaker, a match is a block of the first team
+		# followed by a block of the second team
+		odds, team_names, bet_types = tournament['odds'], tournament['team_names'], tournament['bet_types']
+		for idx, (bookie_name, contestant_1_odds) in enumerate(odds):
 
-			if not is_valid_bookie(row):
+			if (idx // num_bookmakers) % 2 != 0:
 				continue
 
-			contestant_idx = int(row_idx / num_bookmakers)
-			bet_type_idx = int(row_idx / (2 * num_bookmakers))
-			row_idx += 1
-			bookie_name, odds = decode_row(row)
-
-			row_data = {
-				'tournament_name': tournament_name,
-				'team_name': team_names[contestant_idx],
-				'bookie_name': bookie_name,
-				'odds': odds,
-				'bet_type': bet_types[bet_type_idx]
-			}
-			rows_by_team.append(row_data)
-
-		# reformat data for postgres insertion
-		for match_idx, match in enumerate(rows_by_team):
-
-			if (int(match_idx / num_bookmakers) % 2) != 0:
-				continue
-
-			row = (
-				match['team_name'],
-				rows_by_team[match_idx + num_bookmakers]['team_name'],
-				match['odds'],
-				rows_by_team[match_idx + num_bookmakers]['odds'],
+			table_data.append((
+				team_names[idx // num_bookmakers],
+				team_names[idx // num_bookmakers + 1],
+				contestant_1_odds,
+				odds[idx + num_bookmakers][1],
 				-1,  # draw odds
-				match['bet_type'],
+				bet_types[idx // (2 * num_bookmakers)],
 				scrape_time,
 				-1,  # match time
-				match['tournament_name'],
-				match['bookie_name'] + ' (hltv)'
-			)
-			table_data.append(row)
+				tournament['tournament_name'],
+				bookie_name + ' (hltv)'
+			))
 
 	return table_data
 
 
-def postgres_db_insert(data, db_credentials):
-	"""Insert GGBet odds data into database.
+def transcribe_data(page, cache=None, scrape_time=None):
+	"""Transcribe the raw html data to a tabular format for database insertion.
 
-	PARAMS
-	------
-	data : list of tuples
-		List of tuples containing ordered entries of team_1, team_2, team_1_winner_odds, team_2_winner_odds, draw_odds,
-		bet_type, scrape_time, match_time, tournament_name, source.
-	db_credentials : dict
-		A dictionary containing key-value log in credentials for the database.
-	"""
+	Parameters
+	----------
+	page : dict
+		Extracted page payload with the class attributes of the provider cells under
+		'bookmakers' and the page html under 'html'.
+	cache : ParseCache
+		Cache of the rows of tournament fragments. Without a cache the page is parsed at once.
+	scrape_time : int
+		Unix timestamp of the scrape, defaults to now.
 
-	conn = None
-	insert_statement = """
-		INSERT INTO csgo_winner_odds (
-			team_1, team_2, team_1_winner_odds, team_2_winner_odds, draw_odds, bet_type, scrape_time, match_time, tournament_name, source
-		)
-		VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+	Returns
+	-------
+	`OddsBatch` of the rows ready for database insertion.
 	"""
 
-	try:
-		conn = psycopg2.connect(**db_credentials)
-		cursor = conn.cursor()
-		cursor.executemany(insert_statement, data)
-		conn.commit()
-		cursor.close()
-		logger.info('Inserted %s rows.', len(data))
-	except psycopg2.DatabaseError:
-		logger.error('Failed to insert %s rows into database.', len(data))
-	finally:
-		if conn:
-			conn.close()
+	scrape_time = int(time.time()) if scrape_time is None else scrape_time
+
+	bookmakers = get_book_makers(page['bookmakers'])
+	if cache is None:
+		return transcribe_tournaments(page['html'], len(bookmakers), scrape_time)
+
+	table_data = OddsBatch()
+	for fragment in iter_fragments(page['html'] or ''):
+		parse = functools.partial(transcribe_tournaments, fragment, len(bookmakers), scrape_time)
+		table_data.extend(cache.parse(' '.join(bookmakers) + '\n' + fragment, parse))
+	table_data.fill('scrape_time', scrape_time)  # cached rows have the time of an earlier scrape
+
+	return table_data
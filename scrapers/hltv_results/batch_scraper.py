@@ -1,11 +1,25 @@
 import os
 import time
-import random
+import signal
+import socket
 import logging.config
-from selenium import webdriver
+from hashlib import md5
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from config import LOGGING, HLTV_BASE_URL, OFFSET_RANGE
-from utils import transcribe_table_data, calc_average_header_date, postgres_db_upsert
+from common.browser import BrowserPool
+from common.batch import ResultsBatch
+from common.db import BulkWriter, WriteResult, RESULTS_TABLE, RESULTS_CONFLICT, RESULTS_UPDATE
+from common.fetcher import TieredFetcher, HttpSessions
+from common.metrics import METRICS
+from common.profiling import start_profiler
+from common.ratelimit import RateLimiter
+from common.readiness import READINESS_LOG
+from common.snapshots import SnapshotArchive
+from config import LOGGING, OFFSET_RANGE, OFFSET_STEP, BACKFILL_CONCURRENCY, BACKFILL_RATE, \
+	BACKFILL_PROGRESS_DB, BACKFILL_DEV_PROGRESS_DB, BACKFILL_CHUNK_PAGES, BACKFILL_LEASE_SECONDS, BACKFILL_DEV_QUEUE_TABLE, BACKFILL_BROWSER, METRICS_FILE
+from progress import OffsetTracker, FAILED
+from work_queue import WorkQueue, QUEUE_TABLE
+from scraper import scrape, SNAPSHOT_DIR, HLTV_BASE_URL, METRICS_DIR, PROFILE, PROFILE_STAGES, PROFILE_SAMPLE
 
 
 # get os config variables
@@ -16,6 +30,16 @@ DB_CREDENTIALS = {
 	'password': os.environ['DB_PASSWORD'],
 	'dbname': os.environ['DB_NAME']
 }
+BACKFILL_MODE = os.environ.get('BACKFILL_MODE', 'local')  # 'local' progress file or shared 'queue'
+WORKER_ID = os.environ.get('WORKER_ID', '%s-%s' % (socket.gethostname(), os.getpid()))
+# runs outside PRODUCTION store nothing, their progress must not mark production offsets or chunks as done
+PROGRESS_DB = BACKFILL_PROGRESS_DB if ENVIRONMENT == 'PRODUCTION' else BACKFILL_DEV_PROGRESS_DB
+WORK_QUEUE_TABLE = QUEUE_TABLE if ENVIRONMENT == 'PRODUCTION' else BACKFILL_DEV_QUEUE_TABLE
+# set to backfill a stub site, see benchmarks/end_to_end.py
+OFFSET_RANGE = tuple(int(offset) for offset in os.environ['BACKFILL_OFFSET_RANGE'].split(',')) \
+	if 'BACKFILL_OFFSET_RANGE' in os.environ else OFFSET_RANGE
+BACKFILL_RATE = float(os.environ.get('BACKFILL_RATE', BACKFILL_RATE))
+WORK_QUEUE_TABLE = os.environ.get('BACKFILL_QUEUE_TABLE', WORK_QUEUE_TABLE)
 
 
 # initialize logging and monitoring
@@ -23,36 +47,207 @@ logging.config.dictConfig(LOGGING)
 logger = logging.getLogger(ENVIRONMENT)
 
 
+def scrape_offset(fetcher, offset):
+	"""Fetch and transcribe the results page at an offset, the fetcher waits for the rate limit."""
+
+	match_data = scrape(fetcher, HLTV_BASE_URL + str(offset)).rows
+
+	return offset, match_data
+
+
+def store(writer, match_data, offset):
+	"""Upsert the results of a page into the database. Returns True if the rows were stored, or
+	outside PRODUCTION, where they are only logged and the progress is kept apart.
+	"""
+
+	logger.info('Finished processing of %s rows for an offset of %s.', len(match_data), offset)
+	if ENVIRONMENT == 'PRODUCTION':
+		logger.info('Upserting %s rows into database.', len(match_data))
+		# flush right away, an offset is only marked as done once its rows are written
+		return WriteResult.combine(writer.write(match_data) + writer.flush()).ok
+	logger.info('Produced data: %s', match_data)
+
+	return True
+
+
+def content_hash(match_data):
+	"""Hash the content of a results page from the hashes of its rows."""
+
+	return md5(''.join(match_data.column('hash_id')).encode('utf-8')).hexdigest()
+
+
+class Backfill:
+	"""Concurrent, rate limited scraping of results pages.
+
+	Up to `concurrency` pages are fetched and transcribed in parallel, while `rate` caps the
+	requests per second across all of them. At most twice as many pages are submitted at once,
+	more are submitted as they finish, so an interrupted backfill only waits for the pages in
+	flight. Finished pages are upserted in the main thread over one reused connection, so
+	database writes overlap with the fetches still in flight.
+	Chrome sessions are recycled as configured in `BACKFILL_BROWSER`, so long backfills do not
+	slow down with the memory of their sessions.
+	"""
+
+	def __init__(self, concurrency=BACKFILL_CONCURRENCY, rate=BACKFILL_RATE, browser=BACKFILL_BROWSER):
+		self.pool = BrowserPool(size=concurrency, **browser)
+		self.executor = ThreadPoolExecutor(max_workers=concurrency)
+		self.max_in_flight = 2 * concurrency
+		self.in_flight = {}  # future -> offset
+		self.archive = SnapshotArchive(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+		self.limiter = RateLimiter(rate)
+		self.fetcher = TieredFetcher(self.pool, HttpSessions(pool_size=concurrency), self.archive, limiter=self.limiter)
+		self.writer = BulkWriter(DB_CREDENTIALS, RESULTS_TABLE, ResultsBatch, RESULTS_CONFLICT, RESULTS_UPDATE, name='hltv_results')
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		# pages which did not start yet are dropped, their offsets are claimed again after a restart
+		cancelled = sum(future.cancel() for future in self.in_flight)
+		if cancelled:
+			logger.info('Cancelled %s queued pages.', cancelled)
+		self.executor.shutdown(wait=False)  # running pages fail once the browser pool is closed
+		self.pool.close()
+		self.writer.close()
+		if self.archive is not None:
+			self.archive.close()
+
+	def run(self, tracker, heartbeat=None):
+		"""Scrape all offsets which the tracker has not completed yet.
+
+		Pages without rows or whose upsert failed are marked as failed and retried once their
+		backoff has passed. With the heartbeat of a work queue chunk, no more pages are submitted
+		once its lease was lost, and the pages in flight are still stored.
+
+		Returns
+		-------
+		Tuple of the number of pages and the number of rows scraped.
+		"""
+
+		start = time.time()
+		pages = rows = 0
+
+		lost = lambda: heartbeat is not None and heartbeat.lost
+		while not lost():
+			offsets = tracker.todo()
+			if not offsets:
+				retry_at = tracker.next_retry_at()
+				if retry_at is None:
+					break
+				logger.info('Waiting %.0fs for the next retry.', max(0., retry_at - time.time()))
+				time.sleep(max(0., retry_at - time.time()))
+				continue
+
+			offsets = iter(offsets)
+			while True:
+				for offset in offsets if not lost() else ():
+					tracker.claim(offset)
+					self.in_flight[self.executor.submit(scrape_offset, self.fetcher, offset)] = offset
+					if len(self.in_flight) >= self.max_in_flight:
+						break
+				if not self.in_flight:
+					break
+				done, _ = wait(self.in_flight, return_when=FIRST_COMPLETED)
+				for future in done:
+					del self.in_flight[future]
+					offset, match_data = future.result()
+					pages += 1
+					if len(match_data) == 0:
+						logger.warning('HLTV data scrape produced 0 data points for an offset of %s.', offset)
+						tracker.fail(offset, 'no rows')
+					elif not store(self.writer, match_data, offset):
+						tracker.fail(offset, 'database write failed')
+					else:
+						tracker.complete(offset, len(match_data), content_hash(match_data))
+						rows += len(match_data)
+					if pages % 10 == 0:
+						logger.info('Backfilled %s pages at %.1f pages per minute, chrome sessions recycled: %s.',
+									pages, pages / (time.time() - start) * 60, dict(self.pool.stats.recycles) or 'none')
+
+		if lost():
+			logger.warning('Stopped the chunk after %s pages, its lease was lost.', pages)
+		elapsed = time.time() - start
+		logger.info('Backfilled %s pages with %s rows in %.1fs (%.1f pages per minute).',
+					pages, rows, elapsed, pages / elapsed * 60 if elapsed else 0.)
+
+		return pages, rows
+
+
+def terminate(signum, frame):
+	"""Exit on SIGTERM like on SIGINT, so the chrome sessions are quit and the progress is kept."""
+
+	raise SystemExit('Terminated by signal %s.' % signum)
+
+
+def run_local():
+	"""Backfill the configured offset range, resuming from the local progress file."""
+
+	tracker = OffsetTracker(PROGRESS_DB)
+	tracker.recover()
+	tracker.register(range(OFFSET_RANGE[0], OFFSET_RANGE[1], OFFSET_STEP))
+	try:
+		with Backfill() as backfill:
+			backfill.run(tracker)
+	finally:
+		logger.info('Backfill progress: %s', tracker.summary())
+		tracker.close()
+
+
+def run_queue(worker_id):
+	"""Backfill chunks of the configured offset range pulled from the shared work queue.
+
+	Any number of workers can run at the same time, each one processes chunks until the queue
+	is empty. Note that the rate limit applies per worker.
+	"""
+
+	queue = WorkQueue(DB_CREDENTIALS, worker_id, lease_seconds=BACKFILL_LEASE_SECONDS, table=WORK_QUEUE_TABLE)
+	queue.create()
+	queue.populate(OFFSET_RANGE, OFFSET_STEP, BACKFILL_CHUNK_PAGES)
+
+	start = time.time()
+	total_pages = total_rows = 0
+	try:
+		with Backfill() as backfill:
+			while True:
+				chunk = queue.claim()
+				if chunk is None:
+					break
+				done = queue.done_offsets(chunk)  # stored by an earlier attempt at the chunk, not fetched again
+				logger.info('Worker %s claimed offsets %s to %s, %s of them stored before.', worker_id, chunk[0], chunk[1], len(done))
+
+				chunk_start = time.time()
+				tracker = OffsetTracker(':memory:', max_attempts=3, backoff=5.)
+				tracker.register(offset for offset in range(chunk[0], chunk[1], OFFSET_STEP) if offset not in done)
+				with queue.heartbeat(chunk) as heartbeat:
+					pages, rows = backfill.run(tracker, heartbeat)
+				failed = FAILED in tracker.summary()
+				if not queue.finish(chunk, pages, rows, time.time() - chunk_start, failed=failed, done_offsets=tracker.completed()):
+					logger.warning('Worker %s could not finish offsets %s to %s, the chunk was reclaimed by another worker.',
+								   worker_id, chunk[0], chunk[1])
+				tracker.close()
+
+				total_pages += pages
+				total_rows += rows
+				logger.info('Worker %s finished offsets %s to %s%s, %s pages and %s rows at %.1f pages per minute overall.',
+							worker_id, chunk[0], chunk[1], ' with failures' if failed else '', total_pages, total_rows,
+							total_pages / (time.time() - start) * 60)
+	finally:
+		logger.info('Work queue: %s', queue.summary())
+		queue.close()
+
+
 if __name__ == '__main__':
 
 	logger.info('Starting batch scrape job for hltv match results data.')
+	signal.signal(signal.SIGTERM, terminate)
 
-	# initialize headless selenium webdriver
-	driver = webdriver.Chrome(executable_path='/usr/local/bin/chromedriver')
-
-	# iteratively load website / raw table data
-	for offset in range(OFFSET_RANGE[0], OFFSET_RANGE[1], 100):
-
-		driver.get(HLTV_BASE_URL + str(offset))
-		driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-
-		# transcribe raw html to condensed tabular data
-		headers = driver.find_elements_by_class_name('standard-headline')
-		header_text = [header.text for header in headers]
-		match_time = calc_average_header_date(header_text)
-		table = driver.find_elements_by_class_name('result')
-		result_text = [row.text for row in table]
-		match_data = transcribe_table_data(result_text, match_time)
-		logger.info('Finished processing of %s rows for an offset of %s.', len(table), offset)
-
-		# insert to db
-		if ENVIRONMENT == 'PRODUCTION' and len(table) > 0:
-			logger.info('Upserting %s rows into database.', len(table))
-			postgres_db_upsert(match_data, DB_CREDENTIALS)
-		elif len(table) == 0:
-			logger.warning('HLTV data scrape produced 0 data points.')
-		else:
-			logger.info('Produced data: %s', table)
-
-		# sleep to not spam website
-		time.sleep(random.uniform(1, 3))
+	profiler = start_profiler('backfill_hltv_results', PROFILE, PROFILE_STAGES, PROFILE_SAMPLE, METRICS_DIR or '.')
+	if BACKFILL_MODE == 'queue':
+		run_queue(WORKER_ID)
+	else:
+		run_local()
+	if profiler is not None:
+		profiler.stop()
+	logger.info('Page readiness times: %s', READINESS_LOG.summary('hltv_results'))
+	if METRICS_DIR:
+		METRICS.write_textfile(os.path.join(METRICS_DIR, 'backfill_' + METRICS_FILE))
@@ -5,6 +5,53 @@ HLTV_BASE_URL = 'https://www.hltv.org/results?offset='
 
 
 OFFSET_RANGE = (19300, 48000)  # (start, end)
+OFFSET_STEP = 100  # results per page
+
+
+BACKFILL_CONCURRENCY = 4  # pages fetched in parallel
+BACKFILL_RATE = 1.  # global politeness limit in requests per second
+BACKFILL_PROGRESS_DB = 'backfill_progress.sqlite'  # local file tracking the state of every offset
+BACKFILL_DEV_PROGRESS_DB = 'backfill_progress.dev.sqlite'  # progress of runs outside PRODUCTION, which write nothing
+BACKFILL_CHUNK_PAGES = 20  # pages per chunk of the shared work queue
+BACKFILL_LEASE_SECONDS = 300  # chunks of crashed workers are reclaimed after this time
+BACKFILL_DEV_QUEUE_TABLE = 'backfill_chunks_dev'  # work queue of runs outside PRODUCTION, which write nothing
+BACKFILL_BROWSER = {  # chrome sessions of a backfill are recycled after pages, memory or a stuck load
+	'max_pages': 50,
+	'max_rss_mb': 768,
+	'page_load_timeout': 30,
+}
+
+
+READINESS = {  # DOM conditions for the results table to be loaded
+	'selector': '.result',
+	'rows': '.result',
+	'timeout': 15,
+}
+
+
+EXTRACTION = {  # DOM fields read in one round trip
+	'headers': {'selector': '.standard-headline'},
+	'results': {'selector': '.result'},
+}
+
+
+FETCH_TIERS = ('html', 'browser')  # server rendered, chrome is only a fallback
+
+
+RESOURCES = {  # resources blocked in the browser tier, see common/resources.py
+	'types': ('image', 'font', 'media', 'tracker'),
+	'allow': ('*hltv.org/*',),  # hltv's own scripts and requests, which the results list may depend on
+	'baseline_sample': .05,  # fraction of the loads without blocking, to measure the savings
+}
+
+
+SPOOL_FILE = 'hltv_results.spool'  # rows which could not be written, replayed on the next run
+
+
+METRICS_FILE = 'hltv_results.prom'  # metrics of the last run, written to the METRICS_DIR directory
+
+
+WORKER_INTERVAL = 30 * 60  # seconds between two runs in a long-running worker, see worker.py
 
 
 LOGGING = {
@@ -30,6 +77,10 @@ LOGGING = {
 		'DEV': {
 			'handlers': ['console'],
 			'level': 'DEBUG',
+		},
+		'common': {  # fetch, write and browser timings of the shared modules
+			'handlers': ['console'],
+			'level': 'INFO',
 		}
 	}
 }
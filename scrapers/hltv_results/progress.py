@@ -0,0 +1,134 @@
+import time
+import sqlite3
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+PENDING, IN_FLIGHT, DONE, FAILED = 'pending', 'in-flight', 'done', 'failed'
+
+
+class OffsetTracker:
+	"""Durable progress of a backfill in a local SQLite file.
+
+	Every offset is either pending, in-flight, done or failed, together with its row count and
+	the hash of its content. Offsets left in-flight by a crashed run are pending again after
+	`recover`, and failed offsets are retried with exponential backoff until `max_attempts`.
+
+	Parameters
+	----------
+	path : str
+		Path of the SQLite file.
+	max_attempts : int
+		Number of attempts after which a failed offset is given up.
+	backoff : float
+		Seconds to wait before the first retry, doubled for every further attempt.
+	max_backoff : float
+		Upper limit of the wait between two attempts.
+	"""
+
+	def __init__(self, path, max_attempts=5, backoff=30., max_backoff=900.):
+		self.max_attempts = max_attempts
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.conn = sqlite3.connect(path)
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS backfill_offsets (
+				page_offset INTEGER PRIMARY KEY,
+				state TEXT NOT NULL,
+				rows INTEGER,
+				content_hash TEXT,
+				attempts INTEGER NOT NULL DEFAULT 0,
+				next_attempt_at REAL NOT NULL DEFAULT 0,
+				error TEXT,
+				updated_at REAL
+			)
+		""")
+		self.conn.commit()
+
+	def close(self):
+		self.conn.close()
+
+	def _update(self, statement, params):
+		with self.conn:
+			self.conn.execute(statement, params)
+
+	def register(self, offsets):
+		"""Add offsets as pending, offsets which are already tracked keep their state."""
+
+		with self.conn:
+			self.conn.executemany(
+				'INSERT OR IGNORE INTO backfill_offsets (page_offset, state, updated_at) VALUES (?, ?, ?)',
+				[(offset, PENDING, time.time()) for offset in offsets]
+			)
+
+	def recover(self):
+		"""Reset offsets left in-flight by an interrupted run to pending."""
+
+		with self.conn:
+			count = self.conn.execute(
+				'UPDATE backfill_offsets SET state = ?, updated_at = ? WHERE state = ?', (PENDING, time.time(), IN_FLIGHT)
+			).rowcount
+		if count:
+			logger.info('Recovered %s in-flight offsets of an interrupted run.', count)
+
+	def claim(self, offset):
+		self._update(
+			'UPDATE backfill_offsets SET state = ?, attempts = attempts + 1, updated_at = ? WHERE page_offset = ?',
+			(IN_FLIGHT, time.time(), offset)
+		)
+
+	def complete(self, offset, rows, content_hash):
+		self._update(
+			'UPDATE backfill_offsets SET state = ?, rows = ?, content_hash = ?, error = NULL, updated_at = ? WHERE page_offset = ?',
+			(DONE, rows, content_hash, time.time(), offset)
+		)
+
+	def fail(self, offset, error):
+		"""Mark an offset as failed and schedule its retry."""
+
+		attempts = self.conn.execute(
+			'SELECT attempts FROM backfill_offsets WHERE page_offset = ?', (offset,)
+		).fetchone()[0]
+		delay = min(self.max_backoff, self.backoff * 2 ** max(attempts - 1, 0))
+		self._update(
+			'UPDATE backfill_offsets SET state = ?, error = ?, next_attempt_at = ?, updated_at = ? WHERE page_offset = ?',
+			(FAILED, error, time.time() + delay, time.time(), offset)
+		)
+		if attempts >= self.max_attempts:
+			logger.error('Giving up on offset %s after %s attempts: %s', offset, attempts, error)
+
+	def completed(self):
+		"""Get the offsets which are done."""
+
+		return [row[0] for row in self.conn.execute('SELECT page_offset FROM backfill_offsets WHERE state = ?', (DONE,))]
+
+	def todo(self, now=None):
+		"""Get the offsets which are pending or whose retry is due, in ascending order."""
+
+		now = time.time() if now is None else now
+		rows = self.conn.execute("""
+			SELECT page_offset FROM backfill_offsets
+			WHERE state = ? OR (state = ? AND attempts < ? AND next_attempt_at <= ?)
+			ORDER BY page_offset
+		""", (PENDING, FAILED, self.max_attempts, now)).fetchall()
+
+		return [row[0] for row in rows]
+
+	def next_retry_at(self):
+		"""Get the time of the next due retry, None if no failed offset is retried anymore."""
+
+		return self.conn.execute(
+			'SELECT MIN(next_attempt_at) FROM backfill_offsets WHERE state = ? AND attempts < ?',
+			(FAILED, self.max_attempts)
+		).fetchone()[0]
+
+	def summary(self):
+		"""Count the offsets and rows per state."""
+
+		rows = self.conn.execute(
+			'SELECT state, COUNT(*), COALESCE(SUM(rows), 0) FROM backfill_offsets GROUP BY state'
+		).fetchall()
+
+		return {state: {'offsets': count, 'rows': total} for state, count, total in rows}
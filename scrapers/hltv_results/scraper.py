@@ -1,59 +1,120 @@
 import os
 import sentry_sdk
 import logging.config
-from selenium import webdriver
 
-from config import LOGGING, HLTV_URL
-from utils import transcribe_table_data, calc_average_header_date, postgres_db_upsert
+from common.browser import BrowserPool
+from common.batch import ResultsBatch
+from common.db import BulkWriter, RESULTS_TABLE, RESULTS_CONFLICT, RESULTS_UPDATE, record_run
+from common.fetcher import TieredFetcher
+from common.metrics import METRICS
+from common.profiling import start_profiler
+from common.resources import ResourcePolicy
+from common.snapshots import SnapshotArchive
+from common.writebehind import WriteBehind, Spool
+from config import LOGGING, HLTV_URL, HLTV_BASE_URL, READINESS, EXTRACTION, FETCH_TIERS, RESOURCES, SPOOL_FILE, METRICS_FILE
+from utils import transcribe_page
 
 
 # get os config variables
 ENVIRONMENT = os.environ['ENVIRONMENT']
-SENTRY_URL = os.environ['SENTRY_URL']
+SENTRY_URL = os.environ.get('SENTRY_URL')  # not set for the backfill, which imports `scrape` from here
 DB_CREDENTIALS = {
 	'host': os.environ['DB_HOST'],
 	'user': os.environ['DB_USER'],
 	'password': os.environ['DB_PASSWORD'],
 	'dbname': os.environ['DB_NAME']
 }
+SPOOL_PATH = os.path.join(os.environ.get('SPOOL_DIR', '.'), SPOOL_FILE)
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')  # archive of the scraped pages, off if not set
+METRICS_DIR = os.environ.get('METRICS_DIR')  # textfile collector directory of the run metrics, off if not set
+PROFILE = os.environ.get('PROFILE')  # profiling of the run, "cpu" and/or "memory", off if not set
+PROFILE_STAGES = os.environ.get('PROFILE_STAGES')  # profiled stages, e.g. "parse" or "write", the whole run if not set
+PROFILE_SAMPLE = float(os.environ.get('PROFILE_SAMPLE', 1.))  # fraction of the runs which are profiled
+HLTV_URL = os.environ.get('HLTV_URL', HLTV_URL)  # set to scrape a stub site, see benchmarks/end_to_end.py
+HLTV_BASE_URL = os.environ.get('HLTV_BASE_URL', HLTV_BASE_URL)
 
 
 # initialize logging and monitoring
 logging.config.dictConfig(LOGGING)
 logger = logging.getLogger(ENVIRONMENT)
-if ENVIRONMENT == 'PRODUCTION':
+if ENVIRONMENT == 'PRODUCTION' and SENTRY_URL:
 	sentry_sdk.init(SENTRY_URL)
 
 
-if __name__ == '__main__':
+# resources blocked in the browser tier, with the savings per load
+resources = ResourcePolicy(**RESOURCES)
 
-	logger.info('Starting scrape job for hltv match results data.')
 
-	# initialize headless selenium webdriver
-	chrome_options = webdriver.ChromeOptions()
-	chrome_options.add_argument('--headless')
-	chrome_options.add_argument('--no-sandbox')
-	chrome_options.add_argument('--disable-dev-shm-usage')
-	driver = webdriver.Chrome(chrome_options=chrome_options)
-
-	# load website / raw table data
-	driver.get(HLTV_URL)
-	driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-
-	# transcribe raw html to condensed tabular data
-	headers = driver.find_elements_by_class_name('standard-headline')
-	header_text = [header.text for header in headers]
-	match_time = calc_average_header_date(header_text)
-	table = driver.find_elements_by_class_name('result')
-	result_text = [row.text for row in table]
-	match_data = transcribe_table_data(result_text, match_time)
-	logger.info('Finished processing of %s rows.', len(table))
+def scrape(fetcher, url=HLTV_URL):
+	"""Fetch a hltv results page with the cheapest configured tier and transcribe its results table."""
+
+	return fetcher.fetch(url, transcribe_page, EXTRACTION, READINESS, tiers=FETCH_TIERS, name='hltv_results', resources=resources)
+
+
+def open_sink():
+	"""Open the write-behind queue of the results table."""
+
+	writer = BulkWriter(DB_CREDENTIALS, RESULTS_TABLE, ResultsBatch, RESULTS_CONFLICT, RESULTS_UPDATE, name='hltv_results')
+	return WriteBehind(writer, Spool(SPOOL_PATH))
+
+
+def run(fetcher, sink=None):
+	"""Scrape the hltv match results once and queue the rows for the database.
+
+	Parameters
+	----------
+	fetcher : TieredFetcher
+		Fetcher of the page.
+	sink : WriteBehind
+		Write-behind queue of the results table, the rows are only logged if None.
+
+	Returns
+	-------
+	FetchResult of the page.
+	"""
+
+	result = scrape(fetcher)
+	match_data = result.rows
+	logger.info('Finished processing of %s rows.', len(match_data))
 
 	# insert to db
-	if ENVIRONMENT == 'PRODUCTION' and len(table) > 0:
-		logger.info('Inserting %s rows into database.', len(table))
-		postgres_db_upsert(match_data, DB_CREDENTIALS)
-	elif len(table) == 0:
+	if sink is not None and len(match_data) > 0:
+		logger.info('Inserting %s rows into database.', len(match_data))
+		sink.put(match_data)
+	elif len(match_data) == 0:
 		logger.warning('HLTV data scrape produced 0 data points.')
 	else:
-		logger.info('Produced data: %s', table)
+		logger.info('Produced data: %s', match_data)
+
+	return result
+
+
+if __name__ == '__main__':
+
+	logger.info('Starting scrape job for hltv match results data.')
+
+	METRICS.start_run('hltv_results')
+	profiler = start_profiler('hltv_results', PROFILE, PROFILE_STAGES, PROFILE_SAMPLE, METRICS_DIR or '.')
+	archive = SnapshotArchive(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+	sink = open_sink() if ENVIRONMENT == 'PRODUCTION' else None
+	tier = error = None
+	try:
+		with BrowserPool(size=1) as pool:
+			tier = run(TieredFetcher(pool, archive=archive), sink).tier
+	except Exception as e:
+		error = repr(e)
+		raise  # a failed run is recorded too, and still reported
+	finally:
+		if sink is not None:
+			sink.close()
+		if archive is not None:
+			archive.close()
+
+		# record the run
+		if profiler is not None:
+			profiler.stop()
+		summary = METRICS.finish_run('hltv_results', tier, error)
+		if ENVIRONMENT == 'PRODUCTION':
+			record_run(DB_CREDENTIALS, summary)
+		if METRICS_DIR:
+			METRICS.write_textfile(os.path.join(METRICS_DIR, METRICS_FILE))
@@ -1,7 +1,7 @@
 import logging
-import psycopg2
 from hashlib import md5
 from datetime import datetime
+from common.batch import ResultsBatch
 
 
 logger = logging.getLogger(__name__)
@@ -51,10 +51,10 @@ def transcribe_table_data(text_table, match_time=-1):
 
 	Returns
 	-------
-	List of tuples with processed data ready for database insertion.
+	`ResultsBatch` of the processed data ready for database insertion.
 	"""
 
-	processed_data = []
+	processed_data = ResultsBatch()
 
 	for text in text_table:
 		if len(text) == 0:
@@ -68,38 +68,13 @@ def transcribe_table_data(text_table, match_time=-1):
 	return processed_data
 
 
-def postgres_db_upsert(data, db_credentials):
-	"""Insert match results data from hltv into database.
+def transcribe_page(page, scrape_time=None):
+	"""Transcribe an extracted hltv results page into a `ResultsBatch`.
 
-	PARAMS
-	------
-	data : list of tuples
-		List of tuples containing ordered entries of hash_id, team_1, team_2, team_1_score, team_2_score,
-		tournament, matchtype, match_time.
-	db_credentials : dict
-		A dictionary containing key-value log in credentials for the database.
+	The match time is estimated from the dates of the page headers, `scrape_time` is accepted
+	like by the transcribe functions of the odds scrapers but the results do not depend on it.
 	"""
 
-	conn = None
-	insert_statement = """
-		INSERT INTO csgo_match_results (
-			hash_id, team_1, team_2, team_1_score, team_2_score, tournament, matchtype, match_time
-		)
-		VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-		ON CONFLICT (hash_id) DO UPDATE 
-		SET match_time = EXCLUDED.match_time;
-	"""
+	match_time = calc_average_header_date(page['headers'])
 
-	try:
-		conn = psycopg2.connect(**db_credentials)
-		cursor = conn.cursor()
-		cursor.executemany(insert_statement, data)
-		conn.commit()
-		cursor.close()
-		logger.info('Inserted %s rows.', len(data))
-	except psycopg2.DatabaseError as e:
-		logger.error('Failed to insert %s rows into database.', len(data))
-		logger.error('Error: %s', e)
-	finally:
-		if conn:
-			conn.close()
+	return transcribe_table_data(page['results'], match_time)
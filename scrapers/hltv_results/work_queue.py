@@ -0,0 +1,204 @@
+import logging
+import threading
+import psycopg2
+
+
+logger = logging.getLogger(__name__)
+
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+QUEUE_TABLE = 'backfill_chunks'
+
+
+class WorkQueue:
+	"""Postgres backed queue of offset chunks shared by several backfill workers.
+
+	Workers claim chunks with `FOR UPDATE SKIP LOCKED`, so concurrent claims never block on or
+	hand out the same chunk. A claimed chunk is leased for `lease_seconds` and the lease is
+	renewed while the chunk is processed. Chunks whose lease expired, e.g. because the worker
+	crashed, and failed chunks with attempts left are claimed again by any worker. The offsets of
+	a chunk which were stored are kept with it, so a failed chunk only retries its failed offsets.
+
+	Parameters
+	----------
+	db_credentials : dict
+		A dictionary containing key-value log in credentials for the database.
+	worker_id : str
+		Unique name of this worker.
+	lease_seconds : int
+		Duration of a lease before the chunk can be reclaimed.
+	max_attempts : int
+		Number of attempts after which a failed chunk is given up.
+	table : str
+		Name of the queue table.
+	"""
+
+	def __init__(self, db_credentials, worker_id, lease_seconds=300, max_attempts=3, table=QUEUE_TABLE):
+		self.table = table
+		self.db_credentials = db_credentials
+		self.worker_id = worker_id
+		self.lease_seconds = lease_seconds
+		self.max_attempts = max_attempts
+		self.conn = psycopg2.connect(**db_credentials)
+		self.conn.autocommit = True
+
+	def close(self):
+		self.conn.close()
+
+	def _execute(self, statement, params=None, conn=None):
+		with (conn or self.conn).cursor() as cursor:
+			cursor.execute(statement, params)
+			return cursor.fetchall() if cursor.description else cursor.rowcount
+
+	def create(self):
+		"""Create the queue table if it does not exist yet.
+
+		Workers starting at the same time serialize on an advisory lock, since concurrent
+		`CREATE TABLE IF NOT EXISTS` statements can conflict with each other.
+		"""
+
+		with self.conn.cursor() as cursor:
+			cursor.execute('BEGIN;')
+			try:
+				cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s));', (self.table,))
+				cursor.execute("""
+					CREATE TABLE IF NOT EXISTS {table} (
+						chunk_start INTEGER PRIMARY KEY,
+						chunk_end INTEGER NOT NULL,
+						state TEXT NOT NULL DEFAULT 'pending',
+						leased_by TEXT,
+						lease_expires_at TIMESTAMPTZ,
+						attempts INTEGER NOT NULL DEFAULT 0,
+						pages INTEGER,
+						rows INTEGER,
+						elapsed REAL,
+						updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+					);
+				""".format(table=self.table))
+				# queue tables created before the completed offsets were tracked
+				cursor.execute("ALTER TABLE {table} ADD COLUMN IF NOT EXISTS done_offsets INTEGER[] NOT NULL DEFAULT '{{}}';".format(
+					table=self.table))
+				cursor.execute('COMMIT;')
+			except psycopg2.DatabaseError:
+				cursor.execute('ROLLBACK;')
+				raise
+
+	def populate(self, offset_range, step, chunk_pages):
+		"""Split an offset range into chunks of `chunk_pages` pages, existing chunks are kept."""
+
+		chunk_size = step * chunk_pages
+		chunks = [(start, min(start + chunk_size, offset_range[1])) for start in range(offset_range[0], offset_range[1], chunk_size)]
+		with self.conn.cursor() as cursor:
+			cursor.executemany(
+				'INSERT INTO {table} (chunk_start, chunk_end) VALUES (%s, %s) ON CONFLICT (chunk_start) DO NOTHING;'.format(table=self.table),
+				chunks
+			)
+
+	def claim(self):
+		"""Lease the next available chunk. Returns a (start, end) tuple or None if no chunk is left."""
+
+		rows = self._execute("""
+			UPDATE {table}
+			SET state = %s, leased_by = %s, lease_expires_at = now() + %s * INTERVAL '1 second',
+				attempts = attempts + 1, updated_at = now()
+			WHERE chunk_start = (
+				SELECT chunk_start FROM {table}
+				WHERE state = %s
+					OR (state = %s AND lease_expires_at < now())
+					OR (state = %s AND attempts < %s)
+				ORDER BY chunk_start
+				LIMIT 1
+				FOR UPDATE SKIP LOCKED
+			)
+			RETURNING chunk_start, chunk_end;
+		""".format(table=self.table), (LEASED, self.worker_id, self.lease_seconds, PENDING, LEASED, FAILED, self.max_attempts))
+
+		return rows[0] if rows else None
+
+	def renew(self, chunk, conn=None):
+		"""Extend the lease of a chunk. Returns False if the lease was lost to another worker."""
+
+		return self._execute("""
+			UPDATE {table} SET lease_expires_at = now() + %s * INTERVAL '1 second', updated_at = now()
+			WHERE chunk_start = %s AND state = %s AND leased_by = %s;
+		""".format(table=self.table), (self.lease_seconds, chunk[0], LEASED, self.worker_id), conn=conn) == 1
+
+	def done_offsets(self, chunk):
+		"""Get the offsets of a chunk which earlier attempts stored."""
+
+		rows = self._execute('SELECT done_offsets FROM {table} WHERE chunk_start = %s;'.format(table=self.table), (chunk[0],))
+
+		return set(rows[0][0]) if rows else set()
+
+	def finish(self, chunk, pages, rows, elapsed, failed=False, done_offsets=()):
+		"""Mark a leased chunk as done or failed together with its throughput and the offsets it
+		stored. Returns False if the lease was lost to another worker.
+		"""
+
+		return self._execute("""
+			UPDATE {table} SET state = %s, pages = %s, rows = %s, elapsed = %s, lease_expires_at = NULL, updated_at = now(),
+				done_offsets = ARRAY(SELECT DISTINCT unnest(done_offsets || %s::INTEGER[]) ORDER BY 1)
+			WHERE chunk_start = %s AND state = %s AND leased_by = %s;
+		""".format(table=self.table), (
+			FAILED if failed else DONE, pages, rows, elapsed, list(done_offsets), chunk[0], LEASED, self.worker_id
+		)) == 1
+
+	def summary(self):
+		"""Count the chunks, pages and rows per state."""
+
+		rows = self._execute(
+			'SELECT state, COUNT(*), COALESCE(SUM(pages), 0), COALESCE(SUM(rows), 0) FROM {table} GROUP BY state;'.format(table=self.table)
+		)
+
+		return {state: {'chunks': chunks, 'pages': pages, 'rows': total} for state, chunks, pages, total in rows}
+
+	def heartbeat(self, chunk):
+		"""Renew the lease of a chunk in a background thread until the returned heartbeat is stopped."""
+
+		return Heartbeat(self, chunk)
+
+
+class Heartbeat:
+	"""Renews the lease of a chunk on its own connection while used as a context manager.
+
+	A renewal which fails with a database error is retried on a new connection after a tenth of
+	the lease, so an outage shorter than the lease does not lose the chunk. `lost` is set once
+	the chunk was reclaimed by another worker, the chunk should not be worked on anymore then.
+	"""
+
+	def __init__(self, queue, chunk):
+		self.queue = queue
+		self.chunk = chunk
+		self.lost = False
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+
+	def __enter__(self):
+		self._thread.start()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._stop.set()
+		self._thread.join()
+
+	def _run(self):
+		conn, interval = None, self.queue.lease_seconds / 3.
+		try:
+			while not self._stop.wait(interval):
+				try:
+					if conn is None:
+						conn = psycopg2.connect(**self.queue.db_credentials)
+						conn.autocommit = True
+					if not self.queue.renew(self.chunk, conn=conn):
+						logger.warning('Lost the lease of chunk %s to another worker.', self.chunk)
+						self.lost = True
+						break
+					interval = self.queue.lease_seconds / 3.
+				except psycopg2.DatabaseError as e:  # connection errors included
+					logger.error('Failed to renew the lease of chunk %s, retrying on a new connection: %s', self.chunk, e)
+					if conn is not None:
+						conn.close()
+					conn, interval = None, self.queue.lease_seconds / 10.
+		finally:
+			if conn is not None:
+				conn.close()
@@ -0,0 +1,230 @@
+"""Re-run the current transcribe functions of a site over its archived pages.
+
+The snapshots of a site in a date range are transcribed in a process pool with the scrape time
+they were taken at, so a fixed parser re-derives the historical rows without network access.
+With --write the rows are bulk loaded into the database in a single transaction: odds rows pass
+the same change detection as a live scrape and results are upserted with all their columns.
+Odds are inserted, so odds sites need --replace with --write, which first deletes the odds the
+site wrote at the scrape times of the replayed snapshots. Odds without a snapshot, e.g. of
+scrapes which ran without an archive, are never deleted.
+
+Usage: python replay.py SITE --archive DIR [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--processes N] [--write [--replace]]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import datetime
+import importlib
+import psycopg2
+from multiprocessing import Pool, cpu_count
+
+from common.batch import OddsBatch, ResultsBatch
+from common.changes import ChangeFilter
+from common.db import copy_merge, ODDS_TABLE, RESULTS_TABLE, RESULTS_CONFLICT
+from common.snapshots import SnapshotArchive
+
+
+logger = logging.getLogger(__name__)
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SITES = {  # transcribe function in the utils module of every site
+	'egb': 'transcribe_page',
+	'ggbet': 'transcribe_page',
+	'hltv': 'transcribe_data',
+	'hltv_results': 'transcribe_page',
+	'rivalry': 'transcribe_page',
+}
+SOURCES = {  # pattern of the sources of the odds rows of every site
+	'egb': 'egb',
+	'ggbet': 'ggbet',
+	'hltv': '% (hltv)',
+	'rivalry': 'rivalry',
+}
+SCRAPE_TIME_SLACK = 10  # seconds the rows of a live scrape can be stamped after the time of its snapshot
+
+
+# state of the pool processes
+_archive = _transcribe = None
+
+
+def init_worker(site, root):
+	"""Import the transcribe function of the site, every site has its own utils module."""
+
+	global _archive, _transcribe
+	sys.path.insert(0, os.path.join(ROOT, site))
+	_transcribe = getattr(importlib.import_module('utils'), SITES[site])
+	_archive = SnapshotArchive(root)
+
+
+def transcribe_snapshot(snapshot):
+	"""Transcribe an archived page. Returns its scrape time, its rows and an error or None."""
+
+	scrape_time, url, tier, digest = snapshot
+	try:
+		return scrape_time, _transcribe(_archive.load(digest), scrape_time=scrape_time), None
+	except Exception as e:
+		return scrape_time, None, 'snapshot %s of %s: %r' % (digest[:12], url, e)
+
+
+class Loader:
+	"""Bulk loads replayed rows in one transaction, which is only committed once the replay is done.
+
+	Parameters
+	----------
+	db_credentials : dict
+		A dictionary containing key-value log in credentials for the database.
+	site : str
+		Name of the replayed site.
+	batch_size : int
+		Rows per COPY.
+	replace : bool
+		Delete the odds the site wrote at the scrape times of the replayed snapshots first.
+	"""
+
+	def __init__(self, db_credentials, site, batch_size=50000, replace=False):
+		self.site = site
+		self.batch_size = batch_size
+		self.replace_existing = replace
+		self.conn = psycopg2.connect(**db_credentials)
+		if site == 'hltv_results':
+			self.table, self.batch_type = RESULTS_TABLE, ResultsBatch
+			self.conflict, self.update = RESULTS_CONFLICT, ResultsBatch.columns[1:]
+		else:
+			self.table, self.batch_type = ODDS_TABLE, OddsBatch
+			self.conflict, self.update = None, ()
+		self.changes = ChangeFilter() if self.batch_type is OddsBatch else None
+		self.written = 0
+		self._buffer = self.batch_type()
+
+	def prepare(self, snapshots):
+		"""Take the snapshots which are about to be replayed, before any rows are written."""
+
+		if self.replace_existing:
+			self.replace(sorted(set(scrape_time for scrape_time, _, _, _ in snapshots)))
+
+	def replace(self, scrape_times):
+		"""Delete the odds the site wrote in the scrapes of the given snapshot times.
+
+		The rows of a live scrape are stamped when they are transcribed, shortly after the time of
+		their snapshot, so rows up to `SCRAPE_TIME_SLACK` seconds after a snapshot time are deleted.
+		"""
+
+		if not scrape_times:
+			logger.info('No snapshots of %s to replace.', self.site)
+			return
+		with self.conn.cursor() as cur:
+			cur.execute("""
+				DELETE FROM %s WHERE source LIKE %%s AND EXISTS (
+					SELECT 1 FROM unnest(%%s::INTEGER[]) AS snapshots(scrape_time)
+					WHERE %s.scrape_time >= snapshots.scrape_time AND %s.scrape_time < snapshots.scrape_time + %%s
+				)
+			""" % (ODDS_TABLE, ODDS_TABLE, ODDS_TABLE), (SOURCES[self.site], scrape_times, SCRAPE_TIME_SLACK))
+			logger.info('Deleted %s rows of %s in %s scrapes to be replaced.', cur.rowcount, self.site, len(scrape_times))
+
+	def write(self, rows, scrape_time):
+		if self.changes is not None:
+			rows = self.changes.filter(rows, now=scrape_time)
+		self._buffer.extend(rows)
+		if len(self._buffer) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		if self._buffer:
+			self.written += copy_merge(self.conn, self.table, self.batch_type.columns, self._buffer, self.conflict, self.update)
+			self._buffer = self.batch_type()
+
+	def commit(self):
+		self.flush()
+		self.conn.commit()
+		self.conn.close()
+
+	def rollback(self):
+		self.conn.rollback()
+		self.conn.close()
+
+
+def replay(site, root, start=None, end=None, processes=None, loader=None):
+	"""Transcribe the snapshots of a site in [start, end) and hand their rows to the loader.
+
+	Returns the number of snapshots, of rows and of snapshots which failed to transcribe.
+	"""
+
+	with SnapshotArchive(root) as archive:
+		snapshots = archive.find(site, start, end)
+	processes = processes or cpu_count()
+	if loader is not None:
+		loader.prepare(snapshots)
+	logger.info('Replaying %s snapshots of %s with %s processes.', len(snapshots), site, processes)
+
+	begin, rows, failed = time.time(), 0, 0
+	with Pool(processes, init_worker, (site, root)) as pool:
+		chunksize = max(1, len(snapshots) // (processes * 16))
+		for idx, (scrape_time, batch, error) in enumerate(pool.imap(transcribe_snapshot, snapshots, chunksize), 1):
+			if error is not None:
+				logger.error('Failed to transcribe %s', error)
+				failed += 1
+				continue
+			rows += len(batch)
+			if loader is not None:
+				loader.write(batch, scrape_time)
+			if idx % 1000 == 0:
+				logger.info('Replayed %s of %s snapshots, %.0f snapshots/s.', idx, len(snapshots), idx / (time.time() - begin))
+
+	elapsed = time.time() - begin
+	logger.info('Replayed %s snapshots of %s into %s rows in %.1fs (%.0f snapshots/s), %s failed.',
+				len(snapshots), site, rows, elapsed, len(snapshots) / elapsed if elapsed else 0., failed)
+
+	return len(snapshots), rows, failed
+
+
+def timestamp(date):
+	return int(datetime.datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('site', choices=sorted(SITES))
+	parser.add_argument('--archive', default=os.environ.get('SNAPSHOT_DIR'), help='snapshot archive, defaults to $SNAPSHOT_DIR')
+	parser.add_argument('--start', type=timestamp, help='first day to replay (UTC)')
+	parser.add_argument('--end', type=timestamp, help='day after the last day to replay (UTC)')
+	parser.add_argument('--processes', type=int, help='transcribing processes, defaults to the number of cores')
+	parser.add_argument('--write', action='store_true', help='load the rows into the database of the DB_* variables')
+	parser.add_argument('--replace', action='store_true', help='delete the odds the site wrote in the replayed scrapes first')
+	args = parser.parse_args()
+	if not args.archive:
+		parser.error('no archive given, set --archive or SNAPSHOT_DIR')
+	if args.replace and not (args.write and args.site in SOURCES):
+		parser.error('--replace needs --write and an odds site')
+	if args.write and args.site in SOURCES and not args.replace:  # odds are inserted, not upserted
+		parser.error('--write of an odds site needs --replace, the replayed odds would duplicate the stored ones')
+
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+	logging.getLogger('common.changes').setLevel(logging.WARNING)  # one line per snapshot otherwise
+
+	loader = None
+	if args.write:
+		loader = Loader({
+			'host': os.environ['DB_HOST'],
+			'user': os.environ['DB_USER'],
+			'password': os.environ['DB_PASSWORD'],
+			'dbname': os.environ['DB_NAME']
+		}, args.site, replace=args.replace)
+
+	try:
+		_, _, failed = replay(args.site, args.archive, args.start, args.end, args.processes, loader)
+	except BaseException:
+		if loader is not None:
+			loader.rollback()
+		raise
+	if loader is not None:
+		loader.commit()
+		logger.info('Loaded %s rows into %s.', loader.written, loader.table)
+
+	sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+	main()
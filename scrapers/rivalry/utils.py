@@ -1,7 +1,7 @@
 import time
 import logging
 import datetime
-import psycopg2
+from common.batch import OddsBatch
 
 
 logger = logging.getLogger(__name__)
@@ -33,34 +33,37 @@ def get_match_time(date, time):
 	return match_time
 
 
-def transcribe_table_data(table):
+def transcribe_table_data(table, scrape_time=None):
 	"""Extract data from raw table and fit to sql schema.
 
 	Parameters
 	----------
 	table : list
 		List of raw match table data.
+	scrape_time : int
+		Unix timestamp of the scrape, which the dates 'Today' and 'Tomorrow' refer to. Defaults to now.
 
 	Returns
 	-------
-	Transcribed data table according to SQL format.
+	`OddsBatch` of the transcribed data table according to SQL format.
 	"""
 
-	scrape_time = int(time.time())
+	scrape_time = int(time.time()) if scrape_time is None else scrape_time
+	now = datetime.datetime.fromtimestamp(scrape_time)
 	source, bet_type, draw_odds = 'rivalry', 'winner', -1
 
 	start_index = table.index('Counter Strike Betting - Bet on Counter Strike Matches') + 1
 	stop_index = table.index('CONNECT WITH US:')
 	match_data = table[start_index:stop_index]
 
-	formatted_data = []
+	formatted_data = OddsBatch()
 	for element in range(len(match_data)):
 
 		# get match date
 		if match_data[element] == 'Today':
-			date = datetime.datetime.now()
+			date = now
 		elif match_data[element] == 'Tomorrow':
-			date = datetime.datetime.now() + datetime.timedelta(days=1)
+			date = now + datetime.timedelta(days=1)
 
 		# extract data
 		if match_data[element] == 'VS':
@@ -78,35 +81,9 @@ def transcribe_table_data(table):
 	return formatted_data
 
 
-def postgres_db_insert(data, db_credentials):
-	"""Insert odds data into database.
+def transcribe_page(page, scrape_time=None):
+	"""Transcribe the extracted rivalry page into an `OddsBatch`, scraped now or at `scrape_time`."""
 
-	PARAMS
-	------
-	data : list of tuples
-		List of tuples containing ordered entries of team_1, team_2, team_1_winner_odds, team_2_winner_odds,
-		scrape_time, match_time, tournament_name, source.
-	db_credentials : dict
-		A dictionary containing key-value log in credentials for the database.
-	"""
-
-	conn = None
-	insert_statement = """
-		INSERT INTO csgo_winner_odds (
-			team_1, team_2, team_1_winner_odds, team_2_winner_odds, draw_odds, bet_type, scrape_time, match_time, tournament_name, source
-		)
-		VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-	"""
+	table = page['table'] or ''
 
-	try:
-		conn = psycopg2.connect(**db_credentials)
-		cursor = conn.cursor()
-		cursor.executemany(insert_statement, data)
-		conn.commit()
-		cursor.close()
-		logger.info('Inserted %s rows.', len(data))
-	except psycopg2.DatabaseError:
-		logger.error('Failed to insert %s rows into database.', len(data))
-	finally:
-		if conn:
-			conn.close()
+	return transcribe_table_data(table.split('\n'), scrape_time)
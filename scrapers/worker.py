@@ -0,0 +1,287 @@
+"""Long-running worker which runs the scrape jobs of all sites on an in-process schedule.
+
+Instead of starting a container per scrape, the worker imports the scrapers once and runs the
+job of every site each `WORKER_INTERVAL` seconds (in the `config.py` of the site). A job never
+overlaps itself, a run which is due while the previous run still goes on is skipped. Jobs of
+different sites run concurrently.
+
+Odds sites with a `SCHEDULE` in their `config.py` are scraped more often as their next match
+start approaches and less often while their odds do not move (see `common/schedule.py`). All
+runs share a budget of `WORKER_BUDGET` page loads per hour, by default the loads of the fixed
+intervals. When it is used up, due jobs wait, the one with the closest match start first. The browser pool, the http sessions, the database connections
+of the write queues and of the run records, the change detection and the parse caches are kept between runs.
+
+Every run is recorded like a container run, and its overhead is logged: how late it started
+and the seconds outside of its stages, next to the startup time a container pays on every run.
+SIGTERM and SIGINT stop the schedule, running jobs finish and the write queues are flushed.
+
+Usage: python worker.py [SITE ...]
+"""
+import os
+import time
+import signal
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+START = time.time()
+
+from common.browser import BrowserPool  # noqa: E402
+from common.db import RunRecorder  # noqa: E402
+from common.fetcher import TieredFetcher  # noqa: E402
+from common.metrics import METRICS  # noqa: E402
+from common.profiling import start_profiler  # noqa: E402
+from common.schedule import AdaptiveSchedule, ScrapeBudget, NO_MATCH_LEAD  # noqa: E402
+from common.sites import SITES, load_site  # noqa: E402
+from common.snapshots import SnapshotArchive  # noqa: E402
+
+
+# get os config variables, the scrapers read the others
+ENVIRONMENT = os.environ['ENVIRONMENT']
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')  # archive of the scraped pages, off if not set
+METRICS_DIR = os.environ.get('METRICS_DIR')  # textfile collector directory of the run metrics, off if not set
+METRICS_PORT = os.environ.get('METRICS_PORT')  # port of the metrics endpoint, off if not set
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 2))  # jobs running at the same time
+WORKER_BROWSERS = int(os.environ.get('WORKER_BROWSERS', 1))  # chrome sessions shared by the jobs
+WORKER_BUDGET = os.environ.get('WORKER_BUDGET')  # page loads per hour of all jobs, the loads of the fixed intervals if not set
+WORKER_BURST = os.environ.get('WORKER_BURST')  # page loads saved up by the budget, 5 minutes of the budget if not set
+
+
+logger = logging.getLogger(ENVIRONMENT)
+
+
+class Job:
+	"""Scrape job of a site, due every `interval` seconds, or at the intervals of an adaptive schedule.
+
+	Parameters
+	----------
+	site : str
+		Name of the site.
+	scraper : module
+		Scraper module of the site, providing `run` and `open_sink`.
+	interval : float
+		Seconds between the scheduled starts of two runs.
+	sink : WriteBehind
+		Write-behind queue of the site, the rows are only logged if None.
+	schedule : AdaptiveSchedule
+		Adapts the interval after every run, the interval is fixed if None.
+	"""
+
+	def __init__(self, site, scraper, interval, sink=None, schedule=None):
+		self.site = site
+		self.scraper = scraper
+		self.interval = interval
+		self.sink = sink
+		self.schedule = schedule
+		self.next_run = time.time()
+		self.future = None
+		self.runs = self.skipped = self.failed = self.deferred = self.moved = 0
+		self.elapsed = self.overhead = self.delay = 0.
+
+	@property
+	def running(self):
+		return self.future is not None and not self.future.done()
+
+	def priority(self, now):
+		"""Rank of a due job when the budget is short, lower first: the seconds until the next match
+		start of the site, less the seconds the job is overdue, so no job waits forever.
+		"""
+
+		lead = self.schedule.lead(now) if self.schedule is not None else None
+
+		return (NO_MATCH_LEAD if lead is None else lead) - (now - self.next_run)
+
+	def reschedule(self, result, moved, start):
+		"""Adapt the interval to a finished run which started at `start`."""
+
+		if self.schedule is None:
+			return
+		self.interval = self.schedule.update(result.rows if result is not None else None, moved)
+		self.next_run = start + self.interval
+
+	def summary(self):
+		runs = max(self.runs, 1)
+		return {
+			'runs': self.runs,
+			'skipped': self.skipped,
+			'failed': self.failed,
+			'avg_elapsed': round(self.elapsed / runs, 3),
+			'avg_overhead': round(self.overhead / runs, 3),
+			'avg_delay': round(self.delay / runs, 3),
+			'deferred': self.deferred,
+			'moved_rows': self.moved,
+			'moved_per_run': round(self.moved / runs, 2),
+		}
+
+
+class Worker:
+	"""Runs jobs on their schedule until it is stopped.
+
+	Parameters
+	----------
+	jobs : list
+		Jobs to schedule.
+	fetcher : TieredFetcher
+		Fetcher shared by all jobs, with the browser pool of the worker.
+	concurrency : int
+		Maximum number of jobs running at the same time.
+	startup : float
+		Seconds the worker took to start, logged with the overhead of every run.
+	budget : ScrapeBudget
+		Page loads of all jobs, unlimited if None.
+	recorder : RunRecorder
+		Records every run over the connection of the worker, runs are not recorded if None.
+	"""
+
+	def __init__(self, jobs, fetcher, concurrency=2, startup=0., budget=None, recorder=None):
+		self.jobs = jobs
+		self.fetcher = fetcher
+		self.startup = startup
+		self.budget = budget
+		self.recorder = recorder
+		self.executor = ThreadPoolExecutor(concurrency)
+		self._stopping = threading.Event()
+		self._wakeup = threading.Event()  # set when a job was rescheduled or the worker stops
+
+	def stop(self, signum=None, frame=None):
+		if not self._stopping.is_set():
+			logger.info('Stopping the worker%s, waiting for running jobs.', ' on signal %s' % signum if signum else '')
+		self._stopping.set()
+		self._wakeup.set()
+
+	def run(self):
+		"""Start every due job which is not running anymore while the budget lasts, until the worker
+		is stopped.
+		"""
+
+		while not self._stopping.is_set():
+			now, wait = time.time(), None
+			for job in sorted((job for job in self.jobs if job.next_run <= now), key=lambda job: job.priority(now)):
+				if job.running:
+					job.skipped += 1
+					logger.warning('Skipping a run of %s, its previous run is still running.', job.site)
+				elif self.budget is not None and not self.budget.take(now):
+					job.deferred += 1
+					wait = self.budget.wait_time(now)
+					logger.debug('Deferring a run of %s by %.1fs, the scrape budget is used up.', job.site, wait)
+					continue
+				else:
+					job.future = self.executor.submit(self.run_job, job, job.next_run)
+				while job.next_run <= now:
+					job.next_run += job.interval
+			wakeups = [job.next_run for job in self.jobs if job.next_run > now] + ([now + wait] if wait is not None else [])
+			self._wakeup.wait(max(0., min(wakeups) - time.time()))
+			self._wakeup.clear()
+
+		self.executor.shutdown(wait=True)
+
+	def run_job(self, job, scheduled):
+		start = time.time()
+		METRICS.start_run(job.site)
+		changes = getattr(job.scraper, 'changes', None)
+		moved = changes.moved if changes is not None else 0
+		result, error = None, None
+		try:
+			result = job.scraper.run(self.fetcher, job.sink)
+			if job.sink is not None:
+				job.sink.flush()  # the write of the rows belongs to the run
+		except Exception as e:
+			logger.exception('The run of %s failed.', job.site)
+			error = repr(e)
+		summary = METRICS.finish_run(job.site, result.tier if result is not None else None, error)
+
+		# odds are only compared with the last written odds if they are written
+		if changes is not None and job.sink is not None and summary['rows']:
+			moved = changes.moved - moved
+			job.moved += moved
+		else:
+			moved = None
+		job.reschedule(result, moved, start)
+		self._wakeup.set()
+
+		delay = start - scheduled
+		overhead = summary['elapsed'] - sum(summary['stages'].values())
+		job.runs += 1
+		job.failed += int(error is not None)
+		job.elapsed += summary['elapsed']
+		job.overhead += overhead
+		job.delay += delay
+		logger.info('Run %s of %s started %.3fs late and spent %.3fs of %.2fs outside of its stages, '
+					'the worker started once in %.2fs.', job.runs, job.site, delay, overhead, summary['elapsed'], self.startup)
+
+		if job.schedule is not None:
+			lead = job.schedule.lead()
+			logger.info('Next run of %s in %.0fs, %s rows moved, %s runs without movement, next match %s.', job.site,
+						job.interval, '?' if moved is None else moved, job.schedule.quiet_runs,
+						'in %.0fs' % lead if lead is not None else 'unknown')
+
+		if self.recorder is not None:
+			self.recorder.record(summary)
+		if METRICS_DIR:
+			METRICS.write_textfile(os.path.join(METRICS_DIR, 'worker.prom'))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('sites', nargs='*', help='sites to scrape, all by default: %s' % ', '.join(SITES))
+	args = parser.parse_args()
+	args.sites = args.sites or list(SITES)
+	unknown = set(args.sites) - set(SITES)
+	if unknown:
+		parser.error('unknown sites: %s' % ', '.join(sorted(unknown)))
+
+	jobs = []
+	for site in args.sites:
+		scraper, config = load_site(site)
+		sink = scraper.open_sink() if ENVIRONMENT == 'PRODUCTION' else None
+		schedule = getattr(config, 'SCHEDULE', None)
+		if schedule is not None:
+			schedule = AdaptiveSchedule(config.WORKER_INTERVAL, **schedule)
+		jobs.append(Job(site, scraper, config.WORKER_INTERVAL, sink, schedule))
+
+	# the adaptive schedules spend the page loads of the fixed intervals where odds move
+	per_hour = float(WORKER_BUDGET) if WORKER_BUDGET else sum(3600. / job.interval for job in jobs)
+	budget = ScrapeBudget(per_hour, float(WORKER_BURST) if WORKER_BURST else max(len(jobs), per_hour / 12.)) if per_hour > 0 else None
+
+	profiler = start_profiler('worker', os.environ.get('PROFILE'), os.environ.get('PROFILE_STAGES'),
+							  float(os.environ.get('PROFILE_SAMPLE', 1.)), METRICS_DIR or '.')
+	if METRICS_PORT:
+		METRICS.serve(int(METRICS_PORT))
+	archive = SnapshotArchive(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+	recorder = None
+	if ENVIRONMENT == 'PRODUCTION':
+		# the scrape_runs table is created once here, the runs are inserted over the kept connection
+		recorder = RunRecorder(jobs[0].scraper.DB_CREDENTIALS)
+		recorder.open()
+	pool = BrowserPool(size=WORKER_BROWSERS)
+	worker = Worker(jobs, TieredFetcher(pool, archive=archive), WORKER_CONCURRENCY, time.time() - START, budget, recorder)
+	signal.signal(signal.SIGTERM, worker.stop)
+	signal.signal(signal.SIGINT, worker.stop)
+	logger.info('Started a worker for %s in %.2fs with a budget of %s page loads per hour: %s', ', '.join(args.sites),
+				worker.startup, '%.0f' % budget.per_hour if budget is not None else 'unlimited',
+				', '.join('%s every %ss%s' % (job.site, job.interval, ' (adaptive)' if job.schedule else '') for job in jobs))
+
+	try:
+		worker.run()
+	finally:
+		for job in jobs:
+			if job.sink is not None:
+				job.sink.close()
+		pool.close()
+		if archive is not None:
+			archive.close()
+		if recorder is not None:
+			recorder.close()
+		if profiler is not None:
+			profiler.stop()
+		if METRICS_DIR:
+			METRICS.write_textfile(os.path.join(METRICS_DIR, 'worker.prom'))
+		for job in jobs:
+			logger.info('Worker runs of %s: %s', job.site, job.summary())
+		if budget is not None:
+			logger.info('Scrape budget: %s page loads taken, %s deferred.', budget.taken, budget.denied)
+
+
+if __name__ == '__main__':
+	main()